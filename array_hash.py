@@ -0,0 +1,22 @@
+# ---------------------------------------------------------------------------
+# array_hash.py
+#
+# Usage: imported by hydro_cache.py, merge_engine.py
+#
+#   This module hashes NumPy arrays a block of rows at a time, so a raster
+#  can be identified by its contents without copying it into one buffer.
+# ---------------------------------------------------------------------------
+
+# Start Up - Import system modules
+import numpy
+
+#===========================================================================
+#  Local Functions
+#===========================================================================
+
+def HashArray(key, array, blockrows=1024):
+    # add the bytes of array to the hash key a block of rows at a time
+    key.update(str(array.shape).encode("ascii"))
+    key.update(str(array.dtype).encode("ascii"))
+    for row0 in range(0, array.shape[0], blockrows):
+        key.update(numpy.ascontiguousarray(array[row0:row0 + blockrows]).tobytes())
@@ -2,18 +2,22 @@
 
 # A: 断面積の係数C_A (LaharZ式: A = C_A * V^(2/3))
 # B: 表面積の係数C_B (LaharZ式: B = C_B * V^(2/3))
+# label: 複数の係数セットを同時に計算するときに、結果ラスタ名 (<drainName><label><n>) に付ける短い名前 (省略時は係数セット名)
 COEFFICIENTS = {
     'Lahar': {
         "A": 0.05,
-        "B": 200
+        "B": 200,
+        "label": "lh"
     },
     'Debris_Flow': {
         "A": 0.1,
-        "B": 20
+        "B": 20,
+        "label": "df"
     },
     'Rock_Avalanche': {
         "A": 0.2,
-        "B": 20
+        "B": 20,
+        "label": "ra"
     }
 }
 
@@ -22,8 +26,8 @@ COEFFICIENTS = {
 このPythonファイルは、LaharZ実行時の係数を指定するためのものです。
 辞書の変数である"COEFFICIENTS"に、LaharZ実行に用いる係数を入力してください。
 
-現状、LaharZのツールボックスにおいて、'Lahar', 'Debris_Flow', 'Rock_Avalanche'の3つのモード名が定義されています。これらの名前は変更できず、追加もできません。
-そのため、例えば「粘着性ラハールと非粘着性ラハールそれぞれの係数を使ってLaharZを実行したい」という場合は、以下のように"COEFFICIENTS"を定義してください。
+現状、LaharZのツールボックスにおいて、'Lahar', 'Debris_Flow', 'Rock_Avalanche'の3つのモード名が定義されています。ツールボックスで選べるのはこれらの名前だけです。
+そのため、ツールボックスから1つずつ実行する場合、例えば「粘着性ラハールと非粘着性ラハールそれぞれの係数を使ってLaharZを実行したい」という場合は、以下のように"COEFFICIENTS"を定義してください。
 
 COEFFICIENTS = {
     'Lahar': { # 粘着性ラハールの係数
@@ -35,4 +39,29 @@ COEFFICIENTS = {
         "B": 200    # 例
     }
 }
-"""
\ No newline at end of file
+
+係数セットの名前は自由に付けられ、いくつでも追加できます (ツールボックスから1つずつ選べるのは上の3つの名前だけです)。
+複数の係数セットを比べる場合は、run_setting.pyのDISTAL_COEFFICIENT_SETSに係数セット名の一覧を指定するか、
+コマンドラインでdistal_inundationの6番目の引数に「;」で区切った係数セット名を指定してください。
+河道を一度たどるだけで、すべての係数セットとすべての体積の組み合わせを計算し、係数セットごとに結果ラスタ
+<drainName><label><n> と.ptsファイルの列を出力します。"label"は短く、係数セットごとに異なる名前にしてください。
+フォルダの作業領域ではESRI GRIDの名前は13文字までなので、<drainName><label><n>が13文字を超える場合は、河道をたどる前にエラーになります。
+
+COEFFICIENTS = {
+    'Cohesive_Lahar': {
+        "A": 0.329, # 例
+        "B": 154,   # 例
+        "label": "coh"
+    },
+    'Intermediate_Lahar': {
+        "A": 0.253, # 例
+        "B": 129,   # 例
+        "label": "int"
+    },
+    'Noncohesive_Lahar': {
+        "A": 0.051, # 例
+        "B": 200,   # 例
+        "label": "non"
+    }
+}
+"""
@@ -7,7 +7,8 @@
 #   sys.argv[3] name of the output .pts file (drainName)
 #   sys.argv[4] text file storing the volumes
 #   sys.argv[5] text file storing coordinates to start runs
-#   sys.argv[6] flowType (lahar, debris_flow, rock_avalanche)
+#   sys.argv[6] flowType (lahar, debris_flow, rock_avalanche), or names of
+#               coefficient sets of coefficient_setting.py separated by ";"
 #
 #
 #   This program creates an estimate of area of potential inundation by a hypothetical
@@ -15,19 +16,35 @@
 #  volume.  The width and length of the planimetric area is governed by the
 #  cross sections calculated, centered at a stream cell.  The calculations are controlled
 #  by elevation values of cells from an input surface raster (DEM)
+#   Several coefficient sets (sys.argv[6] or DISTAL_COEFFICIENT_SETS in
+#  run_setting.py) are evaluated in one traversal of each stream: every set
+#  has its own grid <drainName><label><n> and its own columns in the .pts
+#  file, and the cross sections of all sets are computed in one walk.
+#  A non-empty DISTAL_COEFFICIENT_SETS takes the place of the flowType
+#  selected in the toolbox, and a warning names the ignored choice.
 #
 # ---------------------------------------------------------------------------
 
 # Start Up - Import system modules
 import sys, string, os, arcpy, math, time, importlib
+import numpy
 from arcpy import env
 from arcpy.sa import *
 from math import *
 import coefficient_setting
+import run_setting
+from run_metrics import RunMetrics, CalcTime
+from progress_report import MakeReporter, VERBOSE, DEBUG
+from scratch_store import ScratchStore
+from flow_paths import FlowPaths, TraversalLengths, DrainsThrough
+from native_hydro import D8_CODES, DIR_NODATA
 
 # Check out license
 arcpy.CheckOutExtension("Spatial")
 
+# longest name of an ESRI GRID, the raster format of a folder workspace
+GRID_NAME_LIMIT = 13
+
 
 def LoadCoefficients():
     # coefficient_setting.py を毎回読み直して、ArcGIS セッション中の変更も反映する
@@ -36,6 +53,44 @@ def LoadCoefficients():
     selectable_flowtypes = coefficients.keys()
     return coefficients, selectable_flowtypes
 
+def CoefficientSets(coefficients, names, drainName="", numruns=1, namelimit=None):
+    # =====================================
+    # Parameters:
+    #   coefficients:  COEFFICIENTS of coefficient_setting.py
+    #   names:  names of the coefficient sets evaluated together
+    #   drainName:  drainage identifier starting the output grid names
+    #   numruns:  number of runs (start points), the last number of
+    #             the output grid names
+    #   namelimit:  longest output grid name allowed, None for no limit
+    #
+    # Returns:  list of dictionaries name, label (added to the names of
+    #           the output grids; the set name if it has no "label"), A, B
+    # =====================================
+
+    sets = []
+    for name in names:
+        if name not in coefficients:
+            raise ValueError("Coefficient set '" + str(name) + "' is not in coefficient_setting.COEFFICIENTS (" +
+                             ", ".join(coefficients) + ")")
+        entry = coefficients[name]
+        if "A" not in entry or "B" not in entry:
+            raise ValueError("Coefficient set '" + str(name) + "' needs both \"A\" and \"B\"")
+        label = str(entry.get("label", name))
+        for other in sets:
+            if other["label"] == label:
+                raise ValueError("Coefficient sets '" + other["name"] + "' and '" + str(name) + "' have the same label '" + label + "'")
+        gridname = str(drainName) + label + str(numruns)    # longest output grid name of the set
+        if namelimit is not None and len(gridname) > namelimit:
+            raise ValueError("Output grid '" + gridname + "' of coefficient set '" + str(name) + "' is longer than " +
+                             str(namelimit) + " characters; give the set a shorter \"label\" in coefficient_setting.py")
+        sets.append({"name": name, "label": label, "A": entry["A"], "B": entry["B"]})
+    return sets
+
+def LoadSettings():
+    # run_setting.py を毎回読み直して、ArcGIS セッション中の変更も反映する
+    importlib.reload(run_setting)
+    return run_setting.SETTINGS
+
 #===========================================================================
 #  Local Functions
 #===========================================================================
@@ -85,30 +140,6 @@ def ConvertTxtToList(atxtfilename,alist,dattype,conflim):
 
     return alist
 
-def CalcTime(tottime):
-    # =====================================
-    # Parameters:
-    #   tottime:  result of subtracting a start time from an
-    #             end time
-    #
-    # Calculates the hours, minutes, seconds from a total
-    # number of seconds.
-    #
-    # Returns:  string of hours, minutes, seconds
-    # =====================================
-
-    timehr = 0
-    timemin = round(tottime /60)
-    timesec = tottime - (timemin * 60)
-    if timemin > 60:
-        timehr = round(timemin/60)
-    if timehr > 0:
-        timemin = timemin - (timehr * 60)
-    if timehr > 0:
-        return str(timehr) + " hrs, " + str(timemin) + " mins, " + str(timesec) + " secs."
-    else:
-        return str(timemin) + " mins, " + str(timesec) + " secs."
-
 def CalcArea(invollist,coeff,areaoutlist):
     # =====================================
     # Parameters:
@@ -511,6 +542,7 @@ def WriteHeader(headr):
     volumeList=headr['volumeList']
     masterXsectList=headr['masterXsectList']
     masterPlanList=headr['masterPlanList']
+    coefficientSets=headr.get('coefficientSets', [])  # sets of a run of several sets
    
 
     outfile = open(ptsfilename, "a", encoding="utf_8_sig")
@@ -526,6 +558,19 @@ def WriteHeader(headr):
     outfile.write(outstrvolumeList)
     outfile.write("_________________________________________________________"+ "\n")
     outfile.write("")
+    for aset in coefficientSets:
+        outfile.write("COEFFICIENT SET " + str(aset['name']) + " (A: " + str(aset['A']) + ", B: " + str(aset['B']) + ")" + "\n")
+        outfile.write('CROSS SECTION AREAS :'+ "\n")
+        outfile.write(' : '.join([str(v) for v in aset['masterXsect']]) + "\n")
+        outfile.write('PLANIMETRIC AREAS :'+ "\n")
+        outfile.write(' : '.join([str(v) for v in aset['masterPlan']]) + "\n")
+    if coefficientSets:
+        outfile.write("_________________________________________________________"+ "\n")
+        outfile.write("DECREASING PLANIMETRIC AREAS LISTED BELOW, ONE COLUMN PER SET AND VOLUME"+ "\n")
+        outfile.write("('-' AFTER THE SET HAS STOPPED OR THE VOLUME HAS BEEN DROPPED)"+ "\n")
+        outfile.write(', '.join([str(aset['name']) + " " + str(v) for aset in coefficientSets for v in volumeList]) + "\n")
+        outfile.write("_________________________________________________________"+ "\n")
+        return
     outfile.write('CROSS SECTION AREAS :'+ "\n")
     for i in range(len(masterXsectList)):
         if i+1 == len(masterXsectList):
@@ -679,7 +724,31 @@ def Check4Pop(currxarea):
         currlength -= 1
     return currxarea
 
-def CalcCrossSection(sectn,currFlowDir,currRow,currCol,planvals,xsectAreaList,B):
+def SubtractSectionArea(currxareas,walking,area):
+    # =====================================
+    # Parameters:
+    #   currxareas:  remaining section areas of every coefficient set
+    #   walking:     True for the sets still walking the section
+    #   area:        area taken by the cell just reached
+    #
+    # Subtracts area from the section areas of the walking sets and pops
+    # the negative ones (Check4Pop); a set whose largest area is used up
+    # stops walking
+    #
+    # Returns:  True if a set is still walking
+    # =====================================
+
+    for k in range(len(currxareas)):
+        if walking[k]:
+            currxarea = currxareas[k]
+            for i in range(len(currxarea)):
+                currxarea[i] = currxarea[i] - area
+            currxareas[k] = Check4Pop(currxarea)
+            if currxareas[k][0] <= 0:
+                walking[k] = False
+    return any(walking)
+
+def CalcCrossSectionSets(sectn,currFlowDir,currRow,currCol,runs):
 
     # =====================================
     # Parameters:
@@ -687,7 +756,8 @@ def CalcCrossSection(sectn,currFlowDir,currRow,currCol,planvals,xsectAreaList,B)
     #   currRow:  row of the current cell
     #   currCol:  column of the current cell
     #   wXmax,wXmin,wYmax,wYmin:  boundaries of DEM array
-    #   planvals:  starts as a list of 0's; one for each planimetric area
+    #   runs:  list of [planvals, xsectAreaList, B] of every coefficient set
+    #          evaluated; planvals and B are updated in place
     #
     # Calculates cross sections for a single stream cell
     # sets variables including whether direction is ordinal or diagonal,
@@ -706,8 +776,10 @@ def CalcCrossSection(sectn,currFlowDir,currRow,currCol,planvals,xsectAreaList,B)
     # cells. If elevation is 99999 stops CalcCrossSection
     # If currxarea is a list longer than 1, check each of the section areas to see if it
     # is a negative value.  If so, delete (pop) item from list
-    #
-    # Returns:  planvals, B
+    # The cells a section walks through depend on the elevations only, so
+    # the coefficient sets share one walk: each set subtracts from its own
+    # section areas, labels its own B array, and drops out of the walk
+    # when its largest area is used up, as it would alone
     # =====================================
 
     # Get sectn dictionary values
@@ -718,11 +790,17 @@ def CalcCrossSection(sectn,currFlowDir,currRow,currCol,planvals,xsectAreaList,B)
     cellDiagonal=sectn['cellDiagonal']
     cellWidth=sectn['cellWidth']
     A=sectn['A']
+    sectn['xsectcount'] = sectn.get('xsectcount', 0) + 1  # number of cross sections computed
 
 
-    currxarea = []
+    currxareas = []
+    walking = []
+    for run in runs:
+        currxarea = []
+        currxarea.extend(run[1]) # make a copy"
+        currxareas.append(currxarea)
+        walking.append(True)
     count = 0
-    currxarea.extend(xsectAreaList) # make a copy"
 
 
     #=============================================
@@ -799,7 +877,10 @@ def CalcCrossSection(sectn,currFlowDir,currRow,currCol,planvals,xsectAreaList,B)
 
     while count < 1000000000:
 
-        if currxarea[0] < 0:
+        for k in range(len(runs)):
+            if walking[k] and currxareas[k][0] < 0:
+                walking[k] = False
+        if not any(walking):
             break
         #=============================================
         # compare elevations equal to fill level
@@ -809,11 +890,15 @@ def CalcCrossSection(sectn,currFlowDir,currRow,currCol,planvals,xsectAreaList,B)
 
             if cellleftelev == filllevel:
 
-                planvals,B = AppendCurrPointToPointArrays(cellleftx,celllefty,currxarea,planvals,B)
+                for k in range(len(runs)):
+                    if walking[k]:
+                        AppendCurrPointToPointArrays(cellleftx,celllefty,currxareas[k],runs[k][0],runs[k][2])
                 cellleftx,celllefty,cellleftelev = GetNextSectionCell(cellleftx,celllefty,cellleftelev,cellnorm,currFlowDir,wXmax,wXmin,wYmax,wYmin,A)
             else: #cellrightelev = filllevel
 
-                planvals,B = AppendCurrPointToPointArrays(cellrightx,cellrighty,currxarea,planvals,B)
+                for k in range(len(runs)):
+                    if walking[k]:
+                        AppendCurrPointToPointArrays(cellrightx,cellrighty,currxareas[k],runs[k][0],runs[k][2])
                 cellrightx,cellrighty,cellrightelev = GetNextSectionCell(cellrightx,cellrighty,cellrightelev,cellwneg,currFlowDir,wXmax,wXmin,wYmax,wYmin,A)
             cellcount += 1
 
@@ -825,21 +910,17 @@ def CalcCrossSection(sectn,currFlowDir,currRow,currCol,planvals,xsectAreaList,B)
 
             if cellrightelev < filllevel:
 
-                for i in range(len(currxarea)):
-                    currxarea[i] = currxarea[i] - ((filllevel - cellrightelev) * cellDimen)
-
-                currxarea = Check4Pop(currxarea)
-                if currxarea[0] > 0:
-                    planvals,B = AppendCurrPointToPointArrays(cellrightx,cellrighty,currxarea,planvals,B)
+                if SubtractSectionArea(currxareas,walking,(filllevel - cellrightelev) * cellDimen):
+                    for k in range(len(runs)):
+                        if walking[k]:
+                            AppendCurrPointToPointArrays(cellrightx,cellrighty,currxareas[k],runs[k][0],runs[k][2])
                     cellrightx,cellrighty,cellrightelev = GetNextSectionCell(cellrightx,cellrighty,cellrightelev,cellwneg,currFlowDir,wXmax,wXmin,wYmax,wYmin,A)
 
             else: # cellleftelev < filllevel
-                for i in range(len(currxarea)):
-                    currxarea[i] = currxarea[i] - ((filllevel - cellleftelev) * cellDimen)
-
-                currxarea = Check4Pop(currxarea)
-                if currxarea[0] > 0:
-                    planvals,B = AppendCurrPointToPointArrays(cellleftx,celllefty,currxarea,planvals,B)
+                if SubtractSectionArea(currxareas,walking,(filllevel - cellleftelev) * cellDimen):
+                    for k in range(len(runs)):
+                        if walking[k]:
+                            AppendCurrPointToPointArrays(cellleftx,celllefty,currxareas[k],runs[k][0],runs[k][2])
                     cellleftx,celllefty,cellleftelev = GetNextSectionCell(cellleftx,celllefty,cellleftelev,cellnorm,currFlowDir,wXmax,wXmin,wYmax,wYmin,A)
             cellcount += 1
 
@@ -848,18 +929,18 @@ def CalcCrossSection(sectn,currFlowDir,currRow,currCol,planvals,xsectAreaList,B)
         #=============================================
 
         elif cellrightelev == cellleftelev:
-            for i in range(len(currxarea)):
-                currxarea[i] = currxarea[i] - ((cellrightelev - filllevel) * (cellDimen * cellcount))
-
-            currxarea = Check4Pop(currxarea)
-            if currxarea[0] > 0:
+            if SubtractSectionArea(currxareas,walking,(cellrightelev - filllevel) * (cellDimen * cellcount)):
                 filllevel = cellrightelev
                 #=============================================
                 # move left and right
                 #=============================================
-                planvals,B = AppendCurrPointToPointArrays(cellleftx,celllefty,currxarea,planvals,B)
+                for k in range(len(runs)):
+                    if walking[k]:
+                        AppendCurrPointToPointArrays(cellleftx,celllefty,currxareas[k],runs[k][0],runs[k][2])
                 cellleftx,celllefty,cellleftelev = GetNextSectionCell(cellleftx,celllefty,cellleftelev,cellnorm,currFlowDir,wXmax,wXmin,wYmax,wYmin,A)
-                planvals,B = AppendCurrPointToPointArrays(cellrightx,cellrighty,currxarea,planvals,B)
+                for k in range(len(runs)):
+                    if walking[k]:
+                        AppendCurrPointToPointArrays(cellrightx,cellrighty,currxareas[k],runs[k][0],runs[k][2])
                 cellrightx,cellrighty,cellrightelev = GetNextSectionCell(cellrightx,cellrighty,cellrightelev,cellwneg,currFlowDir,wXmax,wXmin,wYmax,wYmin,A)
                 cellcount = cellcount + 2
 
@@ -870,23 +951,18 @@ def CalcCrossSection(sectn,currFlowDir,currRow,currCol,planvals,xsectAreaList,B)
         elif cellrightelev > cellleftelev or cellrightelev < cellleftelev:
             if cellrightelev > cellleftelev:
 
-                for i in range(len(currxarea)):
-                    currxarea[i] = currxarea[i] - ((cellleftelev - filllevel) * (cellDimen * cellcount))
-
-                currxarea = Check4Pop(currxarea)
-                if currxarea[0] > 0:
+                if SubtractSectionArea(currxareas,walking,(cellleftelev - filllevel) * (cellDimen * cellcount)):
                     filllevel = cellleftelev
-                    planvals,B = AppendCurrPointToPointArrays(cellleftx,celllefty,currxarea,planvals,B)
+                    for k in range(len(runs)):
+                        if walking[k]:
+                            AppendCurrPointToPointArrays(cellleftx,celllefty,currxareas[k],runs[k][0],runs[k][2])
                     cellleftx,celllefty,cellleftelev = GetNextSectionCell(cellleftx,celllefty,cellleftelev,cellnorm,currFlowDir,wXmax,wXmin,wYmax,wYmin,A)
             else: # cellleftelev > cellrightelev
-                for i in range(len(currxarea)):
-                    currxarea[i] = currxarea[i] - ((cellrightelev - filllevel) * (cellDimen * cellcount))
-
-                currxarea = Check4Pop(currxarea)
-
-                if currxarea[0] > 0:
+                if SubtractSectionArea(currxareas,walking,(cellrightelev - filllevel) * (cellDimen * cellcount)):
                     filllevel = cellrightelev
-                    planvals,B = AppendCurrPointToPointArrays(cellrightx,cellrighty,currxarea,planvals,B)
+                    for k in range(len(runs)):
+                        if walking[k]:
+                            AppendCurrPointToPointArrays(cellrightx,cellrighty,currxareas[k],runs[k][0],runs[k][2])
                     cellrightx,cellrighty,cellrightelev = GetNextSectionCell(cellrightx,cellrighty,cellrightelev,cellwneg,currFlowDir,wXmax,wXmin,wYmax,wYmin,A)
             cellcount += 1
 
@@ -894,8 +970,9 @@ def CalcCrossSection(sectn,currFlowDir,currRow,currCol,planvals,xsectAreaList,B)
         # hit an edge
         #=============================================
         if cellleftelev == 99999.0 or cellrightelev == 99999.0:
-            for i in range(len(currxarea)):
-                currxarea[i] = -99999
+            for currxarea in currxareas:
+                for i in range(len(currxarea)):
+                    currxarea[i] = -99999
 
         #=============================================
         # update count of time through the MAIN LOOP
@@ -903,6 +980,15 @@ def CalcCrossSection(sectn,currFlowDir,currRow,currCol,planvals,xsectAreaList,B)
         #=============================================
         count += 1
 
+def CalcCrossSection(sectn,currFlowDir,currRow,currCol,planvals,xsectAreaList,B):
+    # =====================================
+    # Calculates cross sections for a single stream cell and a single
+    # coefficient set (see CalcCrossSectionSets)
+    #
+    # Returns:  planvals, B
+    # =====================================
+
+    CalcCrossSectionSets(sectn,currFlowDir,currRow,currCol,[[planvals,xsectAreaList,B]])
     return planvals,B
 
 #=============================================
@@ -913,19 +999,37 @@ def CalcCrossSection(sectn,currFlowDir,currRow,currCol,planvals,xsectAreaList,B)
 def main(workspace, Input_surface_raster, drainName, volumeTextFile, coordsTextFile, flowType):
 
     COEFFICIENTS, SELECTABLEFLOWTYPES = LoadCoefficients()
+    SETTINGS = LoadSettings()
+    progress = MakeReporter(SETTINGS) # rate limited messages for the traversal loop
 
-    for i in [1]:
+    scratch = None   # scratch store of this run, removed also when the run fails
+    try:
         #===========================================================================
         # Assign user inputs from menu to appropriate variables
         #===========================================================================
-        starttimetot = time.process_time() # calculate time for program run
+        metrics = RunMetrics("distal_inundation") # wall/cpu time of stages and counters
         tottime = 0.0
         arcpy.AddMessage("Parsing user inputs:")
 
         arcpy.env.workspace=workspace
 
+        # coefficient sets evaluated together in one traversal, if any
+        coefficientNames = list(SETTINGS.get("DISTAL_COEFFICIENT_SETS", []))
+        if coefficientNames and flowType not in ("", "#"):
+            arcpy.AddWarning("DISTAL_COEFFICIENT_SETS of run_setting.py is set, the selected flow type "
+                             + str(flowType) + " is ignored")
+        if not coefficientNames and ";" in flowType:
+            coefficientNames = [name.strip().strip("'") for name in flowType.split(";") if name.strip()]
+        namelimit = GRID_NAME_LIMIT         # output grids of a folder workspace are ESRI GRIDs
+        if os.path.splitext(workspace.rstrip("\\/"))[1].lower() in (".gdb", ".mdb", ".sde"):
+            namelimit = None
+        coefficientSets = CoefficientSets(COEFFICIENTS, coefficientNames, drainName, 1, namelimit)
+
         # if flowType == 'Lahar' or flowType == 'Debris_Flow' or flowType == 'Rock_Avalanche':
-        if flowType in SELECTABLEFLOWTYPES:
+        if coefficientSets:
+            conflim = False
+            arcpy.AddMessage("Running Laharz_py with " + str(len(coefficientSets)) + " coefficient sets")
+        elif flowType in SELECTABLEFLOWTYPES:
             flowType = flowType          # lahar, debris flow, rock avalanche
             conflim = False
             arcpy.AddMessage("Running Laharz_py")
@@ -956,6 +1060,10 @@ def main(workspace, Input_surface_raster, drainName, volumeTextFile, coordsTextF
             # =====================================
             flowType = 'Lahar'
             arcpy.AddMessage("Flow Type is Lahar")
+        elif coefficientSets:
+            for aset in coefficientSets:
+                arcpy.AddMessage(f"{str(aset['name']).replace('_', ' ')} Selected (grids {drainName}{aset['label']}<n>)")
+                arcpy.AddMessage(COEFFICIENTS[aset['name']])
         else:
             if flowType in SELECTABLEFLOWTYPES:
                 arcpy.AddMessage(f"{str(flowType).replace('_', ' ')} Selected")
@@ -965,7 +1073,8 @@ def main(workspace, Input_surface_raster, drainName, volumeTextFile, coordsTextF
         #=============================================
         # Set the ArcGIS environment settings
         #=============================================
-        env.scratchWorkspace = env.workspace
+        scratch = ScratchStore(env.workspace, "distal_inundation", SETTINGS.get("SCRATCH_MEMORY_MB", 1024)) # intermediates of this run
+        env.scratchWorkspace = scratch.folder()
         env.extent = Input_surface_raster
         env.snapRaster = Input_surface_raster
         currentPath = env.workspace
@@ -1028,6 +1137,7 @@ def main(workspace, Input_surface_raster, drainName, volumeTextFile, coordsTextF
         #  get row, column values for boundaries
         # =====================================
         arcpy.AddMessage("_________ Creating DEM Array _________")
+        metrics.start("read_inputs")
         A = arcpy.RasterToNumPyArray(fillname)
 
         # =====================================
@@ -1080,6 +1190,9 @@ def main(workspace, Input_surface_raster, drainName, volumeTextFile, coordsTextF
         arcpy.AddMessage("Number of start points parsed: " + str(numstartpts))
         if numstartpts == 0:
             arcpy.AddWarning("No start points were parsed from '" + coordsTextFile + "'. Subsequent processing will fail.")
+        if coefficientSets:
+            # grid names of the last run, checked before any run is traversed
+            CoefficientSets(COEFFICIENTS, coefficientNames, drainName, numstartpts, namelimit)
 
         # =====================================
         # call CalcArea function with parameters of list of volumes,
@@ -1097,7 +1210,10 @@ def main(workspace, Input_surface_raster, drainName, volumeTextFile, coordsTextF
         # if flowType == 'Rock_Avalanche':
         #     xsectAreaList = CalcArea(volumeList,0.2,xsectAreaList)
         #     planAreaList = CalcArea(volumeList,20,planAreaList)
-        if flowType in SELECTABLEFLOWTYPES:
+        if coefficientSets:
+            xsectAreaList = CalcArea(volumeList,coefficientSets[0]["A"],xsectAreaList)
+            planAreaList = CalcArea(volumeList,coefficientSets[0]["B"],planAreaList)
+        elif flowType in SELECTABLEFLOWTYPES:
             xsectAreaList = CalcArea(volumeList,COEFFICIENTS[flowType]["A"],xsectAreaList)
             planAreaList = CalcArea(volumeList,COEFFICIENTS[flowType]["B"],planAreaList)
 
@@ -1136,6 +1252,20 @@ def main(workspace, Input_surface_raster, drainName, volumeTextFile, coordsTextF
         masterXsectList.extend(xsectAreaList)# master copy of cross section areas
         masterVolumeList.extend(volumeList)  # master copy of volumes
 
+        # =====================================
+        # the areas of every coefficient set evaluated in the traversal;
+        # a single set keeps the names and .pts layout of a plain run
+        # =====================================
+        if coefficientSets:
+            for aset in coefficientSets:
+                aset['masterXsect'] = CalcArea(masterVolumeList,aset["A"],[])  # large to small
+                aset['masterPlan'] = CalcArea(masterVolumeList,aset["B"],[])
+                arcpy.AddMessage(str(aset['name']) + " Cross Section Area List is: " + str(aset['masterXsect']))
+                arcpy.AddMessage(str(aset['name']) + " Planimetric Area List is: " + str(aset['masterPlan']))
+            runs = coefficientSets
+        else:
+            runs = [{'name': flowType, 'label': "", 'masterXsect': masterXsectList, 'masterPlan': masterPlanList}]
+
 
 
         # =====================================
@@ -1163,6 +1293,8 @@ def main(workspace, Input_surface_raster, drainName, volumeTextFile, coordsTextF
         dem_desc = arcpy.Describe(Input_surface_raster)
         dem_extent = dem_desc.extent
 
+        metrics.stop("read_inputs")
+        metrics.start("start_points")
         startCoordsList = []
         out_of_extent = []
         for b in range(len(xstartpoints)):
@@ -1182,13 +1314,7 @@ def main(workspace, Input_surface_raster, drainName, volumeTextFile, coordsTextF
         if len(startCoordsList) == 0:
             raise RuntimeError("No valid start points found after parsing '" + coordsTextFile + "'. Aborting before ExtractByPoints.")
 
-        arcpy.AddMessage("_________ Creating startpts_g (GeoTIFF) _________")
-
-        startpts_raster_name = "startpts_g.tif"
-        startpts_raster_path = os.path.join(currentPath, startpts_raster_name)
-
-        if arcpy.Exists(startpts_raster_path):
-            arcpy.Delete_management(startpts_raster_path) # delete existing startpts_g
+        arcpy.AddMessage("_________ Creating startpts_g _________")
 
         # =====================================
         # Use cell locations of startCoordsList to create a
@@ -1214,15 +1340,16 @@ def main(workspace, Input_surface_raster, drainName, volumeTextFile, coordsTextF
             raise RuntimeError("ExtractByPoints produced an empty raster (all NoData). Check start point coordinates and coordinate system.")
 
         isnull_result = IsNull(tmpStartPoints)  # type: ignore[name-defined]
-        isnull_result.save(startpts_raster_path) # create startpts_g having values of 0 and 1
 
 
         # =====================================
-        #    Convert startpts_g grid to NumPyArray
+        #    Convert startpts_g grid to NumPyArray,
+        #    kept in the scratch store instead of startpts_g.tif
         # =====================================
 
         arcpy.AddMessage("_________ Creating Starting Points Array _________")
-        B = arcpy.RasterToNumPyArray(startpts_raster_path)
+        B = scratch.put("startpts_g", arcpy.RasterToNumPyArray(isnull_result)) # startpts_g having values of 0 and 1
+        del isnull_result, tmpStartPoints
 
         # =====================================
         #    Convert flow direction grid to NumPyArray
@@ -1230,6 +1357,7 @@ def main(workspace, Input_surface_raster, drainName, volumeTextFile, coordsTextF
 
         arcpy.AddMessage("_________ Creating Flow Direction Array _________")
         C = arcpy.RasterToNumPyArray(Input_direction_raster)
+        metrics.stop("start_points")
 
         # =====================================
         #    Get row, column of all starting cells
@@ -1245,7 +1373,7 @@ def main(workspace, Input_surface_raster, drainName, volumeTextFile, coordsTextF
         while j < number_rows:
             for i in range(number_cols):
                if B[j,i] == 0:
-                  arcpy.AddMessage('Found the zero : '+ str(A[j,i]))
+                  progress.message('Found the zero : '+ str(A[j,i]), VERBOSE)
                   FoundX = j
                   FoundY = i
                   foundPt.append(j)
@@ -1260,6 +1388,32 @@ def main(workspace, Input_surface_raster, drainName, volumeTextFile, coordsTextF
             currCol = aStartPoint[1] #startY
             B[currRow,currCol] = 1 # Remove the 0's, entire array completely 1's
 
+        # one array of labels per coefficient set
+        runs[0]['labels'] = B
+        for k in range(1, len(runs)):
+            runs[k]['labels'] = scratch.put("startpts_g_" + str(k), B.copy())
+
+        # =====================================
+        #    Optional estimates of the traversal lengths from the
+        #    downstream paths of all cells at once (flow_paths.py)
+        # =====================================
+        maxTraverse = [None] * len(zerosCoordsList)
+        if SETTINGS.get("FLOW_PATH_ESTIMATES", False) and len(zerosCoordsList) > 0:
+            metrics.start("flow_paths")
+            codes = numpy.where(numpy.isin(C, D8_CODES), C, DIR_NODATA).astype(numpy.uint8)
+            paths = FlowPaths(codes, cellWidth)
+            startcells = numpy.array([pt[0] * number_cols + pt[1] for pt in zerosCoordsList], dtype=numpy.int64)
+            maxTraverse = [int(n) for n in TraversalLengths(paths, startcells)]
+            for r in range(len(startcells)):
+                arcpy.AddMessage("  run " + str(r + 1) + ": at most " + str(maxTraverse[r]) + " cells, " +
+                                 str(round(float(paths["distance"][startcells[r]]), 1)) + " map units to the end of its flow path")
+                below = numpy.flatnonzero(DrainsThrough(paths, numpy.full(len(startcells), startcells[r]), startcells))
+                for q in below:
+                    if q != r:
+                        arcpy.AddMessage("    drains through the start point of run " + str(q + 1))
+            del paths, codes
+            metrics.stop("flow_paths")
+
         mergeList = []
         # =====================================
         #    Begin loop for list of rows, columns
@@ -1280,21 +1434,24 @@ def main(workspace, Input_surface_raster, drainName, volumeTextFile, coordsTextF
             str_xsectAreaList = []
             str_planAreaList = []
 
-            xsectAreaList = []
-            xsectAreaList.extend(masterXsectList)
+            volumeList = []
+            volumeList.extend(masterVolumeList)
 
-            planAreaList = []
-            planAreaList.extend(masterPlanList)
+            for run in runs:
+                run['xsect'] = []
+                run['xsect'].extend(run['masterXsect'])
 
-            checkPlanExtent = []
-            checkPlanExtent.extend(masterPlanList) # make copy of planAreaList
+                run['plan'] = []
+                run['plan'].extend(run['masterPlan'])
 
-            volumeList = []
-            volumeList.extend(masterVolumeList)
+                run['check'] = []
+                run['check'].extend(run['masterPlan']) # make copy of planAreaList
 
-            planvals = []
-            for m in range(len(checkPlanExtent)):
-                planvals.append(0)
+                run['planvals'] = []
+                for m in range(len(run['check'])):
+                    run['planvals'].append(0)
+                run['alive'] = True     # the set is still being evaluated
+                run['cells'] = 0        # cells traversed when the set stopped
 
             # =====================================
             #  Load a row, column
@@ -1306,7 +1463,7 @@ def main(workspace, Input_surface_raster, drainName, volumeTextFile, coordsTextF
             currCol = aStartPoint[1] #startY
 
             currFlowDir = C[currRow,currCol]
-            arcpy.AddMessage("Current flow direction:  " + str(currFlowDir))
+            progress.message("Current flow direction:  " + str(currFlowDir), VERBOSE)
 
 
             # =====================================
@@ -1333,6 +1490,8 @@ def main(workspace, Input_surface_raster, drainName, volumeTextFile, coordsTextF
             headr['volumeList']= volumeList
             headr['masterXsectList']=masterXsectList
             headr['masterPlanList']=masterPlanList 
+            if coefficientSets:
+                headr['coefficientSets']=coefficientSets
         
             #WriteHeader(drainName,ptsfilename,volumeList,masterXsectList,masterPlanList)
             WriteHeader(headr)  
@@ -1345,23 +1504,28 @@ def main(workspace, Input_surface_raster, drainName, volumeTextFile, coordsTextF
             sectn['cellDiagonal']=cellDiagonal
             sectn['cellWidth']=cellWidth
             sectn['A']=A
+            sectn['xsectcount']=0
 
-
-
+            traverseLabel = " NUMBER OF STREAM CELLS TRAVERSED (run " + str(blcount) + ")"  # progress label of this run
+            metrics.start("traverse")
             while not allStop:
                 # =====================================
                 #  just in case of problems
                 # =====================================
                 if cellTraverseCount > 90000000:
                     break
-                
+
+                # the sets still running share the cross sections
+                active = [run for run in runs if run['alive']]
+                sections = [[run['planvals'], run['xsect'], run['labels']] for run in active]
+
                 # ===========================================
                 #  Create cross sections in directions other
                 #  than the direction of stream flow
                 # ===========================================
 
                 #arcpy.AddMessage("First cross section")
-                planvals,B = CalcCrossSection(sectn,currFlowDir,currRow,currCol,planvals,xsectAreaList,B)
+                CalcCrossSectionSets(sectn,currFlowDir,currRow,currCol,sections)
 
                 # ===========================================
                 #  Store current flow direction,
@@ -1375,76 +1539,76 @@ def main(workspace, Input_surface_raster, drainName, volumeTextFile, coordsTextF
                     currFlowDir = 16
                     # 1 of 2 Cardinal flow directions
                     #arcpy.AddMessage("Second cross section - ordinal")
-                    planvals,B = CalcCrossSection(sectn,currFlowDir,currRow,currCol,planvals,xsectAreaList,B)
+                    CalcCrossSectionSets(sectn,currFlowDir,currRow,currCol,sections)
                     currFlowDir = 64
                     # 2 of 2 Cardinal flow directions
                     #arcpy.AddMessage("Third cross section - ordinal")
-                    planvals,B = CalcCrossSection(sectn,currFlowDir,currRow,currCol,planvals,xsectAreaList,B)
+                    CalcCrossSectionSets(sectn,currFlowDir,currRow,currCol,sections)
                 if currFlowDir == 128:
                     currFlowDir = 64
                     # 1 of 2 Cardinal flow directions
                     #arcpy.AddMessage("Second cross section - ordinal")
-                    planvals,B = CalcCrossSection(sectn,currFlowDir,currRow,currCol,planvals,xsectAreaList,B)
+                    CalcCrossSectionSets(sectn,currFlowDir,currRow,currCol,sections)
                     currFlowDir = 1
                     # 2 of 2 Cardinal flow directions
                     #arcpy.AddMessage("Third cross section - ordinal")
-                    planvals,B = CalcCrossSection(sectn,currFlowDir,currRow,currCol,planvals,xsectAreaList,B)
+                    CalcCrossSectionSets(sectn,currFlowDir,currRow,currCol,sections)
                 if currFlowDir == 2:
                     currFlowDir = 1
                     # 1 of 2 Cardinal flow directions
                     #arcpy.AddMessage("Second cross section - ordinal")
-                    planvals,B = CalcCrossSection(sectn,currFlowDir,currRow,currCol,planvals,xsectAreaList,B)
+                    CalcCrossSectionSets(sectn,currFlowDir,currRow,currCol,sections)
                     currFlowDir = 4
                     # 2 of 2 Cardinal flow directions
                     #arcpy.AddMessage("Third cross section - ordinal")
-                    planvals,B = CalcCrossSection(sectn,currFlowDir,currRow,currCol,planvals,xsectAreaList,B)
+                    CalcCrossSectionSets(sectn,currFlowDir,currRow,currCol,sections)
                 if currFlowDir == 8:
                     currFlowDir = 4
                     # 1 of 2 Cardinal flow directions
                     #arcpy.AddMessage("Second cross section - ordinal")
-                    planvals,B = CalcCrossSection(sectn,currFlowDir,currRow,currCol,planvals,xsectAreaList,B)
+                    CalcCrossSectionSets(sectn,currFlowDir,currRow,currCol,sections)
                     currFlowDir = 16
                     # 2 of 2 Cardinal flow directions
                     #arcpy.AddMessage("Third cross section - ordinal")
-                    planvals,B = CalcCrossSection(sectn,currFlowDir,currRow,currCol,planvals,xsectAreaList,B)
+                    CalcCrossSectionSets(sectn,currFlowDir,currRow,currCol,sections)
 
                 
                 if currFlowDir == 1: #  or currFlowDir == 4 or currFlowDir == 16 or currFlowDir == 64:
                     currFlowDir = 128
                     # 1 of 2 Diagonal flow directions
                     #arcpy.AddMessage("Second cross section - diagonal")
-                    planvals,B = CalcCrossSection(sectn,currFlowDir,currRow,currCol,planvals,xsectAreaList,B)
+                    CalcCrossSectionSets(sectn,currFlowDir,currRow,currCol,sections)
                     currFlowDir = 2
                     # 2 of 2 Diagonal flow directions
                     #arcpy.AddMessage("Third cross section - diagonal")
-                    planvals,B = CalcCrossSection(sectn,currFlowDir,currRow,currCol,planvals,xsectAreaList,B)
+                    CalcCrossSectionSets(sectn,currFlowDir,currRow,currCol,sections)
                 if currFlowDir == 4: #  or currFlowDir == 4 or currFlowDir == 16 or currFlowDir == 64:
                     currFlowDir = 2
                     # 1 of 2 Diagonal flow directions
                     #arcpy.AddMessage("Second cross section - diagonal")
-                    planvals,B = CalcCrossSection(sectn,currFlowDir,currRow,currCol,planvals,xsectAreaList,B)
+                    CalcCrossSectionSets(sectn,currFlowDir,currRow,currCol,sections)
                     currFlowDir = 8
                     # 2 of 2 Diagonal flow directions
                     #arcpy.AddMessage("Third cross section - diagonal")
-                    planvals,B = CalcCrossSection(sectn,currFlowDir,currRow,currCol,planvals,xsectAreaList,B)
+                    CalcCrossSectionSets(sectn,currFlowDir,currRow,currCol,sections)
                 if currFlowDir == 16: #  or currFlowDir == 4 or currFlowDir == 16 or currFlowDir == 64:
                     currFlowDir = 8
                     # 1 of 2 Diagonal flow directions
                     #arcpy.AddMessage("Second cross section - diagonal")
-                    planvals,B = CalcCrossSection(sectn,currFlowDir,currRow,currCol,planvals,xsectAreaList,B)
+                    CalcCrossSectionSets(sectn,currFlowDir,currRow,currCol,sections)
                     currFlowDir = 32
                     # 2 of 2 Diagonal flow directions
                     #arcpy.AddMessage("Third cross section - diagonal")
-                    planvals,B = CalcCrossSection(sectn,currFlowDir,currRow,currCol,planvals,xsectAreaList,B)
+                    CalcCrossSectionSets(sectn,currFlowDir,currRow,currCol,sections)
                 if currFlowDir == 64: #  or currFlowDir == 4 or currFlowDir == 16 or currFlowDir == 64:
                     currFlowDir = 32
                     # 1 of 2 Diagonal flow directions
                     #arcpy.AddMessage("Second cross section - diagonal")
-                    planvals,B = CalcCrossSection(sectn,currFlowDir,currRow,currCol,planvals,xsectAreaList,B)
+                    CalcCrossSectionSets(sectn,currFlowDir,currRow,currCol,sections)
                     currFlowDir = 128
                     # 2 of 2 Diagonal flow directions
                     #arcpy.AddMessage("Third cross section - diagonal")
-                    planvals,B = CalcCrossSection(sectn,currFlowDir,currRow,currCol,planvals,xsectAreaList,B)
+                    CalcCrossSectionSets(sectn,currFlowDir,currRow,currCol,sections)
 
                 currFlowDir = savedir  # restore the saved flow direction
                 
@@ -1470,7 +1634,7 @@ def main(workspace, Input_surface_raster, drainName, volumeTextFile, coordsTextF
                         # southwest
                         currCol = currCol + 1
                     #arcpy.AddMessage("Fourth cross section ")
-                    planvals,B = CalcCrossSection(sectn,currFlowDir,currRow,currCol,planvals,xsectAreaList,B)
+                    CalcCrossSectionSets(sectn,currFlowDir,currRow,currCol,sections)
 
                     currRow = savex   # restore X coordinate
                     currCol = savey   # restore Y coordinate
@@ -1480,78 +1644,85 @@ def main(workspace, Input_surface_raster, drainName, volumeTextFile, coordsTextF
                 #  should stop
                 # =====================================
 
-                planvals.reverse()
-                numz = 0
-                temp_plan = []
-                
-                for i in range(len(planvals)):
-                    numz = planvals[i] + numz
+                for run in active:
+                    planvals = run['planvals']
+                    planvals.reverse()
+                    numz = 0
+                    temp_plan = []
+
+                    for i in range(len(planvals)):
+                        numz = planvals[i] + numz
 
-                    temp_plan.append(numz * cellWidth * cellWidth)
+                        temp_plan.append(numz * cellWidth * cellWidth)
 
-                temp_plan.reverse()
+                    temp_plan.reverse()
 
-                for i in range(len(checkPlanExtent)):
-                    checkPlanExtent[i] = planAreaList[i] - temp_plan[i]
+                    for i in range(len(run['check'])):
+                        run['check'][i] = run['plan'][i] - temp_plan[i]
 
 
-                planvals.reverse()
+                    planvals.reverse()
                 
                 # ===========================================
                 # write the remaining planimetric areas to file
-                # remaining area - checkPlanExtent[0] - [6] or
-                # 7 simultaneous runs
+                # remaining area - checkPlanExtent[0] - [n] or
+                # n simultaneous runs, and with several coefficient
+                # sets one column per set and volume
                 # ===========================================
                 outfile = open(ptsfilename, "a", encoding="utf_8_sig")
-                iwrite = len(checkPlanExtent)
-                if iwrite == 1:
-                    outfile.write(str(checkPlanExtent[0])+ "\n")
-                elif iwrite == 2:
-                    outfile.write(str(checkPlanExtent[0])+", "+str(checkPlanExtent[1])+ "\n")
-                elif iwrite == 3:
-                    outfile.write(str(checkPlanExtent[0])+", "+str(checkPlanExtent[1])+", "+str(checkPlanExtent[2])+ "\n")
-                elif iwrite == 4:
-                    outfile.write(str(checkPlanExtent[0])+", "+str(checkPlanExtent[1])+", "+str(checkPlanExtent[2])+", "+str(checkPlanExtent[3])+ "\n")
-                elif iwrite == 5:
-                    outfile.write(str(checkPlanExtent[0])+", "+str(checkPlanExtent[1])+", "+str(checkPlanExtent[2])+", "+str(checkPlanExtent[3])+", "+str(checkPlanExtent[4])+ "\n")
-                elif iwrite == 6:
-                    outfile.write(str(checkPlanExtent[0])+", "+str(checkPlanExtent[1])+", "+str(checkPlanExtent[2])+", "+str(checkPlanExtent[3])+", "+str(checkPlanExtent[4])+", "+str(checkPlanExtent[5])+ "\n")
-                elif iwrite == 7:
-                    outfile.write(str(checkPlanExtent[0])+", "+str(checkPlanExtent[1])+", "+str(checkPlanExtent[2])+", "+str(checkPlanExtent[3])+", "+str(checkPlanExtent[4])+", "+str(checkPlanExtent[5])+", "+str(checkPlanExtent[6])+ "\n")
-                
+                if coefficientSets:
+                    columns = []
+                    for run in runs:
+                        for i in range(len(run['masterPlan'])):
+                            if run['alive'] and i < len(run['check']):
+                                columns.append(str(run['check'][i]))
+                            else:
+                                columns.append("-")
+                    outfile.write(", ".join(columns) + "\n")
+                else:
+                    outfile.write(", ".join([str(v) for v in runs[0]['check']]) + "\n")
+
                # ===========================================
                 # check for negative planimetric values
                 # if so, delete (pop) them
                 # ===========================================
 
-                pnegcount = 0
-                plandiflength = len(checkPlanExtent)
-                if plandiflength > 1:
-                    for i in range(len(checkPlanExtent)):
-                        if checkPlanExtent[i] < 0:
-                            pnegcount += 1
-                if pnegcount > 0 and plandiflength > 1:
-                    #arcpy.AddMessage("Popping...")
-                    planAreaList.pop()
-                    xsectAreaList.pop()
-                    checkPlanExtent.pop()
-                    pnegcount -= 1
-                    plandiflength -= 1
+                for run in active:
+                    checkPlanExtent = run['check']
+                    pnegcount = 0
+                    plandiflength = len(checkPlanExtent)
+                    if plandiflength > 1:
+                        for i in range(len(checkPlanExtent)):
+                            if checkPlanExtent[i] < 0:
+                                pnegcount += 1
+                    if pnegcount > 0 and plandiflength > 1:
+                        #arcpy.AddMessage("Popping...")
+                        run['plan'].pop()
+                        run['xsect'].pop()
+                        checkPlanExtent.pop()
+                        pnegcount -= 1
+                        plandiflength -= 1
+
+                    # the set is done when its largest area is used up
+                    if checkPlanExtent[0] < 0:
+                        run['alive'] = False
+                        run['cells'] = cellTraverseCount
 
                 # =====================================
                 #  Stop if done
                 # =====================================
 
-                if checkPlanExtent[0] < 0:
-                    endtimetot = time.process_time()
-                    tottime = endtimetot - starttimetot
-
+                if not any(run['alive'] for run in runs):
+                    tottime = metrics.walltime()
 
                     stringtime = CalcTime(tottime)
 
                     outfile.write("TOTAL TIME:  " + str(tottime)+ " seconds" + "\n")
                     outfile.write("TOTAL TIME:  " + stringtime + "\n")
+                    outfile.write("CPU TIME:  " + str(metrics.cputime())+ " seconds" + "\n")
                     outfile.write("TOTAL CELLS TRAVERSED:  " + str(cellTraverseCount)+ " cells" + "\n")
+                    for run in coefficientSets:
+                        outfile.write("CELLS TRAVERSED BY " + str(run['name']) + ":  " + str(run['cells']) + " cells" + "\n")
                     outfile.close()
 
                     allStop = True
@@ -1594,18 +1765,17 @@ def main(workspace, Input_surface_raster, drainName, volumeTextFile, coordsTextF
                         currCol = currCol + 1
                     else:
                         #print("Bad flow direction ", currFlowDir)
-                        arcpy.AddMessage("Bad flow direction")
+                        progress.warning("Bad flow direction " + str(currFlowDir) + " at row " + str(currRow) + ", column " + str(currCol))
                 else:
                     # =====================================
                     #   Stop if infinite loop
                     # =====================================
-                    endtimetot = time.process_time()
-                    tottime = endtimetot - starttimetot
-
+                    tottime = metrics.walltime()
                     stringtime = CalcTime(tottime)
 
                     outfile.write("TOTAL TIME:  " + str(tottime)+ " seconds" + "\n")
                     outfile.write("TOTAL TIME:  " + stringtime + "\n")
+                    outfile.write("CPU TIME:  " + str(metrics.cputime())+ " seconds" + "\n")
                     outfile.write("TOTAL CELLS TRAVERSED:  " + str(cellTraverseCount)+ " cells" + "\n")
                     outfile.close()
 
@@ -1616,41 +1786,49 @@ def main(workspace, Input_surface_raster, drainName, volumeTextFile, coordsTextF
                 # Get new flow direction
                 # ===========================================
                 currFlowDir = C[currRow,currCol]
-                arcpy.AddMessage("New Flow Direction is: " + str(currFlowDir))
+                if progress.wants(DEBUG):
+                    progress.detail("New Flow Direction is: " + str(currFlowDir))
 
                 cellTraverseCount += 1
 
-                arcpy.AddMessage("______________________________________")
-                arcpy.AddMessage(" NUMBER OF STREAM CELLS TRAVERSED: " + str(cellTraverseCount))
+                progress.update("traverse", cellTraverseCount, maxTraverse[blcount - 1], traverseLabel)
 
-                arcpy.AddMessage("")
+            metrics.stop("traverse")
+            progress.finish("traverse", cellTraverseCount, None, traverseLabel)
+            metrics.count("runs")
+            metrics.count("cells_traversed", cellTraverseCount)
+            metrics.count("cross_sections", sectn['xsectcount'])
+            for run in runs:
+                metrics.count("cells_labelled", numpy.count_nonzero(run['labels'] > 1))
 
             if allStop == True:
                 arcpy.AddMessage("______________________________________")
                 arcpy.AddMessage("_________ ALL STOP IS:" + str(allStop))
 
-            arcpy.AddMessage("_________ Creating Grid " + str(drainName) + str(blcount) + " from Array _________")
-            if arcpy.Exists(currentPath + "\\" + str(drainName) + str(blcount)):
-                arcpy.Delete_management(currentPath + "\\" + str(drainName) + str(blcount)) # delete existing test_sect
-            myRaster = arcpy.NumPyArrayToRaster(B,arcpy.Point(lowLeftX, lowLeftY),cellWidth,cellWidth)
-            myRaster.save(env.workspace + "\\" + str(drainName) + str(blcount))
+            metrics.start("write_raster")
+            for run in runs:
+                runName = str(drainName) + run['label'] + str(blcount)
+                arcpy.AddMessage("_________ Creating Grid " + runName + " from Array _________")
+                if arcpy.Exists(currentPath + "\\" + runName):
+                    arcpy.Delete_management(currentPath + "\\" + runName) # delete existing test_sect
+                myRaster = arcpy.NumPyArrayToRaster(run['labels'],arcpy.Point(lowLeftX, lowLeftY),cellWidth,cellWidth)
+                myRaster.save(env.workspace + "\\" + runName)
 
-            mergeList.append(str(drainName)+str(blcount))
+                mergeList.append(runName)
+            metrics.stop("write_raster")
 
             # =====================================
-            #   Restore B array to all 1's
+            #   Restore B arrays to all 1's
             # =====================================
 
-            i = 0
-            j = 0
-            while j < number_rows:
-                for i in range(number_cols):
-                   if B[j,i] > 1:
-                       B[j,i] = 1
-                j = j + 1
+            for run in runs:
+                run['labels'][run['labels'] > 1] = 1
 
         arcpy.AddMessage("...Processing Complete...")
-        arcpy.AddMessage("TOTAL TIME:  " + str(tottime) + " seconds")
+        for aline in metrics.summary():
+            arcpy.AddMessage(aline)
+        metricsname = metrics.writejson(PathName + "laharz_textfiles\\" + str(drainName) + "_metrics.json")
+        arcpy.AddMessage("Run metrics written to:  " + metricsname)
 
         arcpy.AddMessage("List of the files created:  " + str(mergeList))
         arcpy.AddMessage("Volumes entered:  " + str(volumeList))
@@ -1660,6 +1838,11 @@ def main(workspace, Input_surface_raster, drainName, volumeTextFile, coordsTextF
         del A
         del B
         del C
+        for run in runs:
+            del run['labels']
+    finally:
+        if scratch is not None:
+            scratch.cleanup()
 
 if __name__ == "__main__":
     from sys import argv
@@ -0,0 +1,190 @@
+# ---------------------------------------------------------------------------
+# flow_paths.py
+#
+# Usage: imported by tools that need downstream flow paths of many cells
+#        (path lengths, outlets, which start points drain through a cell)
+#
+#   This module describes the downstream flow path of every cell of a
+#  <prefix>dir grid at once, without following the path of any cell one
+#  step at a time.  The paths are found by pointer jumping: every cell
+#  keeps a pointer further down its path and the length up to it, and each
+#  round replaces the pointer by the pointer of the cell it points to, so
+#  the pointers reach the outlets after log2(longest path) rounds of whole
+#  array operations.
+#  The same sums number the cells in depth-first order of the drainage
+#  tree (outlets first, each cell before the cells upstream of it), so
+#  "does X drain through Y" is two comparisons: X is in the block of
+#  numbers that starts at Y and is as long as the area draining to Y.
+# ---------------------------------------------------------------------------
+
+# Start Up - Import system modules
+import os
+import math
+import numpy
+from native_hydro import DownstreamCells, TopologicalFrontiers, D8_CODES, DIR_NODATA
+
+#===========================================================================
+#  Local Functions
+#===========================================================================
+
+def PointerJump(down, steps):
+    # =====================================
+    # Parameters:
+    #   down:   flat array of the next cell of every path, -1 at the end
+    #   steps:  value of every cell's step; summed along the paths
+    #
+    # Returns:  (last cell of every path, sum of steps from each cell
+    #           down to that last cell, the last cell's step excluded)
+    # =====================================
+    cells = numpy.arange(len(down), dtype=down.dtype)
+    pointer = numpy.where(down >= 0, down, cells)
+    total = numpy.where(down >= 0, steps, 0).astype(steps.dtype)
+    for jump in range(64):
+        further = pointer[pointer]
+        if numpy.array_equal(further, pointer):
+            break
+        total = total + total[pointer]
+        pointer = further
+    return pointer, total
+
+def SubtreeSizes(down, nodata):
+    # =====================================
+    # Returns:  number of cells whose path goes through each cell,
+    #           the cell included (0 on NoData)
+    # =====================================
+    sizes = (~nodata).astype(numpy.int64)
+    donors = numpy.zeros(len(down), dtype=bool)
+    donors[down[down >= 0]] = True
+    for frontier in TopologicalFrontiers(down, numpy.flatnonzero(~donors & ~nodata)):
+        target = down[frontier]
+        keep = target >= 0
+        numpy.add.at(sizes, target[keep], sizes[frontier[keep]])
+    return sizes
+
+#===========================================================================
+#  Flow paths
+#===========================================================================
+
+def FlowPaths(codes, cellsize=1.0, sizes=None):
+    # =====================================
+    # Parameters:
+    #   codes:     flow direction array (ESRI codes)
+    #   cellsize:  cell size, for distances in map units
+    #   sizes:     optional <prefix>flac counts + 1 (cells draining
+    #              through each cell); computed when not given
+    #
+    # Returns:  dictionary of flat arrays:
+    #   down:      next cell of every cell, -1 at the end of its path
+    #   outlet:    last cell of the path of every cell
+    #   outletid:  number of that outlet (0, 1, ... in cell order)
+    #   distance:  length of the path to the outlet, map units
+    #   steps:     number of cells on the path after the cell
+    #   edge:      True where the path leaves the DEM (not a sink)
+    #   order, size:  depth-first number of every cell and the number
+    #              of cells draining through it, for DrainsThrough
+    #   shape
+    # =====================================
+    numrows, numcols = codes.shape
+    flat = codes.ravel()
+    nodata = flat == DIR_NODATA
+    down = DownstreamCells(codes)
+
+    # length of every step
+    length = numpy.zeros(len(down), dtype=numpy.float64)
+    for k in range(8):
+        length[flat == D8_CODES[k]] = cellsize * (math.sqrt(2.0) if k % 2 == 1 else 1.0)
+    outlet, distance = PointerJump(down, length)
+    outlet, steps = PointerJump(down, (down >= 0).astype(numpy.int64))
+    outlets = numpy.unique(outlet[~nodata])
+    outletid = numpy.searchsorted(outlets, outlet)
+    outletid[nodata] = -1
+
+    # the last cell of a path flows off the DEM or into NoData, unless
+    # its code is not a direction (a sink)
+    edge = numpy.isin(flat[outlet], D8_CODES) & ~nodata
+
+    # depth-first numbers: the cells draining to a cell come right after
+    # it, children of one cell in cell order, outlets one after the other
+    if sizes is None:
+        sizes = SubtreeSizes(down, nodata)
+    else:
+        sizes = numpy.where(nodata, 0, numpy.asarray(sizes, dtype=numpy.int64).ravel())
+    children = numpy.flatnonzero(down >= 0)
+    children = children[numpy.argsort(down[children], kind="stable")]
+    parents = down[children]
+    before = numpy.cumsum(sizes[children]) - sizes[children]     # sizes of the earlier children
+    firsts = numpy.concatenate(([True], parents[1:] != parents[:-1]))
+    groupstart = numpy.maximum.accumulate(numpy.where(firsts, numpy.arange(len(children)), 0))
+    offset = numpy.zeros(len(down), dtype=numpy.int64)
+    offset[children] = 1 + before - before[groupstart]
+    rootstart = numpy.zeros(len(down), dtype=numpy.int64)
+    rootstart[outlets] = numpy.cumsum(sizes[outlets]) - sizes[outlets]
+    root, above = PointerJump(down, offset)
+    order = rootstart[root] + above
+    order[nodata] = -1
+
+    paths = {"down": down,
+             "outlet": outlet,
+             "outletid": outletid,
+             "distance": distance,
+             "steps": steps,
+             "edge": edge,
+             "order": order,
+             "size": sizes,
+             "shape": numpy.array(codes.shape, dtype=numpy.int64)}
+    return paths
+
+def DrainsThrough(paths, cells, through):
+    # =====================================
+    # Parameters:
+    #   paths:    result of FlowPaths
+    #   cells:    flat cell numbers, e.g. of start points
+    #   through:  flat cell numbers, one per cell or one for all
+    #
+    # Returns:  True where the flow path of a cell passes through (or
+    #           starts at) the matching through cell
+    # =====================================
+    order = paths["order"]
+    cells = numpy.asarray(cells, dtype=numpy.int64)
+    through = numpy.asarray(through, dtype=numpy.int64)
+    start = order[through]
+    return (start >= 0) & (order[cells] >= start) & (order[cells] < start + paths["size"][through])
+
+def FlowPath(paths, cell, maxcells=None):
+    # =====================================
+    # Returns:  cells of the flow path from cell to the end of the DEM
+    #           or a sink, cell included; at most maxcells cells
+    # =====================================
+    down = paths["down"]
+    count = int(paths["steps"][cell]) + 1
+    if maxcells is not None:
+        count = min(count, int(maxcells))
+    path = numpy.empty(count, dtype=numpy.int64)
+    for i in range(count):
+        path[i] = cell
+        cell = down[cell]
+    return path
+
+def TraversalLengths(paths, cells):
+    # =====================================
+    # Returns:  number of cells a downstream traversal from each cell
+    #           can visit before leaving the DEM, for ordering runs
+    # =====================================
+    return paths["steps"][numpy.asarray(cells, dtype=numpy.int64)] + 1
+
+def SaveFlowPaths(filename, paths):
+    # saves paths as an uncompressed .npz file
+    folder = os.path.dirname(filename)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder, exist_ok=True)
+    with open(filename, "wb") as afile:
+        numpy.savez(afile, **paths)
+
+def LoadFlowPaths(filename):
+    # =====================================
+    # Returns:  paths saved by SaveFlowPaths, or None if there are none
+    # =====================================
+    if not os.path.isfile(filename):
+        return None
+    with numpy.load(filename) as saved:
+        return {name: saved[name] for name in saved.files}
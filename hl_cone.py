@@ -0,0 +1,412 @@
+# ---------------------------------------------------------------------------
+# hl_cone.py
+#
+# Usage: imported by proximal_zone.py
+#
+#   This module computes the H/L cone of proximal_zone.py on NumPy arrays.
+#  The cone surface of an apex is  apex_elev - slope * distance,  where the
+#  distance is measured between cell centres in map units as EucDistance
+#  does.  A cell is inside the cone where the surface is above the DEM.  With
+#  several apexes the cone is the union of the apex cones, i.e. the upper
+#  envelope of the cone surfaces compared with the DEM.
+#  Rows and columns are numbered from the upper left cell of the DEM, as in
+#  the arrays returned by arcpy.RasterToNumPyArray.
+#  For a sweep over several H/L slopes the critical slope of every cell,
+#  max(apex_elev - dem) / distance, is computed once; the cone of slope s is
+#  then the cells whose critical slope is above s.
+# ---------------------------------------------------------------------------
+
+# Start Up - Import system modules
+import os, math, json, hashlib
+import numpy
+
+#===========================================================================
+#  Local Functions
+#===========================================================================
+
+def CellOfPoint(x, y, left, top, cellsize):
+    # =====================================
+    # Parameters:
+    #   x, y:       map coordinates of a point
+    #   left, top:  map coordinates of the upper left corner of the DEM
+    #   cellsize:   cell size of the DEM
+    #
+    # Returns:  row, column of the cell containing the point
+    # =====================================
+
+    row = int(math.floor((top - y) / cellsize))
+    col = int(math.floor((x - left) / cellsize))
+    return row, col
+
+def MaximumElevationApexes(dem):
+    # =====================================
+    # Parameters:
+    #   dem:  DEM array, NoData as nan
+    #
+    # Finds every cell having the maximum elevation of the DEM,
+    # as Con(Raster(dem) == const_g, const_g) does
+    #
+    # Returns:  list of (row, column, elevation)
+    # =====================================
+
+    maxelev = numpy.nanmax(dem)
+    cells = numpy.argwhere(dem == maxelev)
+    return [(int(r), int(c), float(maxelev)) for r, c in cells]
+
+def PointApexes(dem, points, left, top, cellsize):
+    # =====================================
+    # Parameters:
+    #   dem:        DEM array, NoData as nan
+    #   points:     list of [x, y] map coordinates
+    #   left, top:  map coordinates of the upper left corner of the DEM
+    #   cellsize:   cell size of the DEM
+    #
+    # Locates apex points on the DEM and reads their elevation,
+    # as GetCellValue and ExtractByPoints do
+    #
+    # Returns:  list of (row, column, elevation); points outside the DEM
+    #           or on NoData raise ValueError
+    # =====================================
+
+    apexes = []
+    for point in points:
+        row, col = CellOfPoint(float(point[0]), float(point[1]), left, top, cellsize)
+        if row < 0 or col < 0 or row >= dem.shape[0] or col >= dem.shape[1]:
+            raise ValueError("Apex " + str(point) + " is outside the DEM")
+        elev = float(dem[row, col])
+        if math.isnan(elev):
+            raise ValueError("Apex " + str(point) + " is on a NoData cell")
+        apexes.append((row, col, elev))
+    return apexes
+
+def PruneDominatedApexes(apexes, slope, cellsize, apexchunk=256, maxslope=None):
+    # =====================================
+    # Parameters:
+    #   apexes:     list of (row, column, elevation) of the cone apexes
+    #   slope:      H/L slope (decimal)
+    #   cellsize:   cell size of the DEM
+    #   apexchunk:  number of apexes compared at a time
+    #   maxslope:   if given, keep every apex needed for any slope from
+    #               slope to maxslope (the test is linear in the slope,
+    #               so checking both ends is enough)
+    #
+    # Removes apexes whose cone lies entirely under another cone.
+    # Apex j is dominated by apex i when  E_i - slope * d(i, j) >= E_j;
+    # by the triangle inequality cone j is then below cone i everywhere,
+    # so dropping it does not change the envelope.  Along a crater rim
+    # this removes most of the points.
+    #
+    # Returns:  list of the remaining apexes, highest first
+    # =====================================
+
+    if len(apexes) < 2:
+        return list(apexes)
+    pts = numpy.array(apexes, dtype=numpy.float64)
+    pts = pts[numpy.argsort(-pts[:, 2], kind="stable")]   # highest first
+    rows, cols, elevs = pts[:, 0], pts[:, 1], pts[:, 2]
+    keep = numpy.ones(len(pts), dtype=bool)
+    scale = slope * cellsize
+
+    for j0 in range(0, len(pts), apexchunk):
+        j1 = min(len(pts), j0 + apexchunk)
+        dist = numpy.hypot(rows[:, None] - rows[None, j0:j1], cols[:, None] - cols[None, j0:j1])
+        reach = elevs[:, None] - scale * dist                   # cone i at apex j
+        if maxslope is not None:
+            reach = numpy.minimum(reach, elevs[:, None] - maxslope * cellsize * dist)
+        reach[j0 + numpy.arange(j1 - j0), numpy.arange(j1 - j0)] = -numpy.inf  # not itself
+        # identical apexes would dominate each other; only an earlier one may
+        same = (dist == 0) & (elevs[:, None] == elevs[None, j0:j1])
+        same &= numpy.arange(len(pts))[:, None] > numpy.arange(j0, j1)[None, :]
+        reach[same] = -numpy.inf
+        keep[j0:j1] = ~(reach >= elevs[None, j0:j1]).any(axis=0)
+
+    return [(int(r), int(c), float(e)) for r, c, e in pts[keep]]
+
+def ReachWindows(dem, apexes, slope, cellsize, mindem=None):
+    # =====================================
+    # Parameters:
+    #   dem:        DEM array, NoData as nan
+    #   apexes:     list of (row, column, elevation) of the cone apexes
+    #   slope:      H/L slope (decimal)
+    #   cellsize:   cell size of the DEM
+    #   mindem:     lowest elevation of the DEM, read from dem if None
+    #
+    # A cone can only be above the DEM within
+    #   (apex_elev - mindem) / slope
+    # of its apex.  Each apex gets the window of rows and columns within
+    # that reach; overlapping windows are joined so that every cell is
+    # evaluated once.
+    #
+    # Returns:  list of (row0, row1, col0, col1, apexes in the window),
+    #           row1 and col1 excluded
+    # =====================================
+
+    numrows, numcols = dem.shape
+    if mindem is None:
+        mindem = float(numpy.nanmin(dem))
+    windows = []
+    for apex in apexes:
+        reach = (apex[2] - mindem) / (slope * cellsize)    # in cells
+        if reach <= 0:
+            continue    # the lowest cell of the DEM: nothing is below the cone
+        row0 = max(0, int(math.floor(apex[0] - reach)))
+        row1 = min(numrows, int(math.ceil(apex[0] + reach)) + 1)
+        col0 = max(0, int(math.floor(apex[1] - reach)))
+        col1 = min(numcols, int(math.ceil(apex[1] + reach)) + 1)
+        windows.append([row0, row1, col0, col1, [apex]])
+
+    # join overlapping windows until none overlap
+    joined = True
+    while joined:
+        joined = False
+        merged = []
+        for win in windows:
+            for other in merged:
+                if win[0] < other[1] and other[0] < win[1] and win[2] < other[3] and other[2] < win[3]:
+                    other[0] = min(other[0], win[0])
+                    other[1] = max(other[1], win[1])
+                    other[2] = min(other[2], win[2])
+                    other[3] = max(other[3], win[3])
+                    other[4].extend(win[4])
+                    joined = True
+                    break
+            else:
+                merged.append(win)
+        windows = merged
+
+    return [tuple(win) for win in windows]
+
+def ConeMask(dem, apexes, slope, cellsize, tilesize=64, memorymb=64, reachwindow=False):
+    # =====================================
+    # Parameters:
+    #   dem:        DEM array, NoData as nan
+    #   apexes:     list of (row, column, elevation) of the cone apexes
+    #   slope:      H/L slope (decimal)
+    #   cellsize:   cell size of the DEM
+    #   tilesize:   number of rows and columns of a tile
+    #   memorymb:   memory budget (MB) of the cone surfaces of one tile,
+    #               sets how many apexes are evaluated together
+    #   reachwindow:  if True, evaluate only the windows within reach
+    #               of the apexes (see ReachWindows)
+    #
+    # Evaluates the upper envelope of the apex cones,
+    #   max_i(apex_elev_i - slope * distance_i) > dem,
+    # in one pass over tiles of the DEM, with the apexes vectorized in
+    # chunks.  Memory is bounded by memorymb whatever the number of
+    # apexes.  In each tile only the apexes whose highest possible
+    # surface in the tile is above the lowest DEM cell there are
+    # evaluated, so small tiles keep thousands of apexes (a whole
+    # crater rim) fast.
+    #
+    # Returns:  boolean array, True inside the cone
+    # =====================================
+
+    mask = numpy.zeros(dem.shape, dtype=bool)
+    if reachwindow:
+        # write each window back into the full extent mask
+        for row0, row1, col0, col1, winapexes in ReachWindows(dem, apexes, slope, cellsize):
+            winapexes = [(r - row0, c - col0, e) for r, c, e in winapexes]
+            mask[row0:row1, col0:col1] = ConeMask(dem[row0:row1, col0:col1], winapexes, slope, cellsize, tilesize, memorymb)
+        return mask
+
+    numrows, numcols = dem.shape
+    apexes = PruneDominatedApexes(apexes, slope, cellsize)
+    if len(apexes) == 0:
+        return mask
+    tilesize = max(1, int(tilesize))
+    apexchunk = max(1, int(memorymb * 1048576 // (8 * tilesize * tilesize)))
+
+    pts = numpy.array(apexes, dtype=numpy.float64)         # highest first
+    scale = slope * cellsize
+
+    for row0 in range(0, numrows, tilesize):
+        row1 = min(numrows, row0 + tilesize)
+        rowidx = numpy.arange(row0, row1, dtype=numpy.float64)[None, :, None]
+        rowgap = numpy.maximum(0.0, numpy.maximum(row0 - pts[:, 0], pts[:, 0] - (row1 - 1)))
+        for col0 in range(0, numcols, tilesize):
+            col1 = min(numcols, col0 + tilesize)
+            demtile = dem[row0:row1, col0:col1]
+            if numpy.isnan(demtile).all():
+                continue
+            demmin = numpy.nanmin(demtile)
+
+            # highest surface each apex can reach inside the tile
+            colgap = numpy.maximum(0.0, numpy.maximum(col0 - pts[:, 1], pts[:, 1] - (col1 - 1)))
+            bound = pts[:, 2] - scale * numpy.hypot(rowgap, colgap)
+            active = pts[bound > demmin]
+            if len(active) == 0:
+                continue
+
+            colidx = numpy.arange(col0, col1, dtype=numpy.float64)[None, None, :]
+            tile = mask[row0:row1, col0:col1]
+            for a0 in range(0, len(active), apexchunk):
+                chunk = active[a0:a0 + apexchunk]
+                dist = numpy.hypot(rowidx - chunk[:, 0, None, None], colidx - chunk[:, 1, None, None])
+                surface = (chunk[:, 2, None, None] - scale * dist).max(axis=0)
+                # cone surface above the DEM
+                tile |= surface > demtile
+
+    return mask
+
+def ConeBoundary(mask):
+    # =====================================
+    # Parameters:
+    #   mask:  boolean cone array, True inside the cone
+    #
+    # Finds the cells of the cone having at least one of their 8
+    # neighbours outside the cone (or off the DEM).  The boundary is
+    # 4-connected, so every D8 stream leaving the cone crosses one
+    # of its cells.
+    #
+    # Returns:  boolean array, True on the boundary
+    # =====================================
+
+    padded = numpy.pad(mask, 1, mode="constant", constant_values=False)
+    numrows, numcols = mask.shape
+    interior = mask.copy()
+    for dr in (-1, 0, 1):
+        for dc in (-1, 0, 1):
+            if dr != 0 or dc != 0:
+                interior &= padded[1 + dr:1 + dr + numrows, 1 + dc:1 + dc + numcols]
+    return mask & ~interior
+
+def BoundaryStreamPoints(mask, stream, left, top, cellsize):
+    # =====================================
+    # Parameters:
+    #   mask:       boolean cone array, True inside the cone
+    #   stream:     stream array aligned with mask, 1 on streams
+    #   left, top:  map coordinates of the upper left corner of the DEM
+    #   cellsize:   cell size of the DEM
+    #
+    # Intersects the cone boundary with the streams, as
+    # Plus(cone outline, streams) == 2 did
+    #
+    # Returns:  (rows, columns, x, y) arrays of the intersection cells
+    #           in row order from the top, x and y at cell centres
+    # =====================================
+
+    cells = numpy.argwhere(ConeBoundary(mask) & (stream == 1))
+    rows = cells[:, 0]
+    cols = cells[:, 1]
+    x = left + (cols + 0.5) * cellsize
+    y = top - (rows + 0.5) * cellsize
+    return rows, cols, x, y
+
+#===========================================================================
+#  H/L slope sweep
+#===========================================================================
+
+def CriticalSlope(dem, apexes, cellsize, minslope, maxslope, tilesize=64, memorymb=64):
+    # =====================================
+    # Parameters:
+    #   dem:        DEM array, NoData as nan
+    #   apexes:     list of (row, column, elevation) of the cone apexes
+    #   cellsize:   cell size of the DEM
+    #   minslope, maxslope:  range of the H/L slopes of the sweep
+    #   tilesize, memorymb:  see ConeMask
+    #
+    # Computes the apex distance field once for all slopes of a sweep as
+    # the critical slope of each cell,
+    #   max_i((apex_elev_i - dem) / distance_i),
+    # so that the cone of slope s is  CriticalSlope > s  for any s from
+    # minslope to maxslope.  Values at or below minslope are stored as 0.
+    #
+    # Returns:  float64 array of critical slopes
+    # =====================================
+
+    numrows, numcols = dem.shape
+    crit = numpy.zeros(dem.shape, dtype=numpy.float64)
+    apexes = PruneDominatedApexes(apexes, minslope, cellsize, maxslope=maxslope)
+    if len(apexes) == 0:
+        return crit
+    tilesize = max(1, int(tilesize))
+    apexchunk = max(1, int(memorymb * 1048576 // (8 * tilesize * tilesize)))
+    pts = numpy.array(apexes, dtype=numpy.float64)
+
+    for row0 in range(0, numrows, tilesize):
+        row1 = min(numrows, row0 + tilesize)
+        rowidx = numpy.arange(row0, row1, dtype=numpy.float64)[None, :, None]
+        rowgap = numpy.maximum(0.0, numpy.maximum(row0 - pts[:, 0], pts[:, 0] - (row1 - 1)))
+        for col0 in range(0, numcols, tilesize):
+            col1 = min(numcols, col0 + tilesize)
+            demtile = dem[row0:row1, col0:col1]
+            if numpy.isnan(demtile).all():
+                continue
+            demmin = numpy.nanmin(demtile)
+
+            # only apexes that reach the tile at the smallest slope
+            colgap = numpy.maximum(0.0, numpy.maximum(col0 - pts[:, 1], pts[:, 1] - (col1 - 1)))
+            bound = pts[:, 2] - minslope * cellsize * numpy.hypot(rowgap, colgap)
+            active = pts[bound > demmin]
+            if len(active) == 0:
+                continue
+
+            colidx = numpy.arange(col0, col1, dtype=numpy.float64)[None, None, :]
+            best = numpy.full(demtile.shape, -numpy.inf)
+            for a0 in range(0, len(active), apexchunk):
+                chunk = active[a0:a0 + apexchunk]
+                dist = cellsize * numpy.hypot(rowidx - chunk[:, 0, None, None], colidx - chunk[:, 1, None, None])
+                rise = chunk[:, 2, None, None] - demtile[None, :, :]
+                with numpy.errstate(divide="ignore", invalid="ignore"):
+                    ratio = rise / dist
+                # at the apex cell itself the cone is above the DEM only
+                # if the apex is higher than the cell
+                ratio[dist == 0] = numpy.where(rise[dist == 0] > 0, numpy.inf, -numpy.inf)
+                numpy.maximum(best, numpy.nan_to_num(ratio, nan=-numpy.inf, posinf=numpy.inf).max(axis=0), out=best)
+            best[~(best > minslope)] = 0
+            crit[row0:row1, col0:col1] = best
+
+    return crit
+
+def SweepCacheKey(dem, apexes, cellsize):
+    # =====================================
+    # Parameters:
+    #   dem:        DEM array, NoData as nan
+    #   apexes:     list of (row, column, elevation) of the cone apexes
+    #   cellsize:   cell size of the DEM
+    #
+    # Returns:  hexadecimal key identifying the DEM contents and apex set
+    # =====================================
+
+    key = hashlib.sha1()
+    key.update(str(dem.shape).encode("ascii"))
+    key.update(repr(float(cellsize)).encode("ascii"))
+    key.update(numpy.ascontiguousarray(dem, dtype=numpy.float64).tobytes())
+    key.update(json.dumps(sorted([int(r), int(c), float(e)] for r, c, e in apexes)).encode("ascii"))
+    return key.hexdigest()
+
+def LoadCriticalSlope(folder, key, minslope, maxslope):
+    # =====================================
+    # Parameters:
+    #   folder:     cache folder
+    #   key:        result of SweepCacheKey
+    #   minslope, maxslope:  range of the H/L slopes of the sweep
+    #
+    # Returns:  cached critical slope array if one covers the range,
+    #           else None
+    # =====================================
+
+    infoname = os.path.join(folder, "hlsweep_" + key + ".json")
+    arrayname = os.path.join(folder, "hlsweep_" + key + ".npy")
+    if not (os.path.isfile(infoname) and os.path.isfile(arrayname)):
+        return None
+    with open(infoname, "r", encoding="utf_8") as afile:
+        info = json.load(afile)
+    if info["minslope"] > minslope or info["maxslope"] < maxslope:
+        return None
+    return numpy.load(arrayname)
+
+def SaveCriticalSlope(folder, key, minslope, maxslope, crit):
+    # =====================================
+    # Parameters:
+    #   folder:     cache folder, created if needed
+    #   key:        result of SweepCacheKey
+    #   minslope, maxslope:  range of slopes the array is valid for
+    #   crit:       result of CriticalSlope
+    # =====================================
+
+    if not os.path.isdir(folder):
+        os.makedirs(folder, exist_ok=True)
+    numpy.save(os.path.join(folder, "hlsweep_" + key + ".npy"), crit)
+    with open(os.path.join(folder, "hlsweep_" + key + ".json"), "w", encoding="utf_8") as afile:
+        json.dump({"minslope": minslope, "maxslope": maxslope}, afile)
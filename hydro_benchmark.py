@@ -0,0 +1,146 @@
+# ---------------------------------------------------------------------------
+# hydro_benchmark.py
+#
+# Usage: python hydro_benchmark.py [size] [repeat] [results file]
+#   size         rows and columns of the synthetic terrains; default is 1000,
+#                several sizes may be given separated by ";"
+#   repeat       timed runs of every method, the best is kept; default is 3
+#   results file optional text file the table is also written to
+#
+#   Run it with the python of ArcGIS Pro to compare the depression filling
+#  of native_hydro.py and tiled_hydro.py with Spatial Analyst Fill.  The
+#  terrains are generated, not read: a tilted plane with noise pits, a
+#  fractal surface and a surface of closed craters, so the timings cover
+#  DEMs with many small depressions and DEMs with a few large ones.
+#  Every method is run once before it is timed, so the numba compilation
+#  is reported apart and not in the timings.  For every method the table
+#  gives the best time, the cells raised and the largest difference from
+#  Spatial Analyst Fill (or from PriorityFloodFill when arcpy is missing).
+# ---------------------------------------------------------------------------
+
+# Start Up - Import system modules
+import sys, os, time, tempfile, shutil
+import numpy
+import native_hydro
+from native_hydro import PriorityFloodFill
+from tiled_hydro import TiledFill
+
+try:
+    import arcpy                 # optional, Spatial Analyst Fill is timed when available
+    from arcpy.sa import Fill as ArcpyFill
+    arcpy.CheckOutExtension("Spatial")
+except ImportError:
+    arcpy = None
+
+#===========================================================================
+#  Local Functions
+#===========================================================================
+
+def FractalSurface(size, rng, beta=2.4):
+    # surface with a 1 / f**beta power spectrum, scaled to 0 - 1000 m
+    fy = numpy.fft.fftfreq(size)[:, None]
+    fx = numpy.fft.rfftfreq(size)[None, :]
+    f = numpy.sqrt(fx * fx + fy * fy)
+    f[0, 0] = 1.0
+    spectrum = (rng.normal(size=f.shape) + 1j * rng.normal(size=f.shape)) / f ** (beta / 2.0)
+    spectrum[0, 0] = 0.0
+    z = numpy.fft.irfft2(spectrum, s=(size, size))
+    return (z - z.min()) / (z.max() - z.min()) * 1000.0
+
+def SyntheticTerrains(size, seed=1):
+    # =====================================
+    # Returns:  list of (name, float32 DEM array)
+    # =====================================
+    rng = numpy.random.default_rng(seed)
+    rows, cols = numpy.mgrid[0:size, 0:size].astype(numpy.float64)
+
+    # tilted plane with a pit in nearly every cell
+    noise = 1000.0 - 0.5 * rows - 0.2 * cols + rng.random((size, size)) * 5.0
+
+    # fractal relief with depressions of every size
+    fractal = FractalSurface(size, rng)
+
+    # closed craters of different depths on a gentle slope
+    craters = 500.0 - 0.05 * rows
+    for k in range(max(size // 50, 1)):
+        r0, c0 = rng.random(2) * size
+        radius = 5.0 + rng.random() * size / 20.0
+        depth = 10.0 + rng.random() * 40.0
+        distance = numpy.hypot(rows - r0, cols - c0)
+        craters -= depth * numpy.clip(1.0 - distance / radius, 0.0, None)
+
+    return [("noise", noise.astype(numpy.float32)),
+            ("fractal", fractal.astype(numpy.float32)),
+            ("craters", craters.astype(numpy.float32))]
+
+def SpatialAnalystFill(dem, folder):
+    # Spatial Analyst Fill of dem, through a raster written in folder
+    inname = os.path.join(folder, "bench_dem.tif")
+    arcpy.NumPyArrayToRaster(dem, arcpy.Point(0.0, 0.0), 10.0, 10.0).save(inname)
+    filled = ArcpyFill(inname)
+    return arcpy.RasterToNumPyArray(filled).astype(numpy.float32)
+
+def BestTime(func, repeat):
+    # =====================================
+    # Returns:  (best wall time of repeat calls, result of the last call)
+    # =====================================
+    best = None
+    result = None
+    for k in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best:
+            best = seconds
+    return best, result
+
+def main():
+    sizes = [1000]
+    repeat = 3
+    resultsname = None
+    if len(sys.argv) > 1 and sys.argv[1] != "#":
+        sizes = [int(v) for v in sys.argv[1].split(";") if v.strip()]
+    if len(sys.argv) > 2 and sys.argv[2] != "#":
+        repeat = int(sys.argv[2])
+    if len(sys.argv) > 3 and sys.argv[3] != "#":
+        resultsname = sys.argv[3]
+
+    lines = []
+    lines.append("cell loops:  " + ("numba" if native_hydro.NUMBA_AVAILABLE else "plain Python (numba is not installed)"))
+    lines.append("reference:  " + ("Spatial Analyst Fill" if arcpy is not None else "PriorityFloodFill (arcpy is not available)"))
+
+    # compile the cell loops before anything is timed
+    start = time.perf_counter()
+    warmup = SyntheticTerrains(64)[0][1]
+    PriorityFloodFill(warmup)
+    TiledFill(warmup, 32, 1)
+    lines.append("compile and warm-up:  %.2f s" % (time.perf_counter() - start))
+    lines.append("%-8s %7s %-20s %10s %12s %14s" % ("terrain", "size", "method", "seconds", "cells raised", "max difference"))
+
+    folder = tempfile.mkdtemp(prefix="hydro_benchmark_")
+    try:
+        for size in sizes:
+            for name, dem in SyntheticTerrains(size):
+                methods = [("native", lambda: PriorityFloodFill(dem)),
+                           ("tiled", lambda: TiledFill(dem, max(size // 4, 64)))]
+                if arcpy is not None:
+                    methods.insert(0, ("arcpy", lambda: SpatialAnalystFill(dem, folder)))
+                reference = None
+                for method, func in methods:
+                    seconds, filled = BestTime(func, repeat)
+                    if reference is None:
+                        reference = filled
+                    raised = int(numpy.count_nonzero(filled > dem))
+                    difference = float(numpy.nanmax(numpy.abs(filled.astype(numpy.float64) - reference)))
+                    lines.append("%-8s %7d %-20s %10.3f %12d %14.6f" % (name, size, method, seconds, raised, difference))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    for aline in lines:
+        print(aline)
+    if resultsname:
+        with open(resultsname, "w", encoding="utf_8") as afile:
+            afile.write("\n".join(lines) + "\n")
+
+if __name__ == "__main__":
+    main()
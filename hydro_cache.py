@@ -0,0 +1,188 @@
+# ---------------------------------------------------------------------------
+# hydro_cache.py
+#
+# Usage: imported by surface_hydro.py, new_stream_network.py, proximal_zone.py
+#
+#   This module keeps the <prefix>fill, <prefix>dir and <prefix>flac grids
+#  of every DEM conditioned with HYDRO_CACHE = True, so running surface_hydro
+#  again on the same DEM under another prefix copies the grids instead of
+#  computing them.  An entry is found by a hash of the DEM contents, its
+#  position, cell size and coordinate system, and the options the grids
+#  depend on; the stream grid of each threshold is kept in the entry under
+#  the threshold.  Entries are compressed .npz files in one folder per
+#  entry, and the least recently used entries are removed when the cache
+#  grows over its disk quota.
+# ---------------------------------------------------------------------------
+
+# Start Up - Import system modules
+import os, json, time, shutil, hashlib, uuid
+import numpy
+from array_hash import HashArray
+
+PRODUCTS = ("fill", "dir", "flac")
+
+#===========================================================================
+#  Local Functions
+#===========================================================================
+
+def EntrySize(folder):
+    # bytes of the files of a cache entry
+    size = 0
+    for name in os.listdir(folder):
+        filename = os.path.join(folder, name)
+        if os.path.isfile(filename):
+            size += os.path.getsize(filename)
+    return size
+
+def ReadInfo(folder):
+    # info.json of a cache entry, None if it is missing or broken
+    try:
+        with open(os.path.join(folder, "info.json"), "r", encoding="utf_8") as afile:
+            return json.load(afile)
+    except (OSError, ValueError):
+        return None
+
+def WriteInfo(folder, info):
+    filename = os.path.join(folder, "info.json")
+    with open(filename + ".tmp", "w", encoding="utf_8") as afile:
+        json.dump(info, afile, indent=1)
+    os.replace(filename + ".tmp", filename)
+
+def CacheFolder(workspace):
+    # laharz_cache folder of workspace; a geodatabase can not hold plain
+    # files, so the cache of a geodatabase workspace sits next to it
+    if os.path.splitext(workspace.rstrip("\\/"))[1].lower() in (".gdb", ".mdb", ".sde"):
+        workspace = os.path.dirname(workspace.rstrip("\\/"))
+    return os.path.join(workspace, "laharz_cache")
+
+def ThresholdName(threshold):
+    # file name of the stream grid of threshold
+    return "str_" + str(threshold).replace(".", "_") + ".npz"
+
+#===========================================================================
+#  Hydrology cache
+#===========================================================================
+
+def HydroCacheKey(dem, georeference, options, weight=None):
+    # =====================================
+    # Parameters:
+    #   dem:           DEM array, NoData as nan
+    #   georeference:  list of values placing the DEM (lower left corner,
+    #                  cell size, coordinate system name)
+    #   options:       dictionary of the settings the grids depend on
+    #   weight:        optional weight array of flow accumulation
+    #
+    # Returns:  hexadecimal key of the cache entry
+    # =====================================
+    key = hashlib.sha1()
+    HashArray(key, dem)
+    key.update(json.dumps([str(v) for v in georeference]).encode("utf_8"))
+    key.update(json.dumps(options, sort_keys=True).encode("utf_8"))
+    if weight is not None:
+        HashArray(key, weight)
+    return key.hexdigest()
+
+def LoadHydroProducts(folder, key, threshold=None):
+    # =====================================
+    # Parameters:
+    #   folder:     cache folder
+    #   key:        result of HydroCacheKey
+    #   threshold:  stream threshold whose stream grid is wanted
+    #
+    # Returns:  dictionary "fill", "dir", "flac" (and "str" if the
+    #           stream grid of threshold is kept) -> array, or None when
+    #           the DEM is not in the cache
+    # =====================================
+    entry = os.path.join(folder, key)
+    info = ReadInfo(entry)
+    if info is None:
+        return None
+    arrays = {}
+    try:
+        for name in PRODUCTS:
+            with numpy.load(os.path.join(entry, name + ".npz")) as saved:
+                arrays[name] = saved["array"]
+        if threshold is not None and os.path.isfile(os.path.join(entry, ThresholdName(threshold))):
+            with numpy.load(os.path.join(entry, ThresholdName(threshold))) as saved:
+                arrays["str"] = saved["array"]
+    except (OSError, KeyError, ValueError):
+        return None     # a broken entry is treated as missing and replaced
+    info["lastused"] = time.time()
+    WriteInfo(entry, info)
+    return arrays
+
+def SaveHydroProducts(folder, key, arrays, info=None):
+    # =====================================
+    # Parameters:
+    #   folder:  cache folder
+    #   key:     result of HydroCacheKey
+    #   arrays:  dictionary "fill", "dir", "flac" -> array
+    #   info:    JSON-able description kept with the entry
+    #
+    # Writes the entry in a folder of its own and moves it into place,
+    # so a run reading the cache never sees half an entry
+    # =====================================
+    entry = os.path.join(folder, key)
+    if ReadInfo(entry) is not None:
+        return
+    temporary = os.path.join(folder, "tmp_" + uuid.uuid4().hex[:8])
+    os.makedirs(temporary, exist_ok=True)
+    for name in PRODUCTS:
+        with open(os.path.join(temporary, name + ".npz"), "wb") as afile:
+            numpy.savez_compressed(afile, array=arrays[name])
+    details = dict(info or {})
+    details["created"] = time.time()
+    details["lastused"] = details["created"]
+    WriteInfo(temporary, details)
+    shutil.rmtree(entry, ignore_errors=True)
+    try:
+        os.replace(temporary, entry)
+    except OSError:
+        shutil.rmtree(temporary, ignore_errors=True)    # another run saved it first
+
+def SaveStreamProduct(folder, key, threshold, stream):
+    # keeps the stream grid of threshold in an existing entry
+    entry = os.path.join(folder, key)
+    if ReadInfo(entry) is None:
+        return
+    filename = os.path.join(entry, ThresholdName(threshold))
+    with open(filename + ".tmp", "wb") as afile:
+        numpy.savez_compressed(afile, array=stream)
+    os.replace(filename + ".tmp", filename)
+
+def PruneHydroCache(folder, quotamb, keep=None):
+    # =====================================
+    # Parameters:
+    #   folder:   cache folder
+    #   quotamb:  disk space the cache may use (MB)
+    #   keep:     key of an entry never removed (the one just used)
+    #
+    # Removes the least recently used entries until the cache fits
+    #
+    # Returns:  list of the keys removed
+    # =====================================
+    if not os.path.isdir(folder):
+        return []
+    entries = []
+    total = 0
+    for name in os.listdir(folder):
+        entry = os.path.join(folder, name)
+        if not os.path.isdir(entry):
+            continue
+        info = ReadInfo(entry)
+        if info is None:
+            continue    # an entry being written
+        size = EntrySize(entry)
+        total += size
+        entries.append((info.get("lastused", 0.0), name, size))
+    removed = []
+    quota = float(quotamb) * 1048576
+    for lastused, name, size in sorted(entries):
+        if total <= quota:
+            break
+        if name == keep:
+            continue
+        shutil.rmtree(os.path.join(folder, name), ignore_errors=True)
+        total -= size
+        removed.append(name)
+    return removed
@@ -0,0 +1,295 @@
+# ---------------------------------------------------------------------------
+# incremental_hydro.py
+#
+# Usage: imported by surface_hydro.py
+#
+#   This module updates existing <prefix>fill, <prefix>dir and <prefix>flac
+#  arrays after the DEM was edited inside a window (a lidar patch, a new
+#  eruption deposit), recomputing only the cells the edit can reach:
+#  Fill:  the window, every cell that drained into it (its fill rises if the
+#         edit blocks its way out) and the depressions next to it (their
+#         fill drops if the edit opens a lower spill point).  The region is
+#         flooded again from its own border, held at the old fill.
+#  Direction:  the rows around the refilled region, and every flat touching
+#         them, whose cells are directed to their outlets again.
+#  Accumulation:  the cells downstream, by the old or the new directions, of
+#         a cell whose direction changed; the inflow from the other cells is
+#         taken from the old accumulation.
+#  Every other cell keeps its old value, and the result is the same as
+#  conditioning the whole edited DEM again.
+# ---------------------------------------------------------------------------
+
+# Start Up - Import system modules
+import numpy
+from native_hydro import FloodCells, EdgeCells, D8Block, ResolveFlats, DownstreamCells, TopologicalFrontiers
+from native_hydro import NEIGHBOUR_ROWS, NEIGHBOUR_COLS, DIR_NODATA, DIR_SINK, FLAC_NODATA
+
+#===========================================================================
+#  Local Functions
+#===========================================================================
+
+def NeighbourCells(cells, numrows, numcols, k, reverse=False):
+    # =====================================
+    # Parameters:
+    #   cells:  flat cell numbers
+    #   k:      neighbour step (0..7), taken backwards if reverse
+    #
+    # Returns:  (cells with a neighbour inside the DEM, the neighbours)
+    # =====================================
+    sign = -1 if reverse else 1
+    rows = cells // numcols + sign * NEIGHBOUR_ROWS[k]
+    cols = cells % numcols + sign * NEIGHBOUR_COLS[k]
+    inside = (rows >= 0) & (cols >= 0) & (rows < numrows) & (cols < numcols)
+    return cells[inside], rows[inside] * numcols + cols[inside]
+
+def Spread(region, frontier, allowed, numrows, numcols):
+    # =====================================
+    # Parameters:
+    #   region:    flat boolean array, grown in place
+    #   frontier:  cells just added to region
+    #   allowed:   flat boolean array of the cells region may grow into
+    #
+    # Grows region through 8-neighbour allowed cells
+    # =====================================
+    region[frontier] = True
+    while len(frontier) > 0:
+        found = []
+        for k in range(8):
+            cells, neighbours = NeighbourCells(frontier, numrows, numcols, k)
+            neighbours = neighbours[allowed[neighbours] & ~region[neighbours]]
+            region[neighbours] = True
+            found.append(neighbours)
+        frontier = numpy.unique(numpy.concatenate(found))
+
+def Upstream(region, down, numrows, numcols):
+    # =====================================
+    # Parameters:
+    #   region:  flat boolean array, grown in place
+    #   down:    flat array of the cell each cell flows to
+    #
+    # Adds to region every cell whose flow path enters it
+    # =====================================
+    frontier = numpy.flatnonzero(region)
+    while len(frontier) > 0:
+        found = []
+        for k in range(8):
+            cells, donors = NeighbourCells(frontier, numrows, numcols, k)
+            donors = donors[(down[donors] == cells) & ~region[donors]]
+            region[donors] = True
+            found.append(donors)
+        frontier = numpy.concatenate(found)
+
+def Downstream(cells, down, region):
+    # adds to region the cells on the flow paths from cells
+    frontier = cells
+    region[frontier] = True
+    while len(frontier) > 0:
+        frontier = down[frontier]
+        frontier = numpy.unique(frontier[frontier >= 0])
+        frontier = frontier[~region[frontier]]
+        region[frontier] = True
+
+def Dilate(mask):
+    # mask grown by one cell in the 8 directions
+    numrows, numcols = mask.shape
+    padded = numpy.zeros((numrows + 2, numcols + 2), dtype=bool)
+    padded[1:-1, 1:-1] = mask
+    grown = mask.copy()
+    for k in range(8):
+        grown |= padded[1 + NEIGHBOUR_ROWS[k]:1 + NEIGHBOUR_ROWS[k] + numrows, 1 + NEIGHBOUR_COLS[k]:1 + NEIGHBOUR_COLS[k] + numcols]
+    return grown
+
+def Bounds(mask):
+    # (row0, row1, col0, col1) of the True cells of mask
+    rows = numpy.flatnonzero(mask.any(axis=1))
+    cols = numpy.flatnonzero(mask.any(axis=0))
+    return rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+
+#===========================================================================
+#  Update
+#===========================================================================
+
+def UpdateFill(dem, fill, codes, window, epsilon=0.0):
+    # =====================================
+    # Parameters:
+    #   dem:     edited DEM array, NoData as nan
+    #   fill:    old filled DEM
+    #   codes:   old flow directions
+    #   window:  (row0, row1, col0, col1) of the edited cells
+    #   epsilon: see PriorityFloodFill
+    #
+    # Returns:  (new filled DEM, boolean array of the refilled cells)
+    # =====================================
+    numrows, numcols = dem.shape
+    row0, row1, col0, col1 = window
+    region = numpy.zeros(dem.shape, dtype=bool)
+    region[row0:row1, col0:col1] = True
+    region = region.ravel()
+
+    # cells that drained into the window, or into NoData of the window
+    opened = numpy.array(codes, copy=True)
+    edited = opened[row0:row1, col0:col1]
+    edited[edited == DIR_NODATA] = DIR_SINK
+    Upstream(region, DownstreamCells(opened), numrows, numcols)
+
+    # depressions next to the window or to the cells draining into it
+    flooded = (fill > dem).ravel() | region
+    Spread(region, numpy.flatnonzero(Dilate(region.reshape(dem.shape)).ravel() & flooded & ~region),
+           flooded, numrows, numcols)
+    region = region.reshape(dem.shape)
+
+    # flood the region again from its border, held at the old fill
+    valid = ~numpy.isnan(dem)
+    region &= valid
+    newfill = numpy.array(fill, copy=True)
+    if not region.any():
+        newfill[~valid] = numpy.nan
+        return newfill, region
+    r0, r1, c0, c1 = Bounds(Dilate(region))
+    inside = region[r0:r1, c0:c1]
+    subvalid = valid[r0:r1, c0:c1]
+    border = Dilate(inside) & ~inside & subvalid
+    halo = numpy.zeros((r1 - r0 + 2, c1 - c0 + 2), dtype=bool)
+    halo[max(0, 1 - r0):min(r1 - r0 + 2, numrows - r0 + 1), max(0, 1 - c0):min(c1 - c0 + 2, numcols - c0 + 1)] = \
+        valid[max(0, r0 - 1):min(numrows, r1 + 1), max(0, c0 - 1):min(numcols, c1 + 1)]
+    demedge = EdgeCells(halo)[1:-1, 1:-1] & inside
+
+    z = numpy.where(inside, dem[r0:r1, c0:c1], fill[r0:r1, c0:c1]).astype(fill.dtype).ravel()
+    closed = (~inside).ravel().astype(numpy.uint8)
+    seeds = numpy.flatnonzero((border | demedge).ravel())
+    if z.shape[0] < 2 ** 31:
+        seeds = seeds.astype(numpy.int32)
+    FloodCells(z, closed, seeds, r1 - r0, c1 - c0, z.dtype.type(epsilon))
+    newfill[r0:r1, c0:c1][inside] = z.reshape(inside.shape)[inside]
+    newfill[~valid] = numpy.nan
+    return newfill, region
+
+def FlatCells(fill, cells, numrows, numcols):
+    # =====================================
+    # Returns:  boolean, True for the cells with no lower neighbour that
+    #           do not touch the edge of the DEM or NoData
+    # =====================================
+    z = fill.ravel()
+    flat = ~numpy.isnan(z[cells])
+    for k in range(8):
+        rows = cells // numcols + NEIGHBOUR_ROWS[k]
+        cols = cells % numcols + NEIGHBOUR_COLS[k]
+        inside = (rows >= 0) & (cols >= 0) & (rows < numrows) & (cols < numcols)
+        neighbours = numpy.where(inside, rows * numcols + cols, 0)
+        zn = z[neighbours]
+        flat &= inside & ~numpy.isnan(zn) & (zn >= z[cells])
+    return flat
+
+def UpdateDirection(fill, codes, region, window):
+    # =====================================
+    # Parameters:
+    #   fill:    new filled DEM
+    #   codes:   old flow directions
+    #   region:  boolean array of the refilled cells
+    #   window:  (row0, row1, col0, col1) of the edited cells
+    #
+    # Returns:  new flow directions
+    # =====================================
+    numrows, numcols = fill.shape
+    newcodes = numpy.array(codes, copy=True)
+    edited = numpy.array(region, copy=True)
+    edited[window[0]:window[1], window[2]:window[3]] = True    # NoData may have changed
+    row0, row1, col0, col1 = Bounds(Dilate(edited))
+    newcodes[row0:row1] = D8Block(fill, row0, row1)
+
+    # whole flats touching the recomputed rows, at the elevation of a
+    # cell of the rows, are directed again: their outlets may have moved
+    frontier = numpy.arange(row0 * numcols, row1 * numcols)
+    visited = numpy.zeros(numrows * numcols, dtype=bool)
+    visited[frontier] = True
+    z = fill.ravel()
+    flat = newcodes.ravel()
+    unresolved = visited & (flat == DIR_SINK)
+    while len(frontier) > 0:
+        found = []
+        for k in range(8):
+            cells, neighbours = NeighbourCells(frontier, numrows, numcols, k)
+            take = ~visited[neighbours] & (z[neighbours] == z[cells])
+            neighbours = numpy.unique(neighbours[take])
+            neighbours = neighbours[FlatCells(fill, neighbours, numrows, numcols)]
+            visited[neighbours] = True
+            found.append(neighbours)
+        frontier = numpy.unique(numpy.concatenate(found))
+        unresolved[frontier] = True
+    flat[unresolved] = DIR_SINK
+    return ResolveFlats(fill, newcodes)
+
+def UpdateAccumulation(codes, newcodes, accumulation, weight=None):
+    # =====================================
+    # Parameters:
+    #   codes, newcodes:  old and new flow directions
+    #   accumulation:     old flow accumulation (uint32 counts, or
+    #                     float64 weights when weight is given)
+    #   weight:           optional weight of every cell
+    #
+    # Returns:  (new flow accumulation, number of cells recomputed)
+    # =====================================
+    numrows, numcols = codes.shape
+    nodata = newcodes.ravel() == DIR_NODATA
+    down = DownstreamCells(codes)
+    newdown = DownstreamCells(newcodes)
+    changed = numpy.flatnonzero(down != newdown)      # also cells flowing into new NoData
+    region = numpy.zeros(numrows * numcols, dtype=bool)
+    Downstream(changed, down, region)
+    Downstream(changed, newdown, region)
+    region &= ~nodata
+
+    if weight is None:
+        weights = numpy.ones(numrows * numcols, dtype=numpy.float64)
+    else:
+        weights = numpy.nan_to_num(numpy.asarray(weight, dtype=numpy.float64).ravel())
+    weights[nodata] = 0
+    old = numpy.asarray(accumulation, dtype=numpy.float64).ravel()
+    cells = numpy.flatnonzero(region)
+
+    # totals of the region cells, with the inflow of the cells outside
+    total = numpy.zeros(numrows * numcols, dtype=numpy.float64)
+    total[cells] = weights[cells]
+    for k in range(8):
+        targets, donors = NeighbourCells(cells, numrows, numcols, k)
+        take = (newdown[donors] == targets) & ~region[donors]
+        numpy.add.at(total, targets[take], old[donors[take]] + weights[donors[take]])
+
+    # Kahn order inside the region only
+    regiondown = numpy.where(region, newdown, -1)
+    regiondown[regiondown >= 0] = numpy.where(region[regiondown[regiondown >= 0]], regiondown[regiondown >= 0], -1)
+    donors = numpy.zeros(numrows * numcols, dtype=bool)
+    donors[regiondown[regiondown >= 0]] = True
+    for frontier in TopologicalFrontiers(regiondown, numpy.flatnonzero(region & ~donors)):
+        target = regiondown[frontier]
+        keep = target >= 0
+        numpy.add.at(total, target[keep], total[frontier[keep]])
+
+    newaccumulation = numpy.array(accumulation, copy=True).ravel()
+    if weight is None:
+        newaccumulation[cells] = numpy.rint(total[cells] - weights[cells]).astype(newaccumulation.dtype)
+        newaccumulation[nodata] = FLAC_NODATA
+    else:
+        newaccumulation[cells] = total[cells] - weights[cells]
+        newaccumulation[nodata] = numpy.nan
+    return newaccumulation.reshape(codes.shape), len(cells)
+
+def IncrementalUpdate(dem, fill, codes, accumulation, window, epsilon=0.0, weight=None):
+    # =====================================
+    # Parameters:
+    #   dem:           edited DEM array, NoData as nan
+    #   fill, codes, accumulation:  old <prefix>fill, dir and flac arrays
+    #   window:        (row0, row1, col0, col1) of the edited cells
+    #   epsilon:       see PriorityFloodFill
+    #   weight:        optional weight of flow accumulation
+    #
+    # Returns:  (fill, codes, accumulation, dictionary with the number
+    #           of cells refilled, redirected and reaccumulated)
+    # =====================================
+    newfill, region = UpdateFill(dem, fill, codes, window, epsilon)
+    newcodes = UpdateDirection(newfill, codes, region, window)
+    newaccumulation, reaccumulated = UpdateAccumulation(codes, newcodes, accumulation, weight)
+    counts = {"refilled": int(region.sum()),
+              "redirected": int((codes != newcodes).sum()),
+              "reaccumulated": int(reaccumulated)}
+    return newfill, newcodes, newaccumulation, counts
@@ -0,0 +1,350 @@
+# ---------------------------------------------------------------------------
+# merge_engine.py
+#
+# Usage: imported by merge_runs.py
+#
+#   This module merges the runs produced by distal_inundation.py with NumPy.
+#  A run raster stores 1 for background and n + 1 for cells reached by the
+#  n-th smallest volume or any larger one, so cell values are nested.  The
+#  merge of volume x (output merge_<x + 2>) marks every cell where any run is
+#  greater than x + 1.  Keeping a running elementwise maximum of the runs is
+#  therefore enough to build all of the per volume outputs: each run is read
+#  once and each output is a single threshold of the maximum.
+#  StreamMerge does the same in row blocks, for studies with hundreds of runs
+#  that do not all cover the DEM.  A manifest lists the runs already in the
+#  outputs so new runs can be folded in without re-reading the old ones.
+# ---------------------------------------------------------------------------
+
+# Start Up - Import system modules
+import os, json, hashlib
+import numpy
+from array_hash import HashArray
+
+#===========================================================================
+#  Local Functions
+#===========================================================================
+
+def MergeMaximum(maxarray, runarray, shape):
+    # =====================================
+    # Parameters:
+    #   maxarray:  running maximum of the runs merged so far, or None
+    #   runarray:  array of the next run raster
+    #   shape:     (rows, columns) of the merged output
+    #
+    # Folds one run into the running elementwise maximum.  Runs smaller
+    # than the output are aligned to the upper left corner, as merge_runs
+    # always did.
+    #
+    # Returns:  maxarray
+    # =====================================
+
+    if maxarray is None:
+        maxarray = numpy.ones(shape, dtype=numpy.int32)  # 1 is background value
+
+    rows = min(shape[0], runarray.shape[0])
+    cols = min(shape[1], runarray.shape[1])
+    window = maxarray[:rows, :cols]
+    numpy.maximum(window, runarray[:rows, :cols], out=window, casting="unsafe")
+
+    return maxarray
+
+def ThresholdMerges(maxarray, numvolumes):
+    # =====================================
+    # Parameters:
+    #   maxarray:    running maximum of all runs
+    #   numvolumes:  number of volumes used to create the runs
+    #
+    # Generates the merged array of each volume, one at a time, so only
+    # one output is held in memory.  Volume x is written as merge_<x + 2>
+    # with x + 2 where any run is greater than x + 1, and 1 elsewhere.
+    #
+    # Returns:  iterator of (w, merged array)
+    # =====================================
+
+    for x in range(numvolumes):
+        z = x + 1
+        w = x + 2
+        merged = numpy.where(maxarray > z, w, 1).astype(numpy.int32)
+        yield w, merged
+
+def MergeRuns(readrun, numruns, numvolumes, shape, progress=None):
+    # =====================================
+    # Parameters:
+    #   readrun:     function returning the array of run number r
+    #   numruns:     number of run rasters
+    #   numvolumes:  number of volumes used to create the runs
+    #   shape:       (rows, columns) of the merged output
+    #   progress:    optional ProgressReporter
+    #
+    # Reads every run once, keeps the elementwise maximum, then
+    # thresholds it for every volume
+    #
+    # Returns:  iterator of (w, merged array)
+    # =====================================
+
+    maxarray = None
+    for r in range(numruns):
+        maxarray = MergeMaximum(maxarray, readrun(r), shape)
+        if progress is not None:
+            progress.update("merge", r + 1, numruns, "Completed rasterlist number")
+    if maxarray is None:
+        maxarray = numpy.ones(shape, dtype=numpy.int32)
+
+    return ThresholdMerges(maxarray, numvolumes)
+
+#===========================================================================
+#  Streaming merge in row blocks
+#===========================================================================
+
+def RowBlocks(numrows, blockrows):
+    # =====================================
+    # Parameters:
+    #   numrows:    number of rows of the merged output
+    #   blockrows:  number of rows in one block
+    #
+    # Returns:  list of (first row, number of rows) covering the output
+    # =====================================
+
+    blockrows = max(1, int(blockrows))
+    return [(row0, min(blockrows, numrows - row0)) for row0 in range(0, numrows, blockrows)]
+
+def MergeBlock(readrows, runwindows, row0, nrows, numcols):
+    # =====================================
+    # Parameters:
+    #   readrows:    function readrows(r, runrow0, nrows) returning rows
+    #                runrow0 .. runrow0 + nrows - 1 of run r, full run width
+    #   runwindows:  list of (row offset, column offset, rows, columns) of
+    #                every run in output cells; runs need not cover the output
+    #   row0:        first output row of the block
+    #   nrows:       number of rows in the block
+    #   numcols:     number of columns of the output
+    #
+    # Keeps the elementwise maximum of the part of every run that
+    # overlaps the block.  Only one run window is read at a time.
+    #
+    # Returns:  maximum array of the block, (nrows, numcols)
+    # =====================================
+
+    maxblock = numpy.ones((nrows, numcols), dtype=numpy.int32)  # 1 is background value
+    for r in range(len(runwindows)):
+        roff, coff, rrows, rcols = runwindows[r]
+        top = max(row0, roff)
+        bottom = min(row0 + nrows, roff + rrows)
+        left = max(0, coff)
+        right = min(numcols, coff + rcols)
+        if top >= bottom or left >= right:
+            continue    # run does not reach this block
+        runrows = readrows(r, top - roff, bottom - top)
+        window = maxblock[top - row0:bottom - row0, left:right]
+        numpy.maximum(window, runrows[:, left - coff:right - coff], out=window, casting="unsafe")
+    return maxblock
+
+def StreamMerge(readrows, runwindows, numvolumes, shape, writeblock, blockrows=512, workers=1, progress=None):
+    # =====================================
+    # Parameters:
+    #   readrows:    see MergeBlock
+    #   runwindows:  see MergeBlock
+    #   numvolumes:  number of volumes used to create the runs
+    #   shape:       (rows, columns) of the merged output
+    #   writeblock:  function writeblock(w, row0, array) storing the rows of
+    #                output merge_<w> that start at row0
+    #   blockrows:   number of rows processed at a time
+    #   workers:     number of threads thresholding and writing merged
+    #                blocks while the next block is read; 1 runs in order
+    #   progress:    optional ProgressReporter
+    #
+    # Merges the runs block by block so peak memory depends on
+    # blockrows * columns * workers, not on the number or size of runs.
+    # readrows is only called from the calling thread (arcpy is not
+    # thread safe); the worker threads do NumPy work and writeblock only
+    #
+    # Returns:  number of blocks processed
+    # =====================================
+
+    numrows, numcols = shape
+    blocks = RowBlocks(numrows, blockrows)
+
+    def writemerges(row0, maxblock):
+        for w, merged in ThresholdMerges(maxblock, numvolumes):
+            writeblock(w, row0, merged)
+        return row0
+
+    if workers is None or workers <= 1:
+        for b in range(len(blocks)):
+            row0, nrows = blocks[b]
+            writemerges(row0, MergeBlock(readrows, runwindows, row0, nrows, numcols))
+            if progress is not None:
+                progress.update("merge_blocks", b + 1, len(blocks), "Merged row blocks")
+    else:
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+        with ThreadPoolExecutor(max_workers=int(workers)) as pool:
+            pending = set()
+            done = 0
+            for row0, nrows in blocks:
+                # at most workers blocks wait in memory for their outputs
+                while len(pending) >= int(workers):
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        future.result()
+                        done += 1
+                        if progress is not None:
+                            progress.update("merge_blocks", done, len(blocks), "Merged row blocks")
+                maxblock = MergeBlock(readrows, runwindows, row0, nrows, numcols)  # reads on this thread
+                pending.add(pool.submit(writemerges, row0, maxblock))
+            for future in pending:
+                future.result()
+                done += 1
+                if progress is not None:
+                    progress.update("merge_blocks", done, len(blocks), "Merged row blocks")
+
+    return len(blocks)
+
+def OpenMergeMemmaps(folder, numvolumes, shape):
+    # =====================================
+    # Parameters:
+    #   folder:      scratch folder for the memmap files
+    #   numvolumes:  number of volumes used to create the runs
+    #   shape:       (rows, columns) of the merged output
+    #
+    # Creates one disk backed array per merge_<w> output so finished
+    # blocks leave memory as soon as the operating system pages them out
+    #
+    # Returns:  dictionary w -> numpy.memmap
+    # =====================================
+
+    memmaps = {}
+    for x in range(numvolumes):
+        w = x + 2
+        filename = os.path.join(folder, "merge_" + str(w) + ".dat")
+        memmaps[w] = numpy.memmap(filename, dtype=numpy.int32, mode="w+", shape=tuple(shape))
+    return memmaps
+
+#===========================================================================
+#  Incremental merge
+#===========================================================================
+
+def PseudoRun(mergedarrays):
+    # =====================================
+    # Parameters:
+    #   mergedarrays:  dictionary w -> array (or block) of existing merge_<w>
+    #
+    # Rebuilds a run equivalent to everything already merged: the largest
+    # w whose merge_<w> is set, or 1.  Thresholding it gives back every
+    # existing merge_<w>, so it can be merged with new runs like any run.
+    #
+    # Returns:  int32 array
+    # =====================================
+
+    pseudo = None
+    for w in sorted(mergedarrays):
+        merged = mergedarrays[w]
+        if pseudo is None:
+            pseudo = numpy.ones(merged.shape, dtype=numpy.int32)
+        pseudo[merged == w] = w
+    return pseudo
+
+def ArraySignature(array):
+    # ["sha1", hash of the contents of array], the signature of a raster
+    # that is not a file on disk
+    key = hashlib.sha1()
+    HashArray(key, array)
+    return ["sha1", key.hexdigest()]
+
+def RunSignature(pathname, readrows=None, numrows=0, blockrows=512):
+    # =====================================
+    # Parameters:
+    #   pathname:   path of a raster (file, ESRI GRID folder or raster
+    #               in a geodatabase)
+    #   readrows:   optional function readrows(row0, nrows) returning rows
+    #               of the raster, used for rasters that are not files
+    #   numrows:    number of rows of the raster, with readrows
+    #   blockrows:  number of rows hashed at a time
+    #
+    # Returns:  [modification time, size in bytes] used to notice a run
+    #           that was recomputed after it was merged.  A raster in a
+    #           geodatabase has no file of its own, so it gets
+    #           ["sha1", hash of its contents], read in row blocks, when
+    #           readrows is given.  None if no signature can be made;
+    #           callers must then treat the raster as changed.
+    # =====================================
+
+    if os.path.isdir(pathname):
+        mtime = os.path.getmtime(pathname)
+        size = 0
+        for name in os.listdir(pathname):
+            filename = os.path.join(pathname, name)
+            if os.path.isfile(filename):
+                mtime = max(mtime, os.path.getmtime(filename))
+                size += os.path.getsize(filename)
+        return [round(mtime, 3), size]
+    if os.path.isfile(pathname):
+        return [round(os.path.getmtime(pathname), 3), os.path.getsize(pathname)]
+    if readrows is not None:
+        key = hashlib.sha1()
+        try:
+            for row0, nrows in RowBlocks(numrows, blockrows):
+                HashArray(key, readrows(row0, nrows))
+        except Exception:
+            return None
+        return ["sha1", key.hexdigest()]
+    return None
+
+def ReadManifest(filename):
+    # =====================================
+    # Returns:  manifest dictionary, or None if there is none
+    # =====================================
+
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, "r", encoding="utf_8") as afile:
+        return json.load(afile)
+
+def WriteManifest(filename, dem, shape, numvolumes, runs):
+    # =====================================
+    # Parameters:
+    #   filename:    name of the manifest file
+    #   dem:         name of the DEM the outputs are aligned to
+    #   shape:       (rows, columns) of the outputs
+    #   numvolumes:  number of merge_<w> outputs
+    #   runs:        dictionary run name -> RunSignature
+    #
+    # Records which runs the merge_<w> outputs already include
+    # =====================================
+
+    manifest = {"dem": dem, "shape": list(shape), "volumes": numvolumes,
+                "outputs": ["merge_" + str(x + 2) for x in range(numvolumes)],
+                "runs": runs}
+    with open(filename, "w", encoding="utf_8") as afile:
+        json.dump(manifest, afile, indent=2)
+    return manifest
+
+def PlanIncremental(manifest, dem, shape, numvolumes, runs):
+    # =====================================
+    # Parameters:
+    #   manifest:    manifest of the existing outputs, or None
+    #   dem, shape, numvolumes:  inputs of the current merge
+    #   runs:        dictionary run name -> RunSignature of the runs
+    #                listed for the current merge
+    #
+    # Decides whether the existing outputs can be updated with only
+    # the new runs.  Runs that were removed or recomputed since they
+    # were merged can not be taken out again, so they force a full merge.
+    # A run without a signature can not be compared and counts as changed.
+    #
+    # Returns:  (list of new run names, None) or (None, reason for a full merge)
+    # =====================================
+
+    if manifest is None:
+        return None, "no merge manifest found"
+    if manifest.get("dem") != dem or list(manifest.get("shape", [])) != list(shape):
+        return None, "DEM differs from the merged outputs"
+    if manifest.get("volumes") != numvolumes:
+        return None, "number of volumes differs from the merged outputs"
+    merged = manifest.get("runs", {})
+    for name in merged:
+        if name not in runs:
+            return None, "run " + name + " was removed from the list"
+        if runs[name] is None or merged[name] is None or runs[name] != merged[name]:
+            return None, "run " + name + " changed since it was merged"
+    newruns = [name for name in sorted(runs) if name not in merged]
+    return newruns, None
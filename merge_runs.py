@@ -9,15 +9,21 @@
 #
 #   This program will merge runs of the same volume from separate rasters.
 #   The output is a raster containing cells for one volume from all runs at
-#   a volcano.
+#   a volcano.  Each run raster is read once; all of the merge_<w> outputs
+#   are thresholds of the elementwise maximum of the runs (merge_engine.py).
 # ---------------------------------------------------------------------------
 
 # Start Up - Import system modules
-import sys, string, os, arcpy, time
+import sys, string, os, arcpy, importlib, tempfile, shutil
 from arcpy import env
 from arcpy.sa import *
+import run_setting
+from run_metrics import RunMetrics
+from progress_report import MakeReporter
+from merge_engine import MergeRuns, StreamMerge, OpenMergeMemmaps
+from merge_engine import PseudoRun, RunSignature, ReadManifest, WriteManifest, PlanIncremental
 
-starttimetot = time.process_time()  # calculate time for program run
+metrics = RunMetrics("merge_runs")  # calculate time for program run
 
 # Check out license
 arcpy.CheckOutExtension("Spatial")
@@ -26,6 +32,11 @@ arcpy.CheckOutExtension("Spatial")
 #  Local Functions
 #===========================================================================
 
+def LoadSettings():
+    # run_setting.py を毎回読み直して、ArcGIS セッション中の変更も反映する
+    importlib.reload(run_setting)
+    return run_setting.SETTINGS
+
 def ConvertTxtToList(atxtfilename,alist):
     # =====================================
     # Parameters:
@@ -50,12 +61,53 @@ def ConvertTxtToList(atxtfilename,alist):
     afile.close   
     return alist
 
+def RunWindow(rastername, demextent, cellWidth):
+    # =====================================
+    # Parameters:
+    #   rastername:  name of a run raster
+    #   demextent:   extent of the DEM
+    #   cellWidth:   cell size of the DEM
+    #
+    # Locates a run raster on the DEM grid; runs may cover
+    # only part of the DEM
+    #
+    # Returns:  row offset, column offset, rows, columns, extent of the run
+    # =====================================
+
+    desc = arcpy.Describe(rastername)
+    rowoff = int(round((demextent.YMax - desc.extent.YMax) / cellWidth))
+    coloff = int(round((desc.extent.XMin - demextent.XMin) / cellWidth))
+    return rowoff, coloff, desc.height, desc.width, desc.extent
+
+def ReadRunRows(rastername, runextent, numcols, cellWidth, runrow0, nrows):
+    # =====================================
+    # Parameters:
+    #   rastername:  name of a run raster
+    #   runextent:   extent of the run raster
+    #   numcols:     number of columns of the run raster
+    #   cellWidth:   cell size
+    #   runrow0:     first row to read, counted from the top of the run
+    #   nrows:       number of rows to read
+    #
+    # Reads a block of rows of a run raster; NoData is read as
+    # the background value 1
+    #
+    # Returns:  numpyarray (nrows, numcols)
+    # =====================================
+
+    lowerleft = arcpy.Point(runextent.XMin, runextent.YMax - (runrow0 + nrows) * cellWidth)
+    return arcpy.RasterToNumPyArray(rastername, lowerleft, numcols, nrows, 1)
+
 def main():            
+    scratchdir = None   # folder of the memmaps of a streaming merge
+    memmaps = {}
     try:
         #===========================================================================
         # Assign user inputs from menu to appropriate variables
         #===========================================================================
 
+        SETTINGS = LoadSettings()
+        progress = MakeReporter(SETTINGS)  # rate limited messages for the merge loop
         arcpy.AddMessage("Parsing user inputs:")
 
         env.workspace = sys.argv[1]     # set the ArcGIS workspace
@@ -103,90 +155,164 @@ def main():
         lowLeftY = float(xxlly.getOutput(0))
 
         # =====================================
-        #  Convert DEM to NumPyArray and
-        #  get row, column values for boundaries
-        # =====================================
-        arcpy.AddMessage("_________ Convert DEM to Array _________")
-        A = arcpy.RasterToNumPyArray(Input_raster)
-
+        #  Get row, column values for boundaries
+        #  from the raster properties; the DEM itself
+        #  is never converted to an array
         # =====================================
-        #    Get NumPyArray Dimensions
-        # =====================================    
         arcpy.AddMessage("_________ Get Array Dimensions _________")    
-
-        arcpy.AddMessage('Shape is: ' + str(A.shape) + " (rows, colums)") 
-        number_rows = A.shape[0]
-        number_cols = A.shape[1]
+        dem_desc = arcpy.Describe(Input_raster)
+        number_rows = dem_desc.height
+        number_cols = dem_desc.width
+        arcpy.AddMessage('Shape is: ' + str((number_rows, number_cols)) + " (rows, colums)") 
         arcpy.AddMessage('Number of rows is: ' + str(number_rows))
         arcpy.AddMessage('Number of columns is: ' + str(number_cols))
-        del A
-        
+
+        # =====================================
+        #  Incremental merge: read only the runs missing
+        #  from the manifest of the existing merge_<w>;
+        #  the existing outputs are merged back in as one run
+        # =====================================
+        manifestname = PathName + "merge_manifest.json"
+        signatures = None               # run name -> RunSignature, incremental merges only
+        outputList = ["merge_" + str(x + 2) for x in range(numvolumes)]
+
+        sourceList = list(rasterList)   # runs to read
+        useexisting = False             # True if existing merge_<w> are read as a run
+        if SETTINGS.get("MERGE_INCREMENTAL", False):
+            metrics.start("signatures")
+            blockrows = int(SETTINGS.get("MERGE_BLOCK_ROWS", 512))
+            signatures = {}
+            hashed = 0
+            for r in range(numrasters):
+                pathname = os.path.join(env.workspace, rasterList[r])
+                signatures[rasterList[r]] = RunSignature(pathname)
+                if signatures[rasterList[r]] is None:
+                    # raster in a geodatabase: hash its contents in row blocks
+                    runrow0, runcol0, runrows, runcols, runextent = RunWindow(rasterList[r], dem_desc.extent, cellWidth)
+                    def readhashrows(row0, nrows):
+                        return ReadRunRows(rasterList[r], runextent, runcols, cellWidth, row0, nrows)
+                    signatures[rasterList[r]] = RunSignature(pathname, readhashrows, runrows, blockrows)
+                    hashed += 1
+            metrics.stop("signatures")
+            if hashed:
+                arcpy.AddMessage(str(hashed) + " runs are not files on disk (geodatabase): their contents were read "
+                                 "in row blocks to notice recomputed runs")
+                metrics.count("runs_hashed", hashed)
+            newruns, reason = PlanIncremental(ReadManifest(manifestname), Input_raster, (number_rows, number_cols), numvolumes, signatures)
+            if newruns is not None and not all(arcpy.Exists(PathName + aname) for aname in outputList):
+                newruns, reason = None, "merged outputs are missing"
+            if newruns is None:
+                arcpy.AddMessage("Full merge: " + reason)
+            elif len(newruns) == 0:
+                arcpy.AddMessage("Merged outputs already include every run in the list.")
+                sourceList = []
+            else:
+                arcpy.AddMessage("Incremental merge of " + str(len(newruns)) + " new runs: " + str(newruns))
+                sourceList = newruns
+                useexisting = True
+        offset = 1 if useexisting else 0  # index of the first run in sourceList
+        numsources = len(sourceList) + offset
+        metrics.count("runs_merged", len(sourceList))
+
+        # =====================================
+        #  Read each raster in the list of rasters once,
+        #  keeping the elementwise maximum of all runs
+        # =====================================
+        def readrun(r):
+            metrics.start("read_runs")
+            if useexisting and r == 0:
+                B = PseudoRun(dict((x + 2, arcpy.RasterToNumPyArray(PathName + outputList[x])) for x in range(numvolumes)))
+            else:
+                B = arcpy.RasterToNumPyArray(sourceList[r - offset]) # create numpyarray
+            metrics.stop("read_runs")
+            metrics.count("run_rasters_read")
+            return B
+
+        mergemode = SETTINGS.get("MERGE_MODE", "memory")
+        metrics.start("merge")
+        if numsources == 0:
+            merged = []
+        elif mergemode == "stream":
+            # =====================================
+            #  Merge in row blocks; the outputs are kept
+            #  in disk backed arrays until written
+            # =====================================
+            arcpy.AddMessage("_________ Streaming merge in row blocks _________")
+            blockrows = int(SETTINGS.get("MERGE_BLOCK_ROWS", 512))
+            workers = int(SETTINGS.get("MERGE_WORKERS", 1))
+            demextent = dem_desc.extent
+            runinfo = [RunWindow(aname, demextent, cellWidth) for aname in sourceList]
+            if useexisting:
+                runinfo.insert(0, (0, 0, number_rows, number_cols, demextent))
+            runwindows = [info[:4] for info in runinfo]
+
+            def readrows(r, runrow0, nrows):
+                metrics.count("run_blocks_read")
+                if useexisting and r == 0:
+                    return PseudoRun(dict((x + 2, ReadRunRows(PathName + outputList[x], demextent, number_cols, cellWidth, runrow0, nrows)) for x in range(numvolumes)))
+                return ReadRunRows(sourceList[r - offset], runinfo[r][4], runinfo[r][3], cellWidth, runrow0, nrows)
+
+            scratchdir = tempfile.mkdtemp(prefix="merge_", dir=env.workspace)
+            memmaps = OpenMergeMemmaps(scratchdir, numvolumes, (number_rows, number_cols))
+
+            def writeblock(w, row0, block):
+                memmaps[w][row0:row0 + block.shape[0]] = block
+
+            numblocks = StreamMerge(readrows, runwindows, numvolumes, (number_rows, number_cols), writeblock, blockrows, workers, progress)
+            metrics.count("row_blocks", numblocks)
+            # each memmap is released once its raster is written
+            merged = ((w, memmaps.pop(w)) for w in sorted(memmaps))
+        else:
+            merged = MergeRuns(readrun, numsources, numvolumes, (number_rows, number_cols), progress)
+        metrics.stop("merge")
+
         #=============================================
         # For each volume in volume list
         #=============================================                                 
-        for x in range(len(volumeList)):
-            z = x + 1
-            w = x + 2
-            s = 0
-            t = 0
-            A = arcpy.RasterToNumPyArray(Input_raster) # create numpyarray
-            
-            # =====================================
-            #   Set array values to 1
-            # ===================================== 
-            while t < number_rows:
-                for s in range(number_cols):
-                    A[t,s] = 1
-                t = t + 1
-                
-            # =====================================
-            #  For each raster in the list of rasters
-            # =====================================             
-            for r in range(len(rasterList)):        
-                B = arcpy.RasterToNumPyArray(rasterList[r]) # create numpyarray
-
-                number_rowsi = B.shape[0]
-                number_colsi = B.shape[1]
-                
-                i = 0
-                j = 0
-
-                while j < number_rowsi:
-                    for i in range(number_colsi):
-                       if B[j,i] > z:
-                           A[j,i] = w
-                    j = j + 1
-
-                del B  # delete numpyarray of rasters
-                arcpy.AddMessage('Completed rasterlist number : ' + str(r+1))
-                
+        for w, A in merged:
             #================================
             # if raster already exists, delete it
             #================================
+            metrics.start("write")
             currentname = PathName + "merge_" + str(w)
             if arcpy.Exists(currentname):
                 arcpy.Delete_management(currentname) 
+            # integer array gives an integer raster
             myRaster = arcpy.NumPyArrayToRaster(A,arcpy.Point(lowLeftX, lowLeftY),cellWidth,cellWidth)
-            # convert to integer raster
-            outInt = Int(myRaster)
-            outInt.save(currentname)
+            myRaster.save(currentname)
             # build vat for raster
             arcpy.BuildRasterAttributeTable_management(currentname)
 
-            
+            metrics.stop("write")
+            metrics.count("merged_outputs")
             del A   # delete numpyarray of merged rasters
             
             arcpy.AddMessage('Completed merge of : ' + "merge_" + str(w))
 
-        endtimetot = time.process_time()
-        tottime = endtimetot - starttimetot
-        
+        del merged
+
+        # record the runs included in the merged outputs; without
+        # MERGE_INCREMENTAL an older manifest no longer describes them
+        if signatures is not None:
+            WriteManifest(manifestname, Input_raster, (number_rows, number_cols), numvolumes, signatures)
+            arcpy.AddMessage("Merge manifest written to: " + manifestname)
+        elif os.path.isfile(manifestname):
+            os.remove(manifestname)
+
         arcpy.AddMessage("...Processing Complete...")   
-        arcpy.AddMessage("TOTAL TIME:  " + str(tottime) + " seconds")
+        for aline in metrics.summary():
+            arcpy.AddMessage(aline)
+        metrics.writejson(PathName + "laharz_textfiles\\" + "merge_runs_metrics.json")
         
         
     except:
         arcpy.GetMessages(2)
+    finally:
+        # the memmaps are closed before their folder is removed, also
+        # when the merge failed
+        memmaps.clear()
+        if scratchdir is not None:
+            shutil.rmtree(scratchdir, ignore_errors=True)
 
 if __name__ == "__main__":
     main()   
@@ -0,0 +1,415 @@
+# ---------------------------------------------------------------------------
+# native_hydro.py
+#
+# Usage: imported by surface_hydro.py, hydro_benchmark.py
+#
+#   This module computes the surface hydrology grids of surface_hydro.py on
+#  NumPy arrays, without arcpy or a Spatial Analyst license.
+#  Depressions are filled with the priority-flood algorithm (Barnes et al.,
+#  2014): cells are taken from the edge of the DEM inwards in order of
+#  elevation, and a cell lower than the cell it is reached from is raised to
+#  it.  Raised cells go through a plain FIFO queue instead of the heap, so
+#  only cells on the rising front are ever sorted.  The heap and the queue
+#  are flat arrays of cell numbers (int32 while the DEM has fewer than 2**31
+#  cells) and elevations, not Python objects, so the memory used stays a few
+#  bytes per cell.
+#  If numba is installed the cell loops are compiled; otherwise they run as
+#  plain Python, which gives the same results more slowly.
+#  Flow directions use the ESRI D8 codes read by distal_inundation.py
+#       32  64  128
+#       16   x    1
+#        8   4    2
+#  and are computed with whole array shifts, a block of rows at a time.
+#  Flow accumulation is a topological (Kahn) sweep of the D8 graph: cells
+#  with no donors are taken first, pass their totals to the cells they flow
+#  to, and those cells are taken once all their donors are done, so each
+#  cell is visited once.
+# ---------------------------------------------------------------------------
+
+# Start Up - Import system modules
+import numpy
+
+try:
+    from numba import njit       # optional, compiles the cell loops
+except ImportError:
+    njit = None
+
+NUMBA_AVAILABLE = njit is not None   # False: the cell loops run as plain Python
+
+# row and column steps to the 8 neighbours of a cell, and the ESRI
+# flow direction code of each step
+NEIGHBOUR_ROWS = (0, 1, 1, 1, 0, -1, -1, -1)
+NEIGHBOUR_COLS = (1, 1, 0, -1, -1, -1, 0, 1)
+D8_CODES = (1, 2, 4, 8, 16, 32, 64, 128)
+
+DIR_NODATA = 255     # flow direction of NoData cells
+DIR_SINK = 0         # cell with no lower or draining neighbour
+FLAC_NODATA = 4294967295     # uint32 flow accumulation of NoData cells
+
+def Compiled(func):
+    # compile func with numba when it is available
+    if njit is None:
+        return func
+    return njit(cache=True)(func)
+
+#===========================================================================
+#  Heap of cells ordered by elevation
+#===========================================================================
+
+@Compiled
+def HeapPush(keys, cells, size, key, cell):
+    # =====================================
+    # Parameters:
+    #   keys, cells:  arrays holding the heap (elevation, cell number)
+    #   size:  number of cells in the heap
+    #   key, cell:  elevation and number of the cell added
+    #
+    # Returns:  keys, cells (reallocated when full), new size
+    # =====================================
+    if size == keys.shape[0]:
+        keys = numpy.concatenate((keys, numpy.empty_like(keys)))
+        cells = numpy.concatenate((cells, numpy.empty_like(cells)))
+    i = size
+    while i > 0:
+        parent = (i - 1) >> 1
+        if keys[parent] <= key:
+            break
+        keys[i] = keys[parent]
+        cells[i] = cells[parent]
+        i = parent
+    keys[i] = key
+    cells[i] = cell
+    return keys, cells, size + 1
+
+@Compiled
+def HeapPop(keys, cells, size):
+    # =====================================
+    # Returns:  number of the lowest cell, new size
+    # =====================================
+    top = cells[0]
+    size -= 1
+    if size > 0:
+        key = keys[size]
+        cell = cells[size]
+        i = 0
+        while True:
+            child = 2 * i + 1
+            if child >= size:
+                break
+            if child + 1 < size and keys[child + 1] < keys[child]:
+                child += 1
+            if keys[child] >= key:
+                break
+            keys[i] = keys[child]
+            cells[i] = cells[child]
+            i = child
+        keys[i] = key
+        cells[i] = cell
+    return top, size
+
+#===========================================================================
+#  Depression filling
+#===========================================================================
+
+@Compiled
+def FloodCells(z, closed, seeds, numrows, numcols, epsilon):
+    # =====================================
+    # Parameters:
+    #   z:        flat elevation array, filled in place
+    #   closed:   flat uint8 array, 1 for NoData cells, else 0
+    #   seeds:    cell numbers of the cells the flood starts from
+    #   numrows, numcols:  shape of the DEM
+    #   epsilon:  rise given to each filled cell over the cell it is
+    #             reached from; 0 leaves filled areas flat
+    # =====================================
+    size = 0
+    keys = numpy.empty(max(1024, 2 * seeds.shape[0]), dtype=z.dtype)
+    cells = numpy.empty(keys.shape[0], dtype=seeds.dtype)
+    for s in range(seeds.shape[0]):
+        closed[seeds[s]] = 1
+        keys, cells, size = HeapPush(keys, cells, size, z[seeds[s]], seeds[s])
+
+    pit = numpy.empty(z.shape[0], dtype=seeds.dtype)   # each cell queued once at most
+    head = 0
+    tail = 0
+    while size > 0 or head < tail:
+        if head < tail:
+            c = pit[head]
+            head += 1
+        else:
+            c, size = HeapPop(keys, cells, size)
+        zc = z[c]
+        lift = zc
+        if epsilon > 0:
+            lift = zc + epsilon
+            if lift <= zc:
+                lift = numpy.nextafter(zc, numpy.inf)
+        row = c // numcols
+        col = c - row * numcols
+        for k in range(8):
+            r = row + NEIGHBOUR_ROWS[k]
+            q = col + NEIGHBOUR_COLS[k]
+            if r < 0 or q < 0 or r >= numrows or q >= numcols:
+                continue
+            n = r * numcols + q
+            if closed[n]:
+                continue
+            closed[n] = 1
+            if z[n] <= zc or (epsilon > 0 and z[n] < lift):
+                z[n] = lift            # raise the cell and flood on from it
+                pit[tail] = n
+                tail += 1
+            else:
+                keys, cells, size = HeapPush(keys, cells, size, z[n], n)
+
+def EdgeCells(valid):
+    # =====================================
+    # Parameters:
+    #   valid:  boolean array, False on NoData
+    #
+    # Returns:  boolean array of the cells on the edge of the DEM or
+    #           next to NoData, where water can leave the DEM
+    # =====================================
+    numrows, numcols = valid.shape
+    padded = numpy.pad(valid, 1, mode="constant", constant_values=False)
+    inner = valid.copy()
+    for k in range(8):
+        dr = NEIGHBOUR_ROWS[k]
+        dc = NEIGHBOUR_COLS[k]
+        inner &= padded[1 + dr:1 + dr + numrows, 1 + dc:1 + dc + numcols]
+    return valid & ~inner
+
+def PriorityFloodFill(dem, epsilon=0.0):
+    # =====================================
+    # Parameters:
+    #   dem:      DEM array, NoData as nan
+    #   epsilon:  0 fills depressions flat, as arcpy.sa.Fill does; a small
+    #             positive value gives filled areas a slope away from the
+    #             outlet so every cell drains
+    #
+    # Fills every depression of the DEM to the level of its spill point
+    #
+    # Returns:  filled array of the same dtype, NoData as nan
+    # =====================================
+    numrows, numcols = dem.shape
+    if not numpy.issubdtype(dem.dtype, numpy.floating):
+        dem = dem.astype(numpy.float64)
+    z = numpy.array(dem, copy=True).ravel()
+    valid = ~numpy.isnan(dem)
+    if numrows * numcols < 2 ** 31:
+        celltype = numpy.int32
+    else:
+        celltype = numpy.int64
+    closed = (~valid).ravel().astype(numpy.uint8)
+    seeds = numpy.flatnonzero(EdgeCells(valid)).astype(celltype)
+
+    FloodCells(z, closed, seeds, numrows, numcols, z.dtype.type(epsilon))
+    return z.reshape(dem.shape)
+
+#===========================================================================
+#  D8 flow direction
+#===========================================================================
+
+def D8Block(dem, row0, row1):
+    # =====================================
+    # Parameters:
+    #   dem:         DEM array, NoData as nan
+    #   row0, row1:  rows of the block, row1 excluded
+    #
+    # Steepest descent direction of every cell of the block: the drop
+    # to each neighbour is divided by 1 or sqrt(2), and the first of
+    # the steepest directions in code order wins.  Cells with no lower
+    # neighbour that touch the edge of the DEM or NoData flow out of
+    # the DEM, as FlowDirection does.
+    #
+    # Returns:  uint8 direction codes of the block; DIR_SINK where no
+    #           neighbour is lower, DIR_NODATA on NoData
+    # =====================================
+    numrows, numcols = dem.shape
+    top = max(0, row0 - 1)
+    bottom = min(numrows, row1 + 1)
+    halo = numpy.full((row1 - row0 + 2, numcols + 2), numpy.nan, dtype=dem.dtype)
+    halo[1 + top - row0:1 + bottom - row0, 1:-1] = dem[top:bottom]
+    z = dem[row0:row1]
+    nrows = row1 - row0
+
+    codes = numpy.full(z.shape, DIR_SINK, dtype=numpy.uint8)
+    steepest = numpy.zeros(z.shape, dtype=numpy.float64)
+    outside = numpy.zeros(z.shape, dtype=numpy.uint8)     # first step off the DEM
+    for k in (0, 2, 4, 6, 1, 3, 5, 7):                      # cardinal steps first
+        zn = halo[1 + NEIGHBOUR_ROWS[k]:1 + NEIGHBOUR_ROWS[k] + nrows, 1 + NEIGHBOUR_COLS[k]:1 + NEIGHBOUR_COLS[k] + numcols]
+        offdem = numpy.isnan(zn)
+        outside[offdem & (outside == 0)] = D8_CODES[k]
+    for k in range(8):
+        zn = halo[1 + NEIGHBOUR_ROWS[k]:1 + NEIGHBOUR_ROWS[k] + nrows, 1 + NEIGHBOUR_COLS[k]:1 + NEIGHBOUR_COLS[k] + numcols]
+        drop = z - zn
+        if k % 2 == 1:
+            drop = drop / numpy.sqrt(2.0)
+        better = drop > steepest                           # False where zn is nan
+        steepest[better] = drop[better]
+        codes[better] = D8_CODES[k]
+
+    edge = (codes == DIR_SINK) & (outside > 0)
+    codes[edge] = outside[edge]
+    codes[numpy.isnan(z)] = DIR_NODATA
+    return codes
+
+def ResolveFlats(dem, codes):
+    # =====================================
+    # Parameters:
+    #   dem:    DEM array, NoData as nan
+    #   codes:  direction codes from D8Block, changed in place
+    #
+    # Directs the cells of flat areas towards the cells of the same
+    # elevation that already drain, one ring of cells at a time from
+    # the outlets inwards, so each flat cell flows along the shortest
+    # path to an outlet of its flat.  Each ring is processed as arrays
+    # of cell numbers; the work is proportional to the flat cells.
+    # Cells left as DIR_SINK have no outlet at their elevation.
+    # =====================================
+    numrows, numcols = dem.shape
+    z = dem.ravel()
+    flat = codes.ravel()
+    unresolved = numpy.flatnonzero(flat == DIR_SINK)
+    if len(unresolved) == 0:
+        return codes
+    rows = unresolved // numcols
+    cols = unresolved - rows * numcols
+
+    # first ring: flat cells next to a draining cell of the same elevation
+    frontier = []
+    for k in range(8):
+        r = rows + NEIGHBOUR_ROWS[k]
+        c = cols + NEIGHBOUR_COLS[k]
+        inside = (r >= 0) & (c >= 0) & (r < numrows) & (c < numcols)
+        cells = unresolved[inside]
+        neighbours = r[inside] * numcols + c[inside]
+        take = (flat[cells] == DIR_SINK) & (flat[neighbours] != DIR_SINK) & \
+               (flat[neighbours] != DIR_NODATA) & (z[neighbours] == z[cells])
+        flat[cells[take]] = D8_CODES[k]
+        frontier.append(cells[take])
+    frontier = numpy.concatenate(frontier)
+
+    # next rings: flat cells next to the cells directed in the last ring
+    while len(frontier) > 0:
+        rows = frontier // numcols
+        cols = frontier - rows * numcols
+        found = []
+        for k in range(8):
+            # a cell one step opposite to k flows to the frontier cell with code k
+            r = rows - NEIGHBOUR_ROWS[k]
+            c = cols - NEIGHBOUR_COLS[k]
+            inside = (r >= 0) & (c >= 0) & (r < numrows) & (c < numcols)
+            cells = r[inside] * numcols + c[inside]
+            targets = frontier[inside]
+            take = (flat[cells] == DIR_SINK) & (z[cells] == z[targets])
+            cells = cells[take]
+            flat[cells] = D8_CODES[k]
+            found.append(cells)
+        frontier = numpy.concatenate(found)
+    return codes
+
+def D8FlowDirection(dem, blockrows=1024):
+    # =====================================
+    # Parameters:
+    #   dem:        DEM array (normally filled), NoData as nan
+    #   blockrows:  number of rows computed at a time
+    #
+    # Computes ESRI coded D8 flow directions, as FlowDirection does on
+    # a filled DEM, with flat areas directed to their outlets
+    #
+    # Returns:  uint8 array of direction codes, DIR_NODATA on NoData
+    # =====================================
+    numrows, numcols = dem.shape
+    codes = numpy.empty(dem.shape, dtype=numpy.uint8)
+    blockrows = max(1, int(blockrows))
+    for row0 in range(0, numrows, blockrows):
+        row1 = min(numrows, row0 + blockrows)
+        codes[row0:row1] = D8Block(dem, row0, row1)
+    return ResolveFlats(dem, codes)
+
+#===========================================================================
+#  Flow accumulation
+#===========================================================================
+
+def DownstreamCells(codes):
+    # =====================================
+    # Parameters:
+    #   codes:  flow direction array (ESRI codes)
+    #
+    # Returns:  flat array with the cell number each cell flows to, -1
+    #           where the flow leaves the DEM, enters NoData, or the
+    #           code is not a D8 direction (sink, NoData)
+    # =====================================
+    numrows, numcols = codes.shape
+    if numrows * numcols < 2 ** 31:
+        celltype = numpy.int32
+    else:
+        celltype = numpy.int64
+    down = numpy.full(numrows * numcols, -1, dtype=celltype)
+    flat = codes.ravel()
+    for k in range(8):
+        cells = numpy.flatnonzero(flat == D8_CODES[k])
+        rows = cells // numcols + NEIGHBOUR_ROWS[k]
+        cols = cells % numcols + NEIGHBOUR_COLS[k]
+        inside = (rows >= 0) & (cols >= 0) & (rows < numrows) & (cols < numcols)
+        target = rows[inside] * numcols + cols[inside]
+        keep = flat[target] != DIR_NODATA
+        down[cells[inside][keep]] = target[keep]
+    return down
+
+def TopologicalFrontiers(down, start):
+    # =====================================
+    # Parameters:
+    #   down:   flat array of the cell each cell flows to, -1 for none
+    #   start:  cells with no donors to start from
+    #
+    # Yields arrays of cells in topological (Kahn) order: a cell comes
+    # after every cell that flows into it.  The caller may use the
+    # cells of a frontier before the next one is computed.
+    # =====================================
+    donors = numpy.bincount(down[down >= 0], minlength=len(down)).astype(numpy.uint8)
+    frontier = start
+    while len(frontier) > 0:
+        yield frontier
+        target = down[frontier]
+        target = target[target >= 0]
+        numpy.subtract.at(donors, target, 1)
+        target = numpy.unique(target)
+        frontier = target[donors[target] == 0]
+
+def FlowAccumulation(codes, weight=None):
+    # =====================================
+    # Parameters:
+    #   codes:   flow direction array (ESRI codes), DIR_NODATA on NoData
+    #   weight:  optional weight of every cell (nan counted as 0)
+    #
+    # Accumulates, for every cell, the number (or the total weight) of
+    # the cells that flow into it, as FlowAccumulation does
+    #
+    # Returns:  uint32 counts with FLAC_NODATA on NoData, or float64
+    #           weights with nan on NoData when weight is given
+    # =====================================
+    down = DownstreamCells(codes)
+    nodata = codes.ravel() == DIR_NODATA
+    if weight is None:
+        total = numpy.ones(down.shape, dtype=numpy.uint32)
+    else:
+        total = numpy.nan_to_num(numpy.asarray(weight, dtype=numpy.float64).ravel())
+    total[nodata] = 0
+    own = total.copy()
+
+    donors = numpy.zeros(len(down), dtype=bool)
+    donors[down[down >= 0]] = True
+    start = numpy.flatnonzero(~donors & ~nodata)
+    for frontier in TopologicalFrontiers(down, start):
+        target = down[frontier]
+        keep = target >= 0
+        numpy.add.at(total, target[keep], total[frontier[keep]])
+
+    total -= own          # inflow only, the cell itself is not counted
+    if weight is None:
+        total[nodata] = FLAC_NODATA
+    else:
+        total[nodata] = numpy.nan
+    return total.reshape(codes.shape)
@@ -0,0 +1,772 @@
+# ---------------------------------------------------------------------------
+# native_vector.py
+#
+# Usage: imported by raster_to_shapefile.py
+#
+#   This module converts an integer raster into polygons on NumPy arrays,
+#  without arcpy, as RasterToPolygon_conversion does: one polygon for each
+#  group of 4-connected cells of the same value, with its holes.
+#  Boundaries are traced on the cell edges.  Every cell edge between two
+#  different values is directed so the cell it belongs to lies on its right
+#  (outer rings clockwise, holes anticlockwise), and the edge following it
+#  is decided from the two cells ahead of it alone, so the next edge of
+#  every edge is found with whole array operations and each ring is then
+#  read off in one pass over the edges.
+#  Only the corners of the staircase are kept.  With a tolerance the rings
+#  are simplified (Douglas-Peucker) between the vertices where three or more
+#  polygons meet; both polygons along a shared boundary get the same
+#  simplified line, so no gaps or overlaps open between them.
+#  Polygons are written as shapefiles (.shp/.shx/.dbf/.prj) or GeoJSON.
+# ---------------------------------------------------------------------------
+
+# Start Up - Import system modules
+import os, json, struct, datetime
+import numpy
+from native_hydro import Compiled
+
+# edges of a cell, clockwise: top, right, bottom, left; their direction
+# (row and column step) and their first vertex relative to the cell
+EDGE_ROWS = (0, 1, 0, -1)
+EDGE_COLS = (1, 0, -1, 0)
+START_ROWS = (0, 0, 1, 1)
+START_COLS = (0, 1, 1, 0)
+
+NO_POLYGON = -1      # class of NoData cells and of the outside of the raster
+
+#===========================================================================
+#  Local Functions
+#===========================================================================
+
+@Compiled
+def LabelRegions(classes, numrows, numcols):
+    # =====================================
+    # Parameters:
+    #   classes:  flat int32 array of cell classes, NO_POLYGON on NoData
+    #   numrows, numcols:  shape of the raster
+    #
+    # Returns:  (region of every cell, -1 on NoData; number of regions),
+    #           a region being 4-connected cells of one class
+    # =====================================
+    numcells = classes.shape[0]
+    regions = numpy.full(numcells, -1, dtype=numpy.int32)
+    stack = numpy.empty(numcells, dtype=numpy.int64)
+    count = 0
+    for s in range(numcells):
+        if classes[s] < 0 or regions[s] >= 0:
+            continue
+        regions[s] = count
+        stack[0] = s
+        top = 1
+        while top > 0:
+            top -= 1
+            c = stack[top]
+            r = c // numcols
+            col = c - r * numcols
+            for k in range(4):
+                rr = r + EDGE_ROWS[k]
+                cc = col + EDGE_COLS[k]
+                if rr < 0 or rr >= numrows or cc < 0 or cc >= numcols:
+                    continue
+                n = rr * numcols + cc
+                if regions[n] < 0 and classes[n] == classes[s]:
+                    regions[n] = count
+                    stack[top] = n
+                    top += 1
+        count += 1
+    return regions, count
+
+@Compiled
+def FollowRings(successor):
+    # =====================================
+    # Parameters:
+    #   successor:  position of the edge following every edge
+    #
+    # Returns:  (edge positions ring by ring; offsets of the rings and
+    #           the end)
+    # =====================================
+    numedges = successor.shape[0]
+    seen = numpy.zeros(numedges, dtype=numpy.bool_)
+    order = numpy.empty(numedges, dtype=numpy.int64)
+    offsets = numpy.empty(numedges + 1, dtype=numpy.int64)
+    numrings = 0
+    position = 0
+    for s in range(numedges):
+        if seen[s]:
+            continue
+        offsets[numrings] = position
+        numrings += 1
+        e = s
+        while not seen[e]:
+            seen[e] = True
+            order[position] = e
+            position += 1
+            e = successor[e]
+    offsets[numrings] = position
+    return order, offsets[:numrings + 1]
+
+@Compiled
+def FindRoot(parent, c):
+    # root of the set of cell c, halving the path on the way
+    while parent[c] != c:
+        parent[c] = parent[parent[c]]
+        c = parent[c]
+    return c
+
+@Compiled
+def AddCells(cells, parent, size, numrows, numcols):
+    # =====================================
+    # Parameters:
+    #   cells:   flat cell numbers added to the sets
+    #   parent:  flat int64 array, -1 for the cells not added yet
+    #   size:    number of cells of the set of every root
+    #   numrows, numcols:  shape of the raster
+    #
+    # Adds cells and joins them with the 4-connected cells added before
+    # =====================================
+    for i in range(cells.shape[0]):
+        parent[cells[i]] = cells[i]
+        size[cells[i]] = 1
+    for i in range(cells.shape[0]):
+        c = cells[i]
+        r = c // numcols
+        col = c - r * numcols
+        for k in range(4):
+            rr = r + EDGE_ROWS[k]
+            cc = col + EDGE_COLS[k]
+            if rr < 0 or rr >= numrows or cc < 0 or cc >= numcols:
+                continue
+            n = rr * numcols + cc
+            if parent[n] < 0:
+                continue
+            a = FindRoot(parent, c)
+            b = FindRoot(parent, n)
+            if a == b:
+                continue
+            if size[a] < size[b]:
+                a, b = b, a
+            parent[b] = a
+            size[a] += size[b]
+
+@Compiled
+def FindRoots(cells, parent):
+    # roots of the sets of cells
+    roots = numpy.empty(cells.shape[0], dtype=numpy.int64)
+    for i in range(cells.shape[0]):
+        roots[i] = FindRoot(parent, cells[i])
+    return roots
+
+def BoundaryEdges(padded):
+    # =====================================
+    # Parameters:
+    #   padded:  class array with a border of NO_POLYGON around it
+    #
+    # Returns:  (cell, kind) of every edge between a cell with a polygon
+    #           and a cell of another class, ordered by cell and kind
+    # =====================================
+    numrows = padded.shape[0] - 2
+    numcols = padded.shape[1] - 2
+    inner = padded[1:-1, 1:-1]
+    exists = numpy.empty((numrows, numcols, 4), dtype=bool)
+    for k in range(4):
+        # the cell on the left of a clockwise edge is its outward neighbour
+        dr = EDGE_ROWS[(k + 3) % 4]
+        dc = EDGE_COLS[(k + 3) % 4]
+        exists[:, :, k] = (inner != NO_POLYGON) & (padded[1 + dr:1 + dr + numrows, 1 + dc:1 + dc + numcols] != inner)
+    edges = numpy.flatnonzero(exists.ravel())
+    return edges >> 2, (edges & 3).astype(numpy.int8)
+
+def EdgeSuccessors(padded, cell, kind, inside):
+    # =====================================
+    # Parameters:
+    #   padded:      class array with a border of NO_POLYGON around it
+    #   cell, kind:  edges from BoundaryEdges (or a subset of them closed
+    #                into rings)
+    #   inside:      function (values of padded, class of the edge's cell)
+    #                -> True where a cell belongs with the edge's cell
+    #
+    # The edge after an edge turns right round its own cell when the
+    # cell ahead on the right is outside, goes straight when only the
+    # cell ahead on the left is outside, and turns left otherwise, so
+    # polygons touching at a corner only are traced apart
+    #
+    # Returns:  position of the next edge of every edge
+    # =====================================
+    numcols = padded.shape[1] - 2
+    rows = cell // numcols
+    cols = cell - rows * numcols
+    own = padded[rows + 1, cols + 1]
+    steprows = numpy.array(EDGE_ROWS)[kind]
+    stepcols = numpy.array(EDGE_COLS)[kind]
+    outrows = numpy.array(EDGE_ROWS)[(kind + 3) % 4]
+    outcols = numpy.array(EDGE_COLS)[(kind + 3) % 4]
+    aheadright = inside(padded[rows + 1 + steprows, cols + 1 + stepcols], own)
+    aheadleft = inside(padded[rows + 1 + steprows + outrows, cols + 1 + stepcols + outcols], own)
+
+    nextcell = numpy.where(~aheadright, cell,
+                           numpy.where(~aheadleft, cell + steprows * numcols + stepcols,
+                                       cell + (steprows + outrows) * numcols + stepcols + outcols))
+    nextkind = numpy.where(~aheadright, (kind + 1) % 4, numpy.where(~aheadleft, kind, (kind + 3) % 4))
+    ids = cell.astype(numpy.int64) * 4 + kind
+    return numpy.searchsorted(ids, nextcell.astype(numpy.int64) * 4 + nextkind)
+
+def NodeVertices(padded):
+    # =====================================
+    # Returns:  boolean array (rows + 1, columns + 1) of the vertices
+    #           where three or more boundary edges meet, and the corners
+    #           of the raster
+    # =====================================
+    horizontal = padded[:-1, 1:-1] != padded[1:, 1:-1]     # edges along rows of vertices
+    vertical = padded[1:-1, :-1] != padded[1:-1, 1:]       # edges along columns of vertices
+    degree = numpy.zeros((padded.shape[0] - 1, padded.shape[1] - 1), dtype=numpy.int8)
+    degree[:, :-1] += horizontal
+    degree[:, 1:] += horizontal
+    degree[:-1, :] += vertical
+    degree[1:, :] += vertical
+    nodes = degree > 2
+    nodes[[0, 0, -1, -1], [0, -1, 0, -1]] = True
+    return nodes
+
+def SignedArea(points):
+    # shoelace area of a closed ring of (x, y) points; negative when clockwise
+    x = points[:, 0]
+    y = points[:, 1]
+    return 0.5 * float(numpy.dot(x[:-1], y[1:]) - numpy.dot(x[1:], y[:-1]))
+
+def DouglasPeucker(points, tolerance):
+    # =====================================
+    # Returns:  boolean array of the points kept by Douglas-Peucker
+    #           simplification of an open line; the ends are kept
+    # =====================================
+    keep = numpy.zeros(len(points), dtype=bool)
+    keep[0] = True
+    keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start = points[first]
+        vector = points[last] - start
+        length = numpy.hypot(vector[0], vector[1])
+        between = points[first + 1:last] - start
+        if length == 0:
+            distance = numpy.hypot(between[:, 0], between[:, 1])
+        else:
+            distance = numpy.abs(vector[0] * between[:, 1] - vector[1] * between[:, 0]) / length
+        far = int(numpy.argmax(distance))
+        if distance[far] > tolerance:
+            keep[first + 1 + far] = True
+            stack.append((first, first + 1 + far))
+            stack.append((first + 1 + far, last))
+    return keep
+
+def SimplifyArc(vertices, points, tolerance, closed):
+    # =====================================
+    # Parameters:
+    #   vertices:   vertex numbers of an arc (ends included; a closed arc
+    #               repeats its first vertex at the end)
+    #   points:     (column, row) of those vertices
+    #   tolerance:  distance in cells, 0 keeps every vertex
+    #   closed:     True for an arc that is a whole ring
+    #
+    # The arc is simplified in the direction and, for a whole ring, from
+    # the vertex both polygons along it agree on, so the two get the
+    # same line
+    #
+    # Returns:  (boolean array of the vertices kept, key of the arc, True
+    #           when the arc runs against the direction it is keyed in)
+    # =====================================
+    count = len(vertices)
+    if closed:
+        start = int(numpy.argmin(vertices[:-1]))
+        turn = numpy.concatenate((numpy.arange(start, count - 1), numpy.arange(0, start + 1)))
+        if vertices[turn[1]] > vertices[turn[-2]]:
+            turn = turn[::-1]
+    elif vertices[0] > vertices[-1] or (vertices[0] == vertices[-1] and tuple(vertices[::-1]) < tuple(vertices)):
+        turn = numpy.arange(count - 1, -1, -1)
+    else:
+        turn = numpy.arange(count)
+    reverse = count > 2 and (turn[1] - turn[0]) % (count - 1 if closed else count) != 1
+    line = points[turn]
+    if tolerance <= 0:
+        kept = numpy.ones(count, dtype=bool)
+    elif closed or vertices[0] == vertices[-1]:
+        # a loop is split at its point furthest from the start
+        far = int(numpy.argmax(numpy.hypot(line[:, 0] - line[0, 0], line[:, 1] - line[0, 1])))
+        kept = numpy.concatenate((DouglasPeucker(line[:far + 1], tolerance)[:-1], DouglasPeucker(line[far:], tolerance)))
+        if kept.sum() < 4:
+            kept[:] = True         # too small to simplify and stay a ring
+    else:
+        kept = DouglasPeucker(line, tolerance)
+    keep = numpy.empty(count, dtype=bool)
+    keep[turn] = kept
+    if closed:
+        keep[-1] = keep[0]
+    return keep, vertices[turn].tobytes(), bool(reverse)
+
+def ValidRing(points):
+    # =====================================
+    # Returns:  True if a closed (x, y) ring still has an area of the
+    #           sign of an outer ring or hole and no segment gone over twice
+    # =====================================
+    if len(points) < 4:
+        return False
+    segments = set()
+    for a, b in zip(map(tuple, points[:-1]), map(tuple, points[1:])):
+        if (a, b) in segments or (b, a) in segments or a == b:
+            return False
+        segments.add((a, b))
+    return True
+
+def Orientation(ax, ay, bx, by, cx, cy):
+    # sign of the turn a -> b -> c: 1 left, -1 right, 0 straight (in x, y)
+    return numpy.sign((bx - ax) * (cy - ay) - (by - ay) * (cx - ax))
+
+def Between(ax, ay, bx, by, cx, cy):
+    # True where c, on the line through a and b, lies strictly between them
+    return (numpy.minimum(ax, bx) <= cx) & (cx <= numpy.maximum(ax, bx)) & (numpy.minimum(ay, by) <= cy) & \
+           (cy <= numpy.maximum(ay, by)) & ~((cx == ax) & (cy == ay)) & ~((cx == bx) & (cy == by))
+
+def SegmentConflicts(starts, ends, lines, bucket=16):
+    # =====================================
+    # Parameters:
+    #   starts, ends:  (column, row) integer ends of line segments
+    #   lines:         number of the line each segment belongs to
+    #   bucket:        side of the squares segments are sorted into
+    #
+    # Returns:  set of the lines with a segment that crosses, overlaps or
+    #           touches another segment anywhere but at a shared end
+    # =====================================
+    if len(starts) < 2:
+        return set()
+    low = numpy.minimum(starts, ends) // bucket
+    high = numpy.maximum(starts, ends) // bucket
+    # one (square, segment) pair for every square a segment's box covers
+    widths = high[:, 0] - low[:, 0] + 1
+    counts = widths * (high[:, 1] - low[:, 1] + 1)
+    segment = numpy.repeat(numpy.arange(len(starts)), counts)
+    within = numpy.arange(len(segment)) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    squarex = low[segment, 0] + within % widths[segment]
+    squarey = low[segment, 1] + within // widths[segment]
+    square = squarey * (int(high[:, 0].max()) + 2) + squarex
+    sort = numpy.argsort(square, kind="stable")
+    square = square[sort]
+    segment = segment[sort]
+
+    # every pair of segments in a square
+    groupstart = numpy.flatnonzero(numpy.concatenate(([True], square[1:] != square[:-1])))
+    groupsize = numpy.diff(numpy.append(groupstart, len(square)))
+    groupend = numpy.repeat(groupstart + groupsize, groupsize)
+    later = groupend - numpy.arange(len(square)) - 1
+    first = numpy.repeat(numpy.arange(len(square)), later)
+    second = first + 1 + numpy.arange(len(first)) - numpy.repeat(numpy.cumsum(later) - later, later)
+    i = segment[first]
+    j = segment[second]
+
+    ax, ay = starts[i, 0], starts[i, 1]
+    bx, by = ends[i, 0], ends[i, 1]
+    cx, cy = starts[j, 0], starts[j, 1]
+    dx, dy = ends[j, 0], ends[j, 1]
+    o1 = Orientation(ax, ay, bx, by, cx, cy)
+    o2 = Orientation(ax, ay, bx, by, dx, dy)
+    o3 = Orientation(cx, cy, dx, dy, ax, ay)
+    o4 = Orientation(cx, cy, dx, dy, bx, by)
+    crossing = (o1 * o2 < 0) & (o3 * o4 < 0)
+    touching = ((o1 == 0) & Between(ax, ay, bx, by, cx, cy)) | ((o2 == 0) & Between(ax, ay, bx, by, dx, dy)) | \
+               ((o3 == 0) & Between(cx, cy, dx, dy, ax, ay)) | ((o4 == 0) & Between(cx, cy, dx, dy, bx, by))
+    same = ((ax == cx) & (ay == cy) & (bx == dx) & (by == dy)) | ((ax == dx) & (ay == dy) & (bx == cx) & (by == cy))
+    bad = crossing | touching | same
+    return set(lines[i[bad]].tolist()) | set(lines[j[bad]].tolist())
+
+def RingArcs(padded, cell, kind, inside, nodes, tolerance=0.0, split=False):
+    # =====================================
+    # Parameters:
+    #   padded:      class array with a border of NO_POLYGON around it
+    #   cell, kind:  boundary edges, ordered by cell and kind
+    #   inside:      as for EdgeSuccessors
+    #   nodes:       result of NodeVertices
+    #   tolerance:   simplification distance in cells, 0 for none
+    #   split:       True to split rings into arcs without a tolerance
+    #
+    # Returns:  list of rings (cell on the right of the ring's first
+    #           edge, (column, row) corner array, list of arcs from node
+    #           to node as (positions in the corner array, vertices kept,
+    #           key, reverse) from SimplifyArc)
+    # =====================================
+    numcols = padded.shape[1] - 2
+    if len(cell) == 0:
+        return []
+    order, offsets = FollowRings(EdgeSuccessors(padded, cell, kind, inside))
+    ringcell = cell[order]
+    ringkind = kind[order]
+    rows = ringcell // numcols + numpy.array(START_ROWS)[ringkind]
+    cols = ringcell % numcols + numpy.array(START_COLS)[ringkind]
+    vertex = rows.astype(numpy.int64) * (numcols + 1) + cols
+    isnode = nodes.ravel()[vertex]
+
+    # keep the corners (the edge before turns) and the nodes
+    previous = numpy.arange(len(order)) - 1
+    previous[offsets[:-1]] = offsets[1:] - 1
+    keep = (ringkind != ringkind[previous]) | isnode
+
+    rings = []
+    for i in range(len(offsets) - 1):
+        part = slice(offsets[i], offsets[i + 1])
+        corners = numpy.flatnonzero(keep[part])
+        ringvertex = vertex[part][corners]
+        points = numpy.column_stack((cols[part][corners], rows[part][corners])).astype(numpy.float64)
+        arcs = []
+        if tolerance > 0 or split:
+            splits = numpy.flatnonzero(isnode[part][corners])
+            if len(splits) == 0:
+                arc = numpy.append(numpy.arange(len(corners)), 0)
+                arcs.append((arc,) + SimplifyArc(ringvertex[arc], points[arc], tolerance, True))
+            else:
+                # arcs from node to node, the last one running round to the first node
+                for a, b in zip(splits, numpy.append(splits[1:], splits[0] + len(corners))):
+                    arc = numpy.arange(a, b + 1) % len(corners)
+                    arcs.append((arc,) + SimplifyArc(ringvertex[arc], points[arc], tolerance, False))
+        rings.append((int(ringcell[offsets[i]]), points, arcs))
+    return rings
+
+def SimplifyRings(rings, tolerance=0.0):
+    # =====================================
+    # Parameters:
+    #   rings:      result of RingArcs, for one or more sets of edges
+    #               sharing their arcs
+    #   tolerance:  simplification distance the arcs were given
+    #
+    # Returns:  (list of (first cell, (column, row) vertex array closed
+    #           by its first vertex) of every ring; dictionary arc key ->
+    #           (column, row) line of the arc, in the direction of the
+    #           first ring it was met in, and that ring's reverse flag)
+    # =====================================
+    # an arc whose simplification spoils a ring, or crosses or touches
+    # another line, is left as it was, on both sides, until no line does
+    frozen = set()
+    while True:
+        simplified = []
+        spoilt = set()
+        lines = {}
+        for first, points, arcs in rings:
+            kept = numpy.ones(len(points), dtype=bool)
+            for arc, arckeep, key, reverse in arcs:
+                if key not in frozen:
+                    kept[arc] &= arckeep
+                if key not in lines:
+                    line = arc[kept[arc] | (key in frozen)]
+                    if arc[0] == arc[-1] and line[0] != line[-1]:
+                        line = numpy.append(line, line[0])      # a whole ring simplified away from its start
+                    lines[key] = (points[line], reverse)
+            ring = numpy.vstack((points[kept], points[kept][:1]))
+            if tolerance > 0 and (not ValidRing(ring) or SignedArea(ring) * SignedArea(numpy.vstack((points, points[:1]))) <= 0):
+                spoilt.update(arc[2] for arc in arcs if arc[2] not in frozen)
+            simplified.append((first, ring))
+        if not spoilt and tolerance > 0 and lines:
+            keys = list(lines)
+            starts = numpy.vstack([lines[key][0][:-1] for key in keys]).astype(numpy.int64)
+            ends = numpy.vstack([lines[key][0][1:] for key in keys]).astype(numpy.int64)
+            segmentline = numpy.repeat(numpy.arange(len(keys)), [len(lines[key][0]) - 1 for key in keys])
+            spoilt = set(keys[line] for line in SegmentConflicts(starts, ends, segmentline)) - frozen
+        if not spoilt:
+            return simplified, lines
+        frozen |= spoilt
+
+#===========================================================================
+#  Vectorizer
+#===========================================================================
+
+def VectorizeRaster(values, nodata=None, tolerance=0.0):
+    # =====================================
+    # Parameters:
+    #   values:     integer raster array
+    #   nodata:     value of the NoData cells (or a boolean array of them)
+    #   tolerance:  simplification distance in cells, 0 keeps every
+    #               corner of the cell boundaries (arcpy "NO_SIMPLIFY")
+    #
+    # Returns:  list of polygons, dictionaries of:
+    #   value:  raster value of the polygon
+    #   rings:  (column, row) vertex arrays in cell units from the upper
+    #           left corner, outer ring (clockwise) first, then the holes
+    #   cells:  number of cells of the polygon
+    #   ordered by the first cell of each polygon
+    # =====================================
+    numrows, numcols = values.shape
+    if not numpy.issubdtype(values.dtype, numpy.integer):
+        raise ValueError("raster to polygon needs an integer raster, got " + str(values.dtype))
+    if nodata is None:
+        missing = numpy.zeros(values.shape, dtype=bool)
+    elif isinstance(nodata, numpy.ndarray):
+        missing = nodata
+    else:
+        missing = values == nodata
+    codes, classes = numpy.unique(values[~missing], return_inverse=True)
+    padded = numpy.full((numrows + 2, numcols + 2), NO_POLYGON, dtype=numpy.int32)
+    padded[1:-1, 1:-1][~missing] = classes.ravel()
+
+    cell, kind = BoundaryEdges(padded)
+    rings = RingArcs(padded, cell, kind, lambda ahead, own: ahead == own, NodeVertices(padded), tolerance)
+    rings, lines = SimplifyRings(rings, tolerance)
+    cellclass = padded[1:-1, 1:-1].ravel()
+    regions, numregions = LabelRegions(cellclass, numrows, numcols)
+    sizes = numpy.bincount(regions[regions >= 0], minlength=numregions)
+    firsts = numpy.array([first for first, points in rings], dtype=numpy.int64)
+    return AssemblePolygons(rings, regions[firsts].tolist(), sizes[regions[firsts]].tolist(), codes[cellclass[firsts]].tolist())
+
+def VectorizeLevels(values, nodata=None, background=None, tolerance=0.0):
+    # =====================================
+    # Parameters:
+    #   values:      integer raster of nested zones, such as a merged
+    #                raster where larger values mark smaller volumes
+    #   nodata:      value of the NoData cells (or a boolean array of them)
+    #   background:  values up to this one get no zone
+    #   tolerance:   simplification distance in cells
+    #
+    # Makes the polygons of every zone "value >= k", k being each value
+    # above background.  The boundary edges are found once; an edge
+    # between values a > b bounds the zones of every k with b < k <= a,
+    # and the arcs are cut at the nodes of the whole raster, so nested
+    # zones share the same (simplified) line wherever their boundaries
+    # run together.  The regions of the zones come from one union-find
+    # pass adding the cells from the highest value down.
+    #
+    # Returns:  (polygons as for VectorizeRaster, value being the k of
+    #           the zone, with "arcs": for every ring, a list of (line
+    #           number, reversed); list of the (column, row) lines)
+    # =====================================
+    numrows, numcols = values.shape
+    if not numpy.issubdtype(values.dtype, numpy.integer):
+        raise ValueError("raster to polygon needs an integer raster, got " + str(values.dtype))
+    if nodata is None:
+        missing = numpy.zeros(values.shape, dtype=bool)
+    elif isinstance(nodata, numpy.ndarray):
+        missing = nodata
+    else:
+        missing = values == nodata
+    codes, classes = numpy.unique(values[~missing], return_inverse=True)
+    padded = numpy.full((numrows + 2, numcols + 2), NO_POLYGON, dtype=numpy.int32)
+    padded[1:-1, 1:-1][~missing] = classes.ravel()
+    lowest = 0 if background is None else int(numpy.searchsorted(codes, background, side="right"))
+
+    cell, kind = BoundaryEdges(padded)
+    rows = cell // numcols
+    cols = cell - rows * numcols
+    own = padded[rows + 1, cols + 1]
+    outward = (kind + 3) % 4
+    neighbour = padded[rows + 1 + numpy.array(EDGE_ROWS)[outward], cols + 1 + numpy.array(EDGE_COLS)[outward]]
+    nodes = NodeVertices(padded)
+
+    cellclass = padded[1:-1, 1:-1].ravel()
+    order = numpy.argsort(-cellclass, kind="stable")
+    bounds = numpy.searchsorted(-cellclass[order], -numpy.arange(len(codes) + 1), side="right")
+    parent = numpy.full(numrows * numcols, -1, dtype=numpy.int64)
+    size = numpy.zeros(numrows * numcols, dtype=numpy.int64)
+
+    rings = []
+    regions = []
+    cells = []
+    levels = []
+    for k in range(len(codes) - 1, lowest - 1, -1):
+        # zone k: the cells of classes k and above, added to the sets
+        AddCells(order[bounds[k + 1]:bounds[k]].astype(numpy.int64), parent, size, numrows, numcols)
+        edges = (own >= k) & (neighbour < k)
+        zonerings = RingArcs(padded, cell[edges], kind[edges], lambda ahead, own, k=k: ahead >= k, nodes, tolerance, True)
+        roots = FindRoots(numpy.array([first for first, points, arcs in zonerings], dtype=numpy.int64), parent)
+        rings.extend(zonerings)
+        regions.extend((k, int(root)) for root in roots)
+        cells.extend(size[roots].tolist())
+        levels.extend([codes[k]] * len(zonerings))
+
+    simplified, lines = SimplifyRings(rings, tolerance)
+    numbers = {key: number for number, key in enumerate(lines)}
+    arcs = [[(numbers[arc[2]], arc[3]) for arc in ringarcs] for first, points, ringarcs in rings]
+    polygons = AssemblePolygons(simplified, regions, cells, levels, arcs)
+    # lines in the direction they are keyed in, so a reversed arc of any ring reads them backwards
+    return polygons, [line[::-1] if reverse else line for line, reverse in lines.values()]
+
+def AssemblePolygons(rings, regions, cells, values, arcs=None):
+    # =====================================
+    # Parameters:
+    #   rings:    list of (first cell, vertex array) from SimplifyRings
+    #   regions:  key of the region (polygon) of every ring
+    #   cells:    number of cells of the region of every ring
+    #   values:   value written for the polygon of every ring
+    #   arcs:     optional list of the arcs of every ring, kept with it
+    #
+    # Returns:  polygons as for VectorizeRaster, in the order their outer
+    #           rings were traced (by first cell)
+    # =====================================
+    polygons = {}
+    for i, (first, points) in enumerate(rings):
+        region = regions[i]
+        if region not in polygons:
+            polygons[region] = {"value": values[i], "rings": [], "cells": int(cells[i])}
+            if arcs is not None:
+                polygons[region]["arcs"] = []
+        # in (column, row) units y points down, so a clockwise ring has a positive area
+        place = 0 if SignedArea(points) > 0 else len(polygons[region]["rings"])
+        polygons[region]["rings"].insert(place, points)
+        if arcs is not None:
+            polygons[region]["arcs"].insert(place, arcs[i])
+    return list(polygons.values())
+
+def MapCoordinates(rings, xmin, ymax, cellwidth, cellheight):
+    # =====================================
+    # Returns:  rings in map units, from (column, row) cell units of a
+    #           raster whose upper left corner is (xmin, ymax)
+    # =====================================
+    return [numpy.column_stack((xmin + ring[:, 0] * cellwidth, ymax - ring[:, 1] * cellheight)) for ring in rings]
+
+#===========================================================================
+#  Reading and writing
+#===========================================================================
+
+def ReadAsciiGrid(filename):
+    # =====================================
+    # Parameters:
+    #   filename:  ESRI ASCII grid (.asc), as written by RasterToASCII
+    #
+    # Returns:  (array, NoData value or None, xmin, ymax, cell size,
+    #           WKT of the .prj next to it or "")
+    # =====================================
+    header = {}
+    with open(filename, "r") as afile:
+        for skip in range(6):
+            position = afile.tell()
+            words = afile.readline().split()
+            if len(words) != 2 or words[0][0].isdigit() or words[0][0] == "-":
+                afile.seek(position)
+                break
+            header[words[0].lower()] = float(words[1])
+        values = numpy.loadtxt(afile, ndmin=2)
+    cellsize = header["cellsize"]
+    numrows = int(header["nrows"])
+    xmin = header.get("xllcorner", header.get("xllcenter", 0.0) - cellsize / 2.0)
+    ymin = header.get("yllcorner", header.get("yllcenter", 0.0) - cellsize / 2.0)
+    nodata = header.get("nodata_value")
+    if numpy.all(values == numpy.round(values)):
+        values = values.astype(numpy.int64)
+        if nodata is not None:
+            nodata = int(nodata)
+    wkt = ""
+    prjname = os.path.splitext(filename)[0] + ".prj"
+    if os.path.isfile(prjname):
+        with open(prjname, "r") as afile:
+            wkt = afile.read().strip()
+    return values, nodata, xmin, ymin + numrows * cellsize, cellsize, wkt
+
+def WriteShapefile(filename, shapes, fields, records, wkt=""):
+    # =====================================
+    # Parameters:
+    #   filename:  .shp file; .shx, .dbf (and .prj) are written next to it
+    #   shapes:    list of polygons, each a list of (x, y) ring arrays in
+    #              map units, outer rings clockwise
+    #   fields:    list of (name, "N" or "C", width, decimals)
+    #   records:   list of attribute value lists, one per shape
+    #   wkt:       coordinate system for the .prj file, "" for none
+    # =====================================
+    base = os.path.splitext(filename)[0]
+    folder = os.path.dirname(base)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder, exist_ok=True)
+
+    contents = []
+    boxes = []
+    for rings in shapes:
+        allpoints = numpy.vstack(rings) if rings else numpy.zeros((0, 2))
+        box = (allpoints.min(axis=0).tolist() + allpoints.max(axis=0).tolist()) if len(allpoints) else [0.0] * 4
+        boxes.append(box)
+        parts = numpy.cumsum([0] + [len(ring) for ring in rings[:-1]]).astype("<i4")
+        contents.append(struct.pack("<i4d2i", 5, box[0], box[1], box[2], box[3], len(rings), len(allpoints)) +
+                        parts.tobytes() + numpy.ascontiguousarray(allpoints, dtype="<f8").tobytes())
+    if boxes:
+        boxes = numpy.array(boxes)
+        box = [boxes[:, 0].min(), boxes[:, 1].min(), boxes[:, 2].max(), boxes[:, 3].max()]
+    else:
+        box = [0.0] * 4
+
+    def Header(length):
+        # 100 byte main file header; length in 16 bit words
+        return struct.pack(">7i", 9994, 0, 0, 0, 0, 0, length) + struct.pack("<2i8d", 1000, 5, box[0], box[1], box[2], box[3], 0, 0, 0, 0)
+
+    shplength = 50 + sum(4 + len(content) // 2 for content in contents)
+    with open(base + ".shp", "wb") as shp, open(base + ".shx", "wb") as shx:
+        shp.write(Header(shplength))
+        shx.write(Header(50 + 4 * len(contents)))
+        offset = 50
+        for number, content in enumerate(contents):
+            shp.write(struct.pack(">2i", number + 1, len(content) // 2))
+            shp.write(content)
+            shx.write(struct.pack(">2i", offset, len(content) // 2))
+            offset += 4 + len(content) // 2
+
+    # dBase III attribute table
+    today = datetime.date.today()
+    recordlength = 1 + sum(field[2] for field in fields)
+    with open(base + ".dbf", "wb") as dbf:
+        dbf.write(struct.pack("<4BIHH20x", 3, today.year - 1900, today.month, today.day, len(records),
+                              33 + 32 * len(fields), recordlength))
+        for name, kind, width, decimals in fields:
+            dbf.write(struct.pack("<11sc4xBB14x", name.encode("ascii")[:10], kind.encode("ascii"), width, decimals))
+        dbf.write(b"\r")
+        for record in records:
+            dbf.write(b" ")
+            for (name, kind, width, decimals), value in zip(fields, record):
+                if kind == "N":
+                    text = ("%." + str(decimals) + "f") % value if decimals else str(int(value))
+                    dbf.write(text.rjust(width)[:width].encode("ascii"))
+                else:
+                    dbf.write(str(value).ljust(width)[:width].encode("utf_8")[:width].ljust(width))
+        dbf.write(b"\x1a")
+
+    if wkt:
+        with open(base + ".prj", "w") as prj:
+            prj.write(wkt)
+
+def WriteGeoJSON(filename, shapes, fields, records):
+    # =====================================
+    # Parameters as for WriteShapefile; outer rings are written
+    # anticlockwise and holes clockwise as RFC 7946 asks
+    # =====================================
+    features = []
+    for rings, record in zip(shapes, records):
+        coordinates = [ring[::-1].tolist() for ring in rings]
+        features.append({"type": "Feature",
+                         "properties": {field[0]: value for field, value in zip(fields, record)},
+                         "geometry": {"type": "Polygon", "coordinates": coordinates}})
+    with open(filename, "w") as afile:
+        json.dump({"type": "FeatureCollection", "features": features}, afile)
+
+def WriteTopoJSON(filename, lines, layers, numrows, xmin, ymax, cellwidth, cellheight):
+    # =====================================
+    # Parameters:
+    #   filename:  .topojson file
+    #   lines:     (column, row) lines of VectorizeLevels
+    #   layers:    dictionary layer name -> list of (the "arcs" of a
+    #              polygon of VectorizeLevels, dictionary of properties)
+    #   numrows:   rows of the raster
+    #   xmin, ymax, cellwidth, cellheight:  placing of the raster
+    #
+    # Every line is stored once, as whole cell steps from the lower left
+    # corner, and the polygons of all layers refer to the lines, so the
+    # boundaries nested zones share take no more space.  Rings are
+    # written anticlockwise for outer rings as in WriteGeoJSON
+    # =====================================
+    arcs = []
+    for line in lines:
+        quantized = numpy.column_stack((line[:, 0], numrows - line[:, 1])).astype(numpy.int64)
+        quantized[1:] = numpy.diff(quantized, axis=0)
+        arcs.append(quantized.tolist())
+    objects = {}
+    for name, polygons in layers.items():
+        geometries = []
+        for ringarcs, properties in polygons:
+            rings = [[~number if not reverse else number for number, reverse in reversed(ring)] for ring in ringarcs]
+            geometries.append({"type": "Polygon", "arcs": rings, "properties": properties})
+        objects[name] = {"type": "GeometryCollection", "geometries": geometries}
+    topology = {"type": "Topology",
+                "transform": {"scale": [cellwidth, cellheight], "translate": [xmin, ymax - numrows * cellheight]},
+                "objects": objects,
+                "arcs": arcs}
+    with open(filename, "w") as afile:
+        json.dump(topology, afile, separators=(",", ":"))
@@ -5,26 +5,103 @@
 #   sys.argv[1] a workspace
 #   sys.argv[2] a DEM, input surface raster
 #   sys.argv[3] threshold value to demarcate a stream; default is 1000
+#               several thresholds may be given separated by ";"
 #   
 #
 #   This program creates a single stream network raster from an input raster (DEM)
 #  It assumes their is an existing flow direction and flow accumulation rasters
 #  It uses the new threshold to calculate a new stream network
+#  With STREAM_INDEX = True in run_setting.py the stream grids are taken from
+#  a stream network index (stream_index.py) built once from <prefix>flac and
+#  <prefix>dir and kept in laharz_cache, instead of thresholding the grid
 # ---------------------------------------------------------------------------
 
 # Start Up - Import system modules
-import sys, string, os, arcpy
+import sys, string, os, arcpy, importlib
+import numpy
 from arcpy import env
 from arcpy.sa import *
+import run_setting
+from merge_engine import RunSignature, ArraySignature
+from hydro_cache import CacheFolder
+from stream_index import BuildStreamIndex, StreamGrid, SaveStreamIndex, LoadStreamIndex
+from stream_graph import BuildStreamGraph, SaveStreamGraph, GraphFileName
 
 # Check out license
 arcpy.CheckOutExtension("Spatial")
 
+#===========================================================================
+#  Local Functions
+#===========================================================================
+
+def LoadSettings():
+    # run_setting.py を毎回読み直して、ArcGIS セッション中の変更も反映する
+    importlib.reload(run_setting)
+    return run_setting.SETTINGS
+
+def ReadGridArray(rastername, dtype, nodata):
+    # =====================================
+    # Returns:  array of the raster in dtype, nodata on NoData cells
+    # =====================================
+    raster = arcpy.Raster(rastername)
+    A = arcpy.RasterToNumPyArray(raster)
+    missing = numpy.zeros(A.shape, dtype=bool)
+    if raster.noDataValue is not None:
+        missing = A == raster.noDataValue
+    A = A.astype(dtype)
+    A[missing] = nodata
+    return A
+
+def ReadFlacArray(flacname):
+    # flow accumulation array, integer or float as the raster is stored
+    if arcpy.Raster(flacname).isInteger:
+        return ReadGridArray(flacname, numpy.uint32, 0)
+    return ReadGridArray(flacname, numpy.float64, numpy.nan)
+
+def OpenStreamIndex(curdir, prefix, flacname, minthreshold):
+    # =====================================
+    # Parameters:
+    #   curdir:        workspace
+    #   prefix:        prefix of the surface hydrology grids
+    #   flacname:      <prefix>flac
+    #   minthreshold:  lowest threshold the index answers
+    #
+    # Returns:  stream network index of <prefix>flac and <prefix>dir,
+    #           built and saved in laharz_cache when missing or stale.
+    #           Grids in a geodatabase have no file to stamp, so they are
+    #           read and the index is matched by a hash of their contents.
+    # =====================================
+    flacpath = os.path.join(curdir, flacname)     # flacname itself when it is a full path
+    dirname = os.path.join(os.path.dirname(flacpath), prefix + "dir")
+    indexname = os.path.join(CacheFolder(curdir), prefix + "stream_index.npz")
+    signature = [RunSignature(flacpath), RunSignature(dirname), float(minthreshold)]
+    A = D = None
+    if signature[0] is None or signature[1] is None:
+        A = ReadFlacArray(flacname)
+        D = ReadGridArray(dirname, numpy.uint8, 255)
+        signature = [ArraySignature(A), ArraySignature(D), float(minthreshold)]
+    index = LoadStreamIndex(indexname, signature)
+    if index is not None:
+        arcpy.AddMessage("Using stream network index: " + indexname)
+        return index
+    arcpy.AddMessage("Building stream network index from " + flacname + " and " + dirname)
+    if A is None:
+        A = ReadFlacArray(flacname)
+        D = ReadGridArray(dirname, numpy.uint8, 255)
+    index = BuildStreamIndex(A, D, float(minthreshold))
+    SaveStreamIndex(indexname, index, signature)
+    arcpy.AddMessage("Saved stream network index: " + indexname)
+    return index
+
 def main():
     try:
         #===========================================================================
         # Assign user inputs from menu to appropriate variables
         #===========================================================================
+        SETTINGS = LoadSettings()
+        useindex = SETTINGS.get("STREAM_INDEX", False)             # stream grids from the stream network index
+        minthreshold = SETTINGS.get("STREAM_INDEX_MIN", 100)       # lowest threshold kept in the index
+        makegraph = SETTINGS.get("STREAM_GRAPH", False)            # save the stream graph of every grid
         arcpy.AddMessage("Parsing user inputs:")
         
         env.workspace = sys.argv[1]          # set the ArcGIS workspace
@@ -51,15 +128,40 @@ def main():
         arcpy.AddMessage( "Prefix name is: " + atemp2)
         arcpy.AddMessage( "")
         arcpy.AddMessage( "")
-        strname = curdir + "\\" + atemp2 +"str" + str(Stream_Value)
+        thresholds = [v.strip() for v in str(Stream_Value).split(";") if v.strip()]
 
-        # Applying threshold    
-        arcpy.AddMessage( "Calculating new Stream paths:")
-        tempb = GreaterThan(Flow_accum_raster, int(Stream_Value))
-        tempb.save(strname)
+        index = None
+        if useindex and any(int(v) >= minthreshold for v in thresholds):
+            index = OpenStreamIndex(curdir, atemp2, Flow_accum_raster, minthreshold)
+            flac_desc = arcpy.Describe(Flow_accum_raster)
+            lowerleft = arcpy.Point(flac_desc.extent.XMin, flac_desc.extent.YMin)
 
-        arcpy.AddMessage( "Created raster: " + strname)
-        arcpy.AddMessage( "")
+        for Stream_Value in thresholds:
+            strname = curdir + "\\" + atemp2 +"str" + str(Stream_Value)
+
+            # Applying threshold    
+            arcpy.AddMessage( "Calculating new Stream paths:")
+            if index is not None and int(Stream_Value) >= minthreshold:
+                S = StreamGrid(index, int(Stream_Value), 255)
+                tempb = arcpy.NumPyArrayToRaster(S, lowerleft, flac_desc.meanCellWidth, flac_desc.meanCellHeight, 255)
+                tempb.save(strname)
+                arcpy.DefineProjection_management(strname, flac_desc.spatialReference)
+            else:
+                tempb = GreaterThan(Flow_accum_raster, int(Stream_Value))
+                tempb.save(strname)
+                S = None
+
+            arcpy.AddMessage( "Created raster: " + strname)
+
+            # Stream graph saved next to the stream grid
+            if makegraph:
+                if S is None:
+                    S = ReadGridArray(strname, numpy.uint8, 255)
+                dirname = os.path.join(os.path.dirname(os.path.join(curdir, Flow_accum_raster)), atemp2 + "dir")
+                graph = BuildStreamGraph(S, ReadGridArray(dirname, numpy.uint8, 255))
+                SaveStreamGraph(GraphFileName(strname), graph)
+                arcpy.AddMessage( "Created stream graph: " + GraphFileName(strname))
+            arcpy.AddMessage( "")
         
         arcpy.AddMessage( "Processing Complete.")
 
@@ -0,0 +1,48 @@
+# ---------------------------------------------------------------------------
+# process_pool.py
+#
+# Usage: imported by tiled_hydro.py, raster_to_shapefile.py
+#
+#   This module starts the pools of worker processes of the Laharz_py tools.
+#  Inside ArcGIS Pro sys.executable is ArcGISPro.exe, so a pool started with
+#  the defaults would launch copies of ArcGIS Pro instead of Python.  The
+#  pools are started with the "spawn" method (the only one on Windows) and
+#  the pythonw.exe of the Python environment of ArcGIS Pro.
+#  A spawned worker imports the module of the function it runs by name, and
+#  the script that started the pool as __mp_main__ (its main() is not run),
+#  so the module of the function must be importable from the folder of the
+#  toolbox and should not import arcpy or check out a license at import.
+# ---------------------------------------------------------------------------
+
+# Start Up - Import system modules
+import os, sys, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+#===========================================================================
+#  Local Functions
+#===========================================================================
+
+def PythonExecutable():
+    # =====================================
+    # Returns:  interpreter the workers are started with: sys.executable
+    #           when it is a Python, else pythonw.exe (or python.exe) of
+    #           sys.exec_prefix, the Python environment of ArcGIS Pro
+    # =====================================
+    if os.path.basename(sys.executable).lower().startswith("python"):
+        return sys.executable
+    for name in ("pythonw.exe", "python.exe"):
+        filename = os.path.join(sys.exec_prefix, name)
+        if os.path.isfile(filename):
+            return filename
+    return sys.executable
+
+def ProcessPool(workers):
+    # =====================================
+    # Parameters:
+    #   workers:  number of processes
+    #
+    # Returns:  ProcessPoolExecutor of spawned Python processes
+    # =====================================
+    context = multiprocessing.get_context("spawn")
+    context.set_executable(PythonExecutable())
+    return ProcessPoolExecutor(max_workers=int(workers), mp_context=context)
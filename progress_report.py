@@ -0,0 +1,163 @@
+# ---------------------------------------------------------------------------
+# progress_report.py
+#
+# Usage: imported by the Laharz_py tools (distal_inundation.py, merge_runs.py)
+#
+#   This module provides progress reporters used in place of calling
+#  arcpy.AddMessage inside loops.  Messages carry a verbosity level and
+#  progress counts are rate limited, so a hot loop only emits a periodic
+#  aggregate line ("stream cells traversed: 12000 (2400/s)").
+#  Backends:
+#    "arcpy"    messages go to the geoprocessing window (arcpy.AddMessage)
+#    "console"  messages are printed to standard output
+#    "none"     messages are discarded
+# ---------------------------------------------------------------------------
+
+# Start Up - Import system modules
+import sys, time
+
+# verbosity levels
+QUIET = 0      # warnings only
+NORMAL = 1     # stage headings and periodic progress
+VERBOSE = 2    # per run / per raster details
+DEBUG = 3      # per cell details (slow in ArcGIS Pro)
+
+LEVELS = {"QUIET": QUIET, "NORMAL": NORMAL, "VERBOSE": VERBOSE, "DEBUG": DEBUG}
+
+#===========================================================================
+#  Reporter classes
+#===========================================================================
+
+class ProgressReporter(object):
+    # =====================================
+    # Parameters:
+    #   verbosity:  one of QUIET, NORMAL, VERBOSE, DEBUG
+    #   interval:   minimum number of seconds between two progress
+    #               lines of the same counter
+    #
+    # Base class; subclasses override emit()
+    # =====================================
+
+    def __init__(self, verbosity=NORMAL, interval=5.0):
+        self.verbosity = verbosity
+        self.interval = float(interval)
+        self.counters = {}   # key -> [start time, time of last line]
+
+    def emit(self, text, warning=False):
+        pass
+
+    def wants(self, level):
+        # True if messages of this level are shown; use to skip building
+        # message strings in loops
+        return level <= self.verbosity
+
+    def message(self, text, level=NORMAL):
+        if level <= self.verbosity:
+            self.emit(text)
+
+    def detail(self, text):
+        self.message(text, DEBUG)
+
+    def warning(self, text):
+        self.emit(text, True)
+
+    def update(self, key, done, total=None, text=None):
+        # =====================================
+        # Parameters:
+        #   key:    name of the counter, e.g. "traverse"
+        #   done:   number of items completed so far
+        #   total:  number of items expected, if known
+        #   text:   label printed with the count, defaults to key
+        #
+        # Emits a progress line at most once per interval per key,
+        # and always when done reaches total
+        # =====================================
+        if self.verbosity < NORMAL:
+            return
+        now = time.perf_counter()
+        timing = self.counters.get(key)
+        if timing is None:
+            timing = [now, now]
+            self.counters[key] = timing
+        finished = total is not None and done >= total
+        if not finished and now - timing[1] < self.interval:
+            return
+        timing[1] = now
+        self.emit(self.format(key, done, total, text, now - timing[0]))
+
+    def finish(self, key, done, total=None, text=None):
+        # emit the final count of a counter and reset it
+        timing = self.counters.pop(key, None)
+        if self.verbosity < NORMAL:
+            return
+        elapsed = 0.0 if timing is None else time.perf_counter() - timing[0]
+        self.emit(self.format(key, done, total, text, elapsed))
+
+    def format(self, key, done, total, text, elapsed):
+        label = key if text is None else text
+        line = label + ": " + str(done)
+        if total:
+            line = line + " / " + str(total) + " (" + str(int(100.0 * done / total)) + "%)"
+        if elapsed > 0:
+            line = line + " - " + str(round(done / elapsed, 1)) + "/s"
+        return line
+
+
+class ArcpyProgress(ProgressReporter):
+    # messages go to the ArcGIS geoprocessing window
+
+    def emit(self, text, warning=False):
+        import arcpy
+        if warning:
+            arcpy.AddWarning(text)
+        else:
+            arcpy.AddMessage(text)
+
+
+class ConsoleProgress(ProgressReporter):
+    # messages are printed to standard output
+
+    def emit(self, text, warning=False):
+        if warning:
+            text = "WARNING: " + text
+        print(text)
+        sys.stdout.flush()
+
+
+class NullProgress(ProgressReporter):
+    # messages are discarded
+
+    def __init__(self, verbosity=QUIET, interval=0.0):
+        ProgressReporter.__init__(self, QUIET, interval)
+
+    def message(self, text, level=NORMAL):
+        pass
+
+    def warning(self, text):
+        pass
+
+
+def MakeReporter(settings):
+    # =====================================
+    # Parameters:
+    #   settings:  dictionary SETTINGS from run_setting.py
+    #
+    # Creates the reporter selected by "PROGRESS", "VERBOSITY"
+    # and "PROGRESS_INTERVAL"
+    #
+    # Returns:  a ProgressReporter
+    # =====================================
+
+    kind = str(settings.get("PROGRESS", "arcpy")).lower()
+    verbosity = settings.get("VERBOSITY", "NORMAL")
+    if not isinstance(verbosity, int):
+        verbosity = LEVELS[str(verbosity).upper()]
+    interval = settings.get("PROGRESS_INTERVAL", 5.0)
+
+    if kind == "arcpy":
+        return ArcpyProgress(verbosity, interval)
+    if kind == "console":
+        return ConsoleProgress(verbosity, interval)
+    if kind == "none":
+        return NullProgress()
+    raise ValueError("Unknown PROGRESS setting: " + str(kind))
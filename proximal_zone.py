@@ -21,9 +21,18 @@
 # ---------------------------------------------------------------------------
 
 # Start Up - Import system modules
-import sys, string, os, arcpy
+import sys, string, os, arcpy, importlib
+import numpy
 from arcpy import env
 from arcpy.sa import *
+import run_setting
+from run_metrics import RunMetrics
+from hl_cone import MaximumElevationApexes, PointApexes, ConeMask
+from hl_cone import BoundaryStreamPoints
+from start_points import DedupeStartPoints
+from scratch_store import ScratchStore
+from hl_cone import CriticalSlope, SweepCacheKey, LoadCriticalSlope, SaveCriticalSlope
+from hydro_cache import CacheFolder
 
 # Check out license
 arcpy.CheckOutExtension("Spatial")
@@ -32,6 +41,11 @@ arcpy.CheckOutExtension("Spatial")
 #  Local Functions
 #===========================================================================
 
+def LoadSettings():
+    # run_setting.py を毎回読み直して、ArcGIS セッション中の変更も反映する
+    importlib.reload(run_setting)
+    return run_setting.SETTINGS
+
 ##def getdat(atxtfilename,alist):
 ##    # =====================================
 ##    # Parameters:
@@ -112,12 +126,235 @@ def makepointlist(cellx,celly,oneptlist):
 
     return oneptlist
      
+def ConeStartPoints(curdir, scratch, slope_value, Input_surface_raster, Input_stream_raster, Input_direction_raster, metrics, SETTINGS):
+    # =====================================
+    # Parameters:
+    #   curdir:  workspace
+    #   scratch:  ScratchStore holding the H/L cone, as array "xhltemp"
+    #             or as raster xhltemp.tif
+    #   slope_value:  decimal slope of the cone, as text
+    #   Input_surface_raster:  name of DEM
+    #   Input_stream_raster:  name of stream raster
+    #   Input_direction_raster:  name of flow direction raster
+    #   metrics:  RunMetrics of the tool run
+    #   SETTINGS:  dictionary SETTINGS from run_setting.py
+    #
+    # Finds the cone boundary and writes the cells where it crosses a
+    # stream to startpnts_<slope>.txt and firstpnt_<slope>.txt
+    # With BOUNDARY_METHOD "arcpy" the cone goes through polygon, line
+    # and raster conversions; with "numpy" the boundary is found on the
+    # cone array directly.  hl_cone<slope>.shp and startpts_<slope>.shp
+    # are written by "numpy" only if WRITE_VECTOR_PRODUCTS is True.
+    # With START_POINT_DEDUP only one start point per channel is written.
+    #
+    # Returns:  number of start points
+    # =====================================
+
+    textdir = curdir + "\\laharz_textfiles\\"
+    shapedir = curdir + "\\laharz_shapefiles\\"
+    slopename = str(slope_value).split('.')[1]
+    hlshapename = shapedir + "startpts_"+slopename+".shp"
+    txfileuno = textdir + "firstpnt_"+slopename+".txt"
+    txfile = textdir + "startpnts_"+slopename+".txt"
+
+    boundarymethod = SETTINGS.get("BOUNDARY_METHOD", "arcpy")   # "arcpy" or "numpy"
+    writevectors = bool(SETTINGS.get("WRITE_VECTOR_PRODUCTS", False))
+    dem_desc = arcpy.Describe(Input_surface_raster)
+    demext = dem_desc.extent
+    cellsize = dem_desc.meanCellWidth
+
+    conemask = None
+    conetif = scratch.path("xhltemp.tif")
+    if "xhltemp" in scratch:
+        # cone computed with numpy; written as a raster only when needed
+        conemask = scratch.get("xhltemp")
+        conetif = scratch.path("xhltemp_" + slopename + ".tif")
+        if boundarymethod == "arcpy" or writevectors:
+            # 1 inside the cone, NoData outside, as Con(c_minus_dem > 0, 1)
+            hl_cone_g2 = arcpy.NumPyArrayToRaster(conemask.astype(numpy.uint8), arcpy.Point(demext.XMin, demext.YMin), cellsize, cellsize, 0)
+            hl_cone_g2.save(conetif)
+
+    if boundarymethod == "numpy":
+        metrics.start("boundary")
+        if conemask is None:
+            conemask = arcpy.RasterToNumPyArray(conetif, nodata_to_value=0) > 0
+        if writevectors:
+            arcpy.RasterToPolygon_conversion(conetif, shapedir + "hl_cone" + slopename + ".shp", "SIMPLIFY", "VALUE")
+        metrics.stop("boundary")
+
+        metrics.start("start_points")
+        # =====================================
+        # cone boundary cells crossed by a stream, from the arrays
+        # =====================================
+        arcpy.AddMessage( "Finding intersections of streams and hlcone boundary:")
+        arcpy.AddMessage( "        ")
+        stream = arcpy.RasterToNumPyArray(Input_stream_raster, arcpy.Point(demext.XMin, demext.YMin), conemask.shape[1], conemask.shape[0], 0)
+        rows, cols, x, y = BoundaryStreamPoints(conemask, stream, demext.XMin, demext.YMax, cellsize)
+        del stream
+
+        if writevectors and len(x) > 0:
+            points = numpy.zeros(len(x), dtype=[("POINT_X", numpy.float64), ("POINT_Y", numpy.float64)])
+            points["POINT_X"] = x
+            points["POINT_Y"] = y
+            arcpy.da.NumPyArrayToFeatureClass(points, hlshapename, ("POINT_X", "POINT_Y"), dem_desc.spatialReference)
+
+    else:
+        x, y = ArcpyConeStartPoints(curdir, scratch, conetif, slopename, Input_surface_raster, Input_stream_raster, metrics)
+
+    # =====================================
+    # one start point per channel
+    # =====================================
+    if SETTINGS.get("START_POINT_DEDUP", False) and len(x) > 0:
+        pathcells = int(SETTINGS.get("DEDUP_PATH_CELLS", 10))
+        direction = arcpy.RasterToNumPyArray(Input_direction_raster, arcpy.Point(demext.XMin, demext.YMin), dem_desc.width, dem_desc.height, 0)
+        rows = numpy.floor((demext.YMax - y) / cellsize).astype(numpy.int64)
+        cols = numpy.floor((x - demext.XMin) / cellsize).astype(numpy.int64)
+        keep, merged = DedupeStartPoints(rows, cols, direction, pathcells)
+        del direction
+        for j, i in merged:
+            arcpy.AddMessage( "Start point %d,%d is on the path of %d,%d:  merged" % (x[j], y[j], x[i], y[i]))
+        arcpy.AddMessage( "Start points at cone/stream intersections:  " + str(len(x)))
+        arcpy.AddMessage( "Start points kept, one per channel:  " + str(len(keep)))
+        arcpy.AddMessage( "distal_inundation runs avoided:  " + str(len(x) - len(keep)))
+        metrics.count("runs_avoided", len(x) - len(keep))
+        x = x[keep]
+        y = y[keep]
+
+    # =====================================
+    # open files for write, write heading to file of list of coordinates
+    # =====================================
+    runo = open(txfileuno, 'w', encoding="utf_8_sig")
+    report = open(txfile, 'w', encoding="utf_8_sig")
+    if len(x) > 0:
+        # write first X, Y to file
+        runo.write(" %d,%d" % (x[0], y[0]))
+    for i in range(len(x)):
+        report.write(" %d,%d" % (x[i], y[i]))
+        report.write("\n")
+    report.close()
+    runo.close()
+    metrics.count("start_points", len(x))
+    metrics.stop("start_points")
+    return len(x)
+
+def ArcpyConeStartPoints(curdir, scratch, conetif, slopename, Input_surface_raster, Input_stream_raster, metrics):
+    # =====================================
+    # Parameters:
+    #   curdir:  workspace
+    #   scratch:  ScratchStore for the intermediate datasets
+    #   conetif:  name of the H/L cone raster
+    #   slopename:  decimal part of the slope, used in the file names
+    #   Input_surface_raster:  name of DEM
+    #   Input_stream_raster:  name of stream raster
+    #   metrics:  RunMetrics of the tool run
+    #
+    # Converts the cone to hl_cone<slope>.shp and back to an outline
+    # raster, and converts its cells on the streams to startpts_<slope>.shp
+    #
+    # Returns:  x, y arrays of the start points
+    # =====================================
+
+    shapedir = curdir + "\\laharz_shapefiles\\"
+    hlconename = "hlcone"+slopename+"_g"
+    hlshapename = shapedir + "startpts_"+slopename+".shp"
+    hlgridname = scratch.path("stpts_g"+slopename)
+    conepoly = scratch.path("hl_cone_1_"+slopename+".shp")
+    coneline = scratch.path("hl_cone_2_"+slopename+".shp")
+
+    metrics.start("boundary")
+
+    # =====================================   
+    # convert the gridline of intersection of the cone and DEM to a polygon
+    # =====================================
+    # Raster to Polygon
+    arcpy.AddMessage( "Converting cone/elevation intersection Raster to Polygon:")
+    arcpy.AddMessage( "        ")
+    arcpy.RasterToPolygon_conversion(conetif, conepoly, "SIMPLIFY", "VALUE")
+    arcpy.RasterToPolygon_conversion(conetif, curdir + "\\laharz_shapefiles\\" + "hl_cone" + slopename + ".shp", "SIMPLIFY", "VALUE")
+    
+    # convert the polygon to a polyline
+    # Polygon Feature To Line
+    arcpy.AddMessage( "Converting Cone Polygon to Line:")
+    arcpy.AddMessage( "        ")
+    arcpy.FeatureToLine_management(conepoly, coneline, "", "ATTRIBUTES")
+
+    # =====================================
+    # convert the polyline back to a raster
+    # =====================================
+    # Polyline to Raster
+    arcpy.AddMessage( "Converting Cone line back to a Cone outline Raster:")
+    arcpy.AddMessage( "        ")
+    arcpy.PolylineToRaster_conversion(coneline, "GRIDCODE", hlconename, "MAXIMUM_LENGTH", "NONE", Input_surface_raster)
+    
+    arcpy.AddMessage( "")
+    arcpy.AddMessage( "_______________________________")
+    arcpy.AddMessage( "Finding Intersection locations of streams")
+    arcpy.AddMessage( "and H/L Cone and store coordinates as start points:")
+    arcpy.AddMessage( "_______________________________")
+    arcpy.AddMessage( "")
+
+    metrics.stop("boundary")
+    metrics.start("start_points")
+
+    # intersect_g
+    arcpy.AddMessage( "Finding intersections of streams and hlcone:")
+    arcpy.AddMessage( "        ")
+    intersect_g = Plus(hlconename, Input_stream_raster)
+    
+    # Extract by Attributes
+    arcpy.AddMessage( "Extracting intersections from raster:")
+    arcpy.AddMessage( "        ")
+    temp11c = ExtractByAttributes(intersect_g, "VALUE = 2")
+    temp11c.save(hlgridname)
+
+    # Raster to Point
+    arcpy.AddMessage( "Converting intersection locations to point shape file:")
+    arcpy.AddMessage( "        ")
+    arcpy.RasterToPoint_conversion(hlgridname, hlshapename, "VALUE")
+    
+    # Add X and Y coordinates to shape file
+    arcpy.AddMessage( "adding X and Y coordinates to attribute table:")
+    arcpy.AddMessage( "        ")
+    arcpy.AddXY_management(hlshapename)
+    
+    arcpy.AddMessage( "")
+    arcpy.AddMessage( "_______________________________")
+    arcpy.AddMessage( "Writing X and Y locations of  ")
+    arcpy.AddMessage( "intersections to a textfile:")
+    arcpy.AddMessage( "_______________________________")
+    arcpy.AddMessage( "")
+    
+    # set up search cursor
+    rows = arcpy.SearchCursor(hlshapename,"","","POINT_X; POINT_Y","")
+
+    # Get the first feature in the searchcursor
+    row = rows.next()
+
+    # local variables
+    x = []
+    y = []
+
+    # Iterate through the rows in the cursor
+    while row:
+        x.append(row.POINT_X)
+        y.append(row.POINT_Y)
+        row = rows.next()
+
+    return numpy.array(x, dtype=numpy.float64), numpy.array(y, dtype=numpy.float64)
+
 def main():        
+    scratch = None   # scratch store of this run, removed also when the run fails
     try:
 
         #===========================================================================
         # Assign user inputs from menu to appropriate variables
         #===========================================================================
+        metrics = RunMetrics("proximal_zone") # wall/cpu time of stages and counters
+        SETTINGS = LoadSettings()
+        conemethod = SETTINGS.get("CONE_METHOD", "arcpy") # "arcpy" raster algebra or "numpy" arrays
+        sweep = list(SETTINGS.get("HL_SWEEP_SLOPES", []))  # slopes computed in one run, if any
+        if sweep:
+            conemethod = "numpy"           # the sweep needs the critical slope array
         arcpy.AddMessage("Parsing user inputs:")
         env.workspace = sys.argv[1]        # set the ArcGIS workspace 
         Input_surface_raster = sys.argv[2] # name of DEM
@@ -131,7 +368,8 @@ def main():
         # Set the ArcGIS environment settings
         #=============================================
         
-        env.scratchWorkspace = env.workspace
+        scratch = ScratchStore(env.workspace, "proximal_zone", SETTINGS.get("SCRATCH_MEMORY_MB", 1024)) # intermediates of this run
+        env.scratchWorkspace = scratch.folder()
         env.extent = Input_surface_raster
         env.snapRaster = Input_surface_raster
         curdir = env.workspace
@@ -200,20 +438,9 @@ def main():
 
         y = slope_value.split('.')
         slopename = str(y[1])
+        if sweep:
+            slopename = "sweep"
 
-        hlconename = "hlcone"+slopename+"_g"
-        hlshapename = shapedir + "startpts_"+slopename+".shp"
-        hlgridname = "stpts_g"+slopename
-
-
-        # =====================================
-        # set file name for two textfiles storing X,Y coordinates  
-        # one storing an arbitrary single starting point
-        # the other file storing all stream/hl cone intersections as starting points
-        # =====================================
-        txfileuno = textdir + "firstpnt_"+slopename+".txt"
-        txfile = textdir + "startpnts_"+slopename+".txt"
-        
 
         arcpy.AddMessage( "")
         arcpy.AddMessage( "_______________________________")
@@ -227,13 +454,67 @@ def main():
         cone_gt_elev = "0"
         cone_lt_elev = "1"
 
+        metrics.start("cone")
+        conemask = None    # cone array when computed with numpy
+
+        # =====================================
+        # numpy: compute the cone mask from the DEM array
+        # in one vectorized pass instead of the raster chain below
+        # =====================================
+        if conemethod == "numpy":
+            arcpy.AddMessage("Calculating H/L Cone from the DEM array:")
+            arcpy.AddMessage( "        ")
+            dem_desc = arcpy.Describe(Input_surface_raster)
+            demext = dem_desc.extent
+            cellsize = dem_desc.meanCellWidth
+            A = arcpy.RasterToNumPyArray(Input_surface_raster, nodata_to_value=numpy.nan).astype(numpy.float64)
+
+            if apex_choice == "Maximum_Elevation":
+                apexes = MaximumElevationApexes(A)
+            elif apex_choice == "XY_coordinate":
+                a = str(coordspnt).split(' ')
+                apexes = PointApexes(A, [[a[0], a[1]]], demext.XMin, demext.YMax, cellsize)
+            else:
+                apexes = PointApexes(A, ConvertTxtToList(coordstxt, [], "apex"), demext.XMin, demext.YMax, cellsize)
+            arcpy.AddMessage("Apexes (row, column, elevation):  " + str(apexes[:10]) + (" ..." if len(apexes) > 10 else ""))
+            metrics.count("apexes", len(apexes))
+
+        if sweep:
+            # =====================================
+            # critical slope field, computed once for all slopes of the
+            # sweep and cached by DEM contents and apex set
+            # =====================================
+            minslope = min(float(v) for v in sweep)
+            maxslope = max(float(v) for v in sweep)
+            tilesize = int(SETTINGS.get("CONE_TILE_SIZE", 64))
+            memorymb = float(SETTINGS.get("CONE_MEMORY_MB", 64))
+            cachedir = CacheFolder(curdir)
+            sweepkey = SweepCacheKey(A, apexes, cellsize)
+            crit = LoadCriticalSlope(cachedir, sweepkey, minslope, maxslope)
+            if crit is None:
+                arcpy.AddMessage("Calculating the apex distance field for slopes " + str(sweep))
+                crit = CriticalSlope(A, apexes, cellsize, minslope, maxslope, tilesize, memorymb)
+                SaveCriticalSlope(cachedir, sweepkey, minslope, maxslope, crit)
+            else:
+                arcpy.AddMessage("Using the cached apex distance field " + sweepkey)
+                metrics.count("sweep_cache_hits")
+            del A
+
+        elif conemethod == "numpy":
+            # upper envelope of all apex cones in one pass over tiles
+            tilesize = int(SETTINGS.get("CONE_TILE_SIZE", 64))
+            memorymb = float(SETTINGS.get("CONE_MEMORY_MB", 64))
+            reachwindow = bool(SETTINGS.get("CONE_REACH_WINDOW", True))
+            conemask = ConeMask(A, apexes, float(slope_value), cellsize, tilesize, memorymb, reachwindow)
+            del A
+
         # =====================================    
         # Apex_choice is either Maximum elevation,
         # textfile elevation, or manually entered coordinate
         # as apex of an H/L cone
         # =====================================
         # if maximum elevation, find it and store elevation, make const_g and cond_g 
-        if apex_choice == "Maximum_Elevation": 
+        if conemethod == "arcpy" and apex_choice == "Maximum_Elevation": 
             
             arcpy.AddMessage("Searching for Maximum Elevation:")
             arcpy.AddMessage( "        ")
@@ -251,7 +532,7 @@ def main():
             
 # After maxelev have const_g and cond_g
 
-        if apex_choice == "XY_coordinate":
+        if conemethod == "arcpy" and apex_choice == "XY_coordinate":
             coords = str(coordspnt)           
             currhipnt = arcpy.GetCellValue_management(Input_surface_raster,coords,"")
             a = coords.split(' ')
@@ -275,10 +556,24 @@ def main():
 
 # After x,y coord have const_g and cond_g
             
-        if apex_choice == "Maximum_Elevation" or apex_choice == "XY_coordinate":
+        if conemethod == "arcpy" and (apex_choice == "Maximum_Elevation" or apex_choice == "XY_coordinate"):
             # =====================================
             # Create the cone
             # =====================================
+            metrics.count("apexes")
+            windowed = False
+            if apex_choice == "XY_coordinate" and SETTINGS.get("CONE_REACH_WINDOW", True):
+                # the cone can only be above the DEM within
+                # (apex elevation - lowest elevation) / slope of the apex,
+                # so the raster algebra runs on that window only
+                mindem = float(arcpy.GetRasterProperties_management(Input_surface_raster, "MINIMUM").getOutput(0))
+                reach = (float(currhipnt.getOutput(0)) - mindem) / float(slope_value)
+                demext = arcpy.Describe(Input_surface_raster).extent
+                env.extent = arcpy.Extent(max(demext.XMin, float(x) - reach), max(demext.YMin, float(y) - reach),
+                                          min(demext.XMax, float(x) + reach), min(demext.YMax, float(y) + reach))
+                arcpy.AddMessage( "Cone reach from the apex:  " + str(round(reach, 1)))
+                windowed = True
+
             # Calculate Euclidean Distance
             arcpy.AddMessage( "Calculating Euclidean Distance of each cell from SELECTED Location:")
             arcpy.AddMessage( "        ")
@@ -299,13 +594,17 @@ def main():
             # LessThan and SetNull 
             
             hl_cone_g2 = Con(c_minus_dem > 0, 1)
+            if windowed:
+                # write the window back into a full extent raster
+                env.extent = Input_surface_raster
+                hl_cone_g2 = Con(IsNull(hl_cone_g2) == 0, 1)
             #hl_cone_g2.save(curdir + "\\" + "hl_cone_g2")
             # Save as GeoTIFF to avoid ESRI GRID limitations
-            hl_cone_g2.save(curdir + "\\" + "xhltemp.tif")
+            hl_cone_g2.save(scratch.path("xhltemp.tif"))
             
 # after xy_coordinate have onePointList
             
-        if apex_choice == "Textfile":
+        if conemethod == "arcpy" and apex_choice == "Textfile":
             interlist = []
             gridlist = []
             hipnts = []
@@ -318,6 +617,7 @@ def main():
             arcpy.AddMessage("xstartpoints array is :  " + str(xstartpoints))
             arcpy.AddMessage( "        ")
             numxstartpnts = len(xstartpoints)
+            metrics.count("apexes", numxstartpnts)
             arcpy.AddMessage("number of points in array is :  " + str(numxstartpnts))
             arcpy.AddMessage( "        ")
             
@@ -348,7 +648,7 @@ def main():
         # =====================================
         # if textfile or manually entered coordinate, make const_g and cond_g
         # =====================================
-        if apex_choice == "Textfile":
+        if conemethod == "arcpy" and apex_choice == "Textfile":
             for i in range(len(onePointList)):
                 arcpy.AddMessage("Creating grid with value of elevation at coordinate:  ")
                 arcpy.AddMessage( "        ")
@@ -381,10 +681,10 @@ def main():
                 # LessThan and SetNull 
                 
                 hl_cone_g2 = Con(c_minus_dem > 0, 1,0)
-                hl_cone_g2.save(curdir + "\\" + "hl_cone_g2" + str(i) + ".tif")
+                hl_cone_g2.save(scratch.path("hl_cone_g2" + str(i) + ".tif"))
                 
                 
-                gridlist.append("hl_cone_g2" + str(i) + ".tif")
+                gridlist.append(scratch.path("hl_cone_g2" + str(i) + ".tif"))
                 #arcpy.AddMessage( "Gridlist is:" + str(gridlist))
             interlist.extend(gridlist)
 
@@ -394,130 +694,56 @@ def main():
                 #arcpy.AddMessage( "Multi gridlist is:" + str(gridlist))
                 #arcpy.AddMessage( "        ")
                 
-                arcpy.CopyRaster_management(gridlist[0],"grid1.tif")
+                arcpy.CopyRaster_management(gridlist[0],scratch.path("grid1.tif"))
                 
                 del gridlist[0]
                 #arcpy.AddMessage( "Shortened Multi gridlist is:" + str(gridlist))
                 #arcpy.AddMessage( "        ")
                 
                 for i in range(len(gridlist)):
-                    temp = Con(Raster("grid1.tif") > 0, Raster("grid1.tif"), Raster(gridlist[i]))
-                    temp.save(curdir + "\\" + "temp.tif")
-                    if arcpy.Exists(curdir + "\\" + "grid1.tif"):
-                        arcpy.Delete_management(curdir + "\\" + "grid1.tif")
-                    arcpy.CopyRaster_management("temp.tif","grid1.tif")
-                    if arcpy.Exists(curdir + "\\" + "temp.tif"):
-                        arcpy.Delete_management(curdir + "\\" + "temp.tif")
-                if arcpy.Exists(curdir + "\\" + "grid1.tif"):
-                    arcpy.CopyRaster_management("grid1.tif","xhltempx.tif")
-                    arcpy.Delete_management(curdir + "\\" + "grid1.tif")
+                    temp = Con(Raster(scratch.path("grid1.tif")) > 0, Raster(scratch.path("grid1.tif")), Raster(gridlist[i]))
+                    temp.save(scratch.path("temp.tif"))
+                    if arcpy.Exists(scratch.path("grid1.tif")):
+                        arcpy.Delete_management(scratch.path("grid1.tif"))
+                    arcpy.CopyRaster_management(scratch.path("temp.tif"),scratch.path("grid1.tif"))
+                    if arcpy.Exists(scratch.path("temp.tif")):
+                        arcpy.Delete_management(scratch.path("temp.tif"))
+                if arcpy.Exists(scratch.path("grid1.tif")):
+                    arcpy.CopyRaster_management(scratch.path("grid1.tif"),scratch.path("xhltempx.tif"))
+                    arcpy.Delete_management(scratch.path("grid1.tif"))
                 for i in range(len(interlist)):
-                    if arcpy.Exists(curdir + "\\" + interlist[i]):
+                    if arcpy.Exists(interlist[i]):
                         arcpy.AddMessage( "Deleting:" + interlist[i])
-                        arcpy.Delete_management(curdir + "\\" + interlist[i])
+                        arcpy.Delete_management(interlist[i])
             else:
-                if arcpy.Exists(curdir + "\\" + "hl_cone_g20.tif"):
-                    arcpy.CopyRaster_management("hl_cone_g20.tif","xhltempx.tif")
-                    arcpy.Delete_management(curdir + "\\" + "hl_cone_g20.tif")
-            if arcpy.Exists(curdir + "\\" + "xhltempx.tif"):
-                temp = Con(Raster("xhltempx.tif") > 0, Raster("xhltempx.tif"))
-                temp.save(curdir + "\\" + "xhltemp.tif")
-                arcpy.Delete_management(curdir + "\\" + "xhltempx.tif")
+                if arcpy.Exists(scratch.path("hl_cone_g20.tif")):
+                    arcpy.CopyRaster_management(scratch.path("hl_cone_g20.tif"),scratch.path("xhltempx.tif"))
+                    arcpy.Delete_management(scratch.path("hl_cone_g20.tif"))
+            if arcpy.Exists(scratch.path("xhltempx.tif")):
+                temp = Con(Raster(scratch.path("xhltempx.tif")) > 0, Raster(scratch.path("xhltempx.tif")))
+                temp.save(scratch.path("xhltemp.tif"))
+                arcpy.Delete_management(scratch.path("xhltempx.tif"))
                     
 # after textfile, have an xhltemp of all merged
 
 
-        # =====================================   
-        # convert the gridline of intersection of the cone and DEM to a polygon
-        # =====================================
-        # Raster to Polygon
-        arcpy.AddMessage( "Converting cone/elevation intersection Raster to Polygon:")
-        arcpy.AddMessage( "        ")
-        arcpy.RasterToPolygon_conversion(curdir + "\\" + "xhltemp.tif", curdir + "\\" + "hl_cone_1.shp", "SIMPLIFY", "VALUE")
-        arcpy.RasterToPolygon_conversion(curdir + "\\" + "xhltemp.tif", curdir + "\\laharz_shapefiles\\" + "hl_cone" + slopename + ".shp", "SIMPLIFY", "VALUE")
-        
-        # convert the polygon to a polyline
-        # Polygon Feature To Line
-        arcpy.AddMessage( "Converting Cone Polygon to Line:")
-        arcpy.AddMessage( "        ")
-        arcpy.FeatureToLine_management(curdir + "\\" + "hl_cone_1.shp", curdir + "\\" + "hl_cone_2.shp", "", "ATTRIBUTES")
-
-        # =====================================
-        # convert the polyline back to a raster
-        # =====================================
-        # Polyline to Raster
-        arcpy.AddMessage( "Converting Cone line back to a Cone outline Raster:")
-        arcpy.AddMessage( "        ")
-        arcpy.PolylineToRaster_conversion(curdir + "\\" + "hl_cone_2.shp", "GRIDCODE", hlconename, "MAXIMUM_LENGTH", "NONE", Input_surface_raster)
-        
-        arcpy.AddMessage( "")
-        arcpy.AddMessage( "_______________________________")
-        arcpy.AddMessage( "Finding Intersection locations of streams")
-        arcpy.AddMessage( "and H/L Cone and store coordinates as start points:")
-        arcpy.AddMessage( "_______________________________")
-        arcpy.AddMessage( "")
-
-        # intersect_g
-        arcpy.AddMessage( "Finding intersections of streams and hlcone:")
-        arcpy.AddMessage( "        ")
-        intersect_g = Plus(hlconename, Input_stream_raster)
-        
-        # Extract by Attributes
-        arcpy.AddMessage( "Extracting intersections from raster:")
-        arcpy.AddMessage( "        ")
-        temp11c = ExtractByAttributes(intersect_g, "VALUE = 2")
-        temp11c.save(curdir + "\\" + hlgridname)
-
-        # Raster to Point
-        arcpy.AddMessage( "Converting intersection locations to point shape file:")
-        arcpy.AddMessage( "        ")
-        arcpy.RasterToPoint_conversion(hlgridname, hlshapename, "VALUE")
-        
-        # Add X and Y coordinates to shape file
-        arcpy.AddMessage( "adding X and Y coordinates to attribute table:")
-        arcpy.AddMessage( "        ")
-        arcpy.AddXY_management(hlshapename)
-        
-        arcpy.AddMessage( "")
-        arcpy.AddMessage( "_______________________________")
-        arcpy.AddMessage( "Writing X and Y locations of  ")
-        arcpy.AddMessage( "intersections to a textfile:")
-        arcpy.AddMessage( "_______________________________")
-        arcpy.AddMessage( "")
-        
-        # =====================================
-        # open files for write, write heading to file of list of coordinates
-        # =====================================
-        runo = open(txfileuno, 'w', encoding="utf_8_sig")    
-        report = open(txfile, 'w', encoding="utf_8_sig")
-        #report.write('Northing,Easting')
-        #report.write('\n')
-        
-        # set up search cursor
-        rows = arcpy.SearchCursor(hlshapename,"","","POINT_X; POINT_Y","")
-
-        # Get the first feature in the searchcursor
-        row = rows.next()
-
-        # local variables
-        currentloc = ""
-        count = 1
-
-        # Iterate through the rows in the cursor
-        while row:
-            if currentloc != row.POINT_X:
-                currentloc = row.POINT_X
-            # write first X, Y to file
-            if count == 1:
-                runo.write(" %d,%d" % (row.POINT_X, row.POINT_Y))
-            report.write(" %d,%d" % (row.POINT_X, row.POINT_Y))
-            report.write("\n") 
-            row = rows.next()
-            count += 1
-
-        # close files
-        report.close()
-        runo.close()
+        metrics.stop("cone")
+        if sweep:
+            # =====================================
+            # one cone, boundary and start point file per slope,
+            # all from the same critical slope field
+            # =====================================
+            for sweepslope in sweep:
+                arcpy.AddMessage( "")
+                arcpy.AddMessage( "H/L slope: " + str(sweepslope))
+                scratch.put("xhltemp", crit > float(sweepslope))
+                ConeStartPoints(curdir, scratch, str(sweepslope), Input_surface_raster, Input_stream_raster, Input_direction_raster, metrics, SETTINGS)
+            del crit
+        else:
+            if conemask is not None:
+                scratch.put("xhltemp", conemask)
+                del conemask
+            ConeStartPoints(curdir, scratch, slope_value, Input_surface_raster, Input_stream_raster, Input_direction_raster, metrics, SETTINGS)
 
         # report writing to files complete
         arcpy.AddMessage( "")   
@@ -530,50 +756,23 @@ def main():
         arcpy.AddMessage( "_______________________________")
         arcpy.AddMessage( "Cleaning up intermediate files...")
         arcpy.AddMessage( "_______________________________")    
-        if arcpy.Exists(curdir + "\\" + "const_g"):
-            arcpy.Delete_management(curdir + "\\" + "const_g")
-        if arcpy.Exists(curdir + "\\" + "above_g"):
-            arcpy.Delete_management(curdir + "\\" + "above_g")
-        if arcpy.Exists(curdir + "\\" + "c_minus_dem"):
-            arcpy.Delete_management(curdir + "\\" + "c_minus_dem")
-        if arcpy.Exists(curdir + "\\" + "notequ_g"):
-            arcpy.Delete_management(curdir + "\\" + "notequ_g")
-        if arcpy.Exists(curdir + "\\" + "cond_g"):
-            arcpy.Delete_management(curdir + "\\" + "cond_g")
-        if arcpy.Exists(curdir + "\\" + "Eucdist_g"):
-            arcpy.Delete_management(curdir + "\\" + "Eucdist_g")
-        if arcpy.Exists(curdir + "\\" + "Slopeeuc_g"):
-            arcpy.Delete_management(curdir + "\\" + "Slopeeuc_g")
-        if arcpy.Exists(curdir + "\\" + "hl_cone_g1"):
-            arcpy.Delete_management(curdir + "\\" + "hl_cone_g1")
-        if arcpy.Exists(curdir + "\\" + "hl_cone_g2"):
-            arcpy.Delete_management(curdir + "\\" + "hl_cone_g2")
-        if arcpy.Exists(curdir + "\\" + hlgridname):
-            arcpy.Delete_management(curdir + "\\" + hlgridname)
-        if arcpy.Exists(curdir + "\\" + "hl_cone.shp"):
-            arcpy.Delete_management(curdir + "\\" + "hl_cone.shp")
-        if arcpy.Exists(curdir + "\\" + "hl_cone_1.shp"):
-            arcpy.Delete_management(curdir + "\\" + "hl_cone_1.shp")
-        if arcpy.Exists(curdir + "\\" + "hl_cone_2.shp"):
-            arcpy.Delete_management(curdir + "\\" + "hl_cone_2.shp")
-        if arcpy.Exists(curdir + "\\" + "intersect_g"):
-            arcpy.Delete_management(curdir + "\\" + "intersect_g")
-        if arcpy.Exists(curdir + "\\" + "xhltemp.tif"):
-            arcpy.Delete_management(curdir + "\\" + "xhltemp.tif")
-        if arcpy.Exists(curdir + "\\" + "grid1.tif"):
-            arcpy.Delete_management(curdir + "\\" + "grid1.tif")
-        if arcpy.Exists(curdir + "\\" + "temp.tif"):
-            arcpy.Delete_management(curdir + "\\" + "temp.tif")
-        if arcpy.Exists(curdir + "\\" + "xhltempx.tif"):
-            arcpy.Delete_management(curdir + "\\" + "xhltempx.tif")
+        metrics.start("cleanup")
+        scratch.cleanup()     # every intermediate of this run is in its scratch folder
+        metrics.stop("cleanup")
 
         arcpy.AddMessage( "Processing Complete.")
+        for aline in metrics.summary():
+            arcpy.AddMessage(aline)
+        metrics.writejson(textdir + "proximal_zone_" + slopename + "_metrics.json")
         arcpy.AddMessage( "")
 
         
     except:
         arcpy.GetMessages(2)
         raise
+    finally:
+        if scratch is not None:
+            scratch.cleanup()
 
 if __name__ == "__main__":
     main()
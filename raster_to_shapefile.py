@@ -1,70 +1,373 @@
 # ---------------------------------------------------------------------------
 # raster_to_shapefile.py
-# 
+#
 # Usage: raster_to_shapefile.py is attached to Laharz_py.tbx (toolbox)
 #   sys.argv[1] a workspace
 #   sys.argv[2] name of new shapefile
-#   sys.argv[3] name of existing raster data set
+#   sys.argv[3] name of existing raster data set, or for a batch a list
+#               of rasters and glob patterns separated by ";"
 #
 #   This program converts a raster data set of volumes into a polygon
 # shapefile.  The shapefile retains the coding from the raster, storing
 # the information in an associated attribute table
+#   With VECTOR_METHOD = "native" in run_setting.py the polygons are traced
+# by native_vector.py on a NumPy array instead of RasterToPolygon_conversion;
+# without arcpy the tool runs from the command line on ESRI ASCII grids
+# (.asc) and always uses "native".
+#   With VECTOR_NESTED = True the raster is taken as nested zones (merged
+# runs, where a larger value marks a smaller volume) and every zone
+# "value >= k" becomes a layer, all in one pass; the shapefile holds the
+# zones of every k with their areas, and <shapefile>.topojson stores each
+# boundary the zones share once.
+#   A batch (sys.argv[3] with "*", "?", "[" or ";") converts every raster
+# it names into <shapefile>_<raster>.shp, VECTOR_WORKERS rasters at a time
+# in a pool of processes with "native".  A raster is skipped when the
+# manifest of the last batch (laharz_textfiles/<shapefile>_batch.json)
+# shows it converted with the same settings and the raster has not changed
+# since (VECTOR_BATCH_CHECK: "mtime" size and modification time, "hash"
+# contents, "none" always converts); the manifest lists the status and
+# timings of every raster.
 # ---------------------------------------------------------------------------
 
 # Start Up - Import system modules
-import sys, string, os, arcpy, time
-from arcpy import env
-from arcpy.sa import *
+import sys, string, os, time, importlib, glob, json, hashlib
+from concurrent.futures import as_completed
 #from math import *
+import run_setting
+from run_metrics import RunMetrics
+from progress_report import MakeReporter
+from process_pool import ProcessPool
+from vector_convert import NativeConversion, NestedConversion, ConvertRaster
+
+metrics = RunMetrics("raster_to_shapefile")  # calculate time for program run
+
+# files a batch pattern may match as rasters (ESRI grids are folders)
+RASTER_EXTENSIONS = (".asc", ".tif", ".tiff", ".img", ".flt", ".bil")
+
+arcpy = None    # imported by ImportArcpy; None converts ESRI ASCII grids only
+env = None
+
+#===========================================================================
+#  Local Functions
+#===========================================================================
+
+def LoadSettings():
+    # run_setting.py を毎回読み直して、ArcGIS セッション中の変更も反映する
+    importlib.reload(run_setting)
+    return run_setting.SETTINGS
+
+def ImportArcpy():
+    # =====================================
+    # Imports arcpy and checks out the Spatial Analyst license when the
+    # tool runs instead of when the module is imported, so a process of a
+    # batch that imports this script (as __mp_main__) starts without them
+    #
+    # Returns:  arcpy, or None if it is not installed
+    # =====================================
+    global arcpy, env
+    if arcpy is None:
+        try:
+            import arcpy
+            from arcpy import env
+        except ImportError:
+            return None
+    arcpy.CheckOutExtension("Spatial")
+    return arcpy
+
+def CompareWithArcpy(rastername, outPolygons, polygons, vertices, cellarea):
+    # =====================================
+    # Converts the raster with RasterToPolygon_conversion as well, into
+    # <shapefile>_arcpy.shp, and compares the two.  The timings, counts
+    # and area differences are also written to <shapefile>_benchmark.json
+    #
+    # Returns:  list of message lines
+    # =====================================
+    arcpyname = os.path.splitext(outPolygons)[0] + "_arcpy.shp"
+    metrics.start("arcpy_convert")
+    arcpy.RasterToPolygon_conversion(rastername, arcpyname, "NO_SIMPLIFY", "VALUE")
+    metrics.stop("arcpy_convert")
+    arcpyareas = {}
+    arcpyvertices = 0
+    arcpycount = 0
+    with arcpy.da.SearchCursor(arcpyname, ["gridcode", "SHAPE@AREA", "SHAPE@"]) as cursor:
+        for code, area, shape in cursor:
+            arcpyareas[code] = arcpyareas.get(code, 0.0) + area
+            arcpyvertices += shape.pointCount
+            arcpycount += 1
+    areas = {}
+    for polygon in polygons:
+        code = int(polygon["value"])
+        areas[code] = areas.get(code, 0.0) + polygon["cells"] * cellarea
+    differences = {str(code): areas.get(code, 0.0) - arcpyareas.get(code, 0.0) for code in sorted(set(areas) | set(arcpyareas))}
+    difference = max([abs(v) for v in differences.values()] + [0.0])
+    nativeseconds = metrics.stages["convert"]["wall"]
+    arcpyseconds = metrics.stages["arcpy_convert"]["wall"]
+    benchmark = {"raster": rastername,
+                 "seconds": {"native": round(nativeseconds, 3), "arcpy": round(arcpyseconds, 3)},
+                 "polygons": {"native": len(polygons), "arcpy": arcpycount},
+                 "vertices": {"native": vertices, "arcpy": arcpyvertices},
+                 "area_difference": differences}
+    with open(os.path.splitext(outPolygons)[0] + "_benchmark.json", "w", encoding="utf_8") as afile:
+        json.dump(benchmark, afile, indent=1)
+    lines = ["  seconds: native " + str(round(nativeseconds, 3)) + ", arcpy " + str(round(arcpyseconds, 3)),
+             "  polygons: native " + str(len(polygons)) + ", arcpy " + str(arcpycount),
+             "  vertices: native " + str(vertices) + ", arcpy " + str(arcpyvertices),
+             "  largest difference of the area of a gridcode: " + str(round(difference, 3))]
+    return lines
+
+#===========================================================================
+#  Batch conversion
+#===========================================================================
+
+def IsRaster(name):
+    # True for a raster file, or an ESRI grid folder
+    if os.path.isdir(name):
+        return os.path.isfile(os.path.join(name, "hdr.adf"))
+    return name.lower().endswith(RASTER_EXTENSIONS)
+
+def BatchRasters(rasterlist, curpath):
+    # =====================================
+    # Parameters:
+    #   rasterlist:  raster names and glob patterns separated by ";"
+    #   curpath:     workspace the relative names are in
+    #
+    # Returns:  list of the paths of the rasters, each once, in the order
+    #           given (the matches of a pattern sorted by name)
+    # =====================================
+    rasters = []
+    for item in rasterlist.split(";"):
+        item = item.strip().strip("'\"")
+        if not item:
+            continue
+        if not os.path.isabs(item):
+            item = os.path.join(curpath, item)
+        if any(c in item for c in "*?["):
+            names = [name for name in sorted(glob.glob(item)) if IsRaster(name)]
+        else:
+            names = [item]
+        for name in names:
+            if name not in rasters:
+                rasters.append(name)
+    return rasters
+
+def BatchName(shapename, rastername):
+    # name of the shapefile of rastername in a batch
+    base = os.path.splitext(os.path.basename(rastername.rstrip(os.sep)))[0]
+    if shapename in ("", "#"):
+        return base
+    return shapename + "_" + base
+
+def SourceStamp(rastername, check):
+    # =====================================
+    # Parameters:
+    #   rastername:  raster file or ESRI grid folder
+    #   check:       "mtime" or "hash"
+    #
+    # Returns:  [total size, latest modification time] of the files of
+    #           the raster for "mtime", SHA-1 of their contents for "hash",
+    #           None if the raster is not on disk
+    # =====================================
+    if os.path.isdir(rastername):
+        files = sorted(os.path.join(folder, name) for folder, dirs, names in os.walk(rastername) for name in names)
+    elif os.path.isfile(rastername):
+        files = [rastername]
+    else:
+        return None
+    if check == "hash":
+        key = hashlib.sha1()
+        for filename in files:
+            key.update(os.path.relpath(filename, rastername).encode("utf_8"))
+            with open(filename, "rb") as afile:
+                for block in iter(lambda: afile.read(1048576), b""):
+                    key.update(block)
+        return key.hexdigest()
+    stats = [os.stat(filename) for filename in files]
+    return [sum(stat.st_size for stat in stats), max([stat.st_mtime_ns for stat in stats] + [0])]
 
-starttimetot = time.process_time()  # calculate time for program run
+def ReadManifest(filename):
+    # =====================================
+    # Returns:  dictionary output shapefile -> entry of the manifest of
+    #           the last batch, empty if there is none
+    # =====================================
+    try:
+        with open(filename, "r", encoding="utf_8") as afile:
+            manifest = json.load(afile)
+    except (OSError, ValueError):
+        return {}
+    return {entry["output"]: entry for entry in manifest.get("rasters", []) if "output" in entry}
 
-# Check out license
-arcpy.CheckOutExtension("Spatial")
+def BatchConversion(jobs, options, workers, progress):
+    # =====================================
+    # Parameters:
+    #   jobs:      list of (raster, output shapefile)
+    #   options:   options of ConvertRaster
+    #   workers:   number of processes; 1 converts in order
+    #   progress:  ProgressReporter
+    #
+    # Returns:  list of the entries of ConvertRaster, in the order of jobs
+    # =====================================
+    entries = [None] * len(jobs)
+    if workers <= 1 or len(jobs) <= 1:
+        for j in range(len(jobs)):
+            entries[j] = ConvertRaster(jobs[j][0], jobs[j][1], options)
+            progress.update("batch", j + 1, len(jobs), "Converted rasters")
+    else:
+        with ProcessPool(workers) as pool:
+            futures = {pool.submit(ConvertRaster, inRaster, outPolygons, options): j
+                       for j, (inRaster, outPolygons) in enumerate(jobs)}
+            done = 0
+            for future in as_completed(futures):
+                entries[futures[future]] = future.result()
+                done += 1
+                progress.update("batch", done, len(jobs), "Converted rasters")
+    return entries
 
-def main():            
+def main():
     try:
         #===========================================================================
         # Assign user inputs from menu to appropriate variables
         #===========================================================================
 
-        arcpy.AddMessage("Parsing user inputs:")
+        ImportArcpy()
+        SETTINGS = LoadSettings()
+        method = SETTINGS.get("VECTOR_METHOD", "arcpy") # "arcpy" RasterToPolygon or "native" arrays
+        tolerance = float(SETTINGS.get("VECTOR_SIMPLIFY", 0.0)) # native simplification, map units
+        nested = SETTINGS.get("VECTOR_NESTED", False) # zones "value >= k" of every k, native only
+        if nested:
+            method = "native"
+        if arcpy is None:
+            method = "native"
+            SETTINGS = dict(SETTINGS, PROGRESS="console")
+        progress = MakeReporter(SETTINGS)
+        progress.message("Parsing user inputs:")
 
-        env.workspace = sys.argv[1]      # set the ArcGIS workspace
+        workspace = sys.argv[1]          # the workspace
         shapename = sys.argv[2]          # a name of new shapefile
         Raster_to_convert = sys.argv[3]  # name of raster to convert
 
         #=============================================
         # Set the ArcGIS environment settings
-        #=============================================     
-        env.scratchWorkspace = env.workspace  # scratchworkspace
-        curpath = env.workspace               # directory path
+        #=============================================
+        if arcpy is not None:
+            env.workspace = workspace             # set the ArcGIS workspace
+            env.scratchWorkspace = env.workspace  # scratchworkspace
+        curpath = workspace                   # directory path
     ##    env.extent = Raster_to_convert        # set the extent
     ##    env.cellSize = Raster_to_convert      # set the cell size
     ##    env.snapRaster = Raster_to_convert    # set the raster to aligh
-        PathName = env.workspace + "\\"       # set the path to files on disk
 
         #==========================
         # Set local variables
         #==========================
         inRaster = Raster_to_convert
-        outPolygons = PathName + "laharz_shapefiles\\" + shapename + ".shp"
+        if method == "native" and not os.path.isabs(inRaster):
+            inRaster = os.path.join(curpath, inRaster)
+        outPolygons = os.path.join(curpath, "laharz_shapefiles", shapename + ".shp")
         field = "VALUE"
 
+        #==========================
+        # convert a batch of rasters
+        #==========================
+        if any(c in Raster_to_convert for c in "*?[;"):
+            options = {"method": method,
+                       "tolerance": tolerance,
+                       "nested": nested,
+                       "background": SETTINGS.get("VECTOR_BACKGROUND", 1),
+                       "geojson": SETTINGS.get("VECTOR_GEOJSON", False)}
+            check = SETTINGS.get("VECTOR_BATCH_CHECK", "mtime") # "mtime", "hash" or "none"
+            workers = int(SETTINGS.get("VECTOR_WORKERS", 0)) or os.cpu_count() or 1
+            if method != "native":
+                workers = 1     # RasterToPolygon runs in this process
+            batchname = BatchName(shapename, "batch")  # <shapefile>_batch
+            manifestname = os.path.join(curpath, "laharz_textfiles", batchname + ".json")
+            previous = ReadManifest(manifestname)
+
+            metrics.start("batch")
+            rasters = BatchRasters(Raster_to_convert, curpath)
+            progress.message("Rasters in the batch: " + str(len(rasters)))
+            entries = {}
+            stamps = {}
+            jobs = []
+            for inRaster in rasters:
+                outName = os.path.join(curpath, "laharz_shapefiles", BatchName(shapename, inRaster) + ".shp")
+                stamps[inRaster] = SourceStamp(inRaster, check) if check != "none" else None
+                last = previous.get(outName)
+                if (stamps[inRaster] is not None and last is not None and os.path.isfile(outName) and
+                        last.get("status") in ("converted", "skipped") and last.get("raster") == inRaster and
+                        last.get("stamp") == stamps[inRaster] and last.get("options") == options):
+                    entries[inRaster] = dict(last, status="skipped", seconds=0.0, cpu=0.0)
+                else:
+                    jobs.append((inRaster, outName))
+            progress.message("Converting " + str(len(jobs)) + " rasters with " + str(min(workers, max(1, len(jobs)))) +
+                             " processes, " + str(len(rasters) - len(jobs)) + " up to date")
+            for entry in BatchConversion(jobs, options, workers, progress):
+                entries[entry["raster"]] = entry
+                if entry["status"] == "failed":
+                    progress.warning("  " + os.path.basename(entry["raster"]) + ": " + entry["error"])
+            metrics.stop("batch")
+
+            manifest = {"tool": "raster_to_shapefile",
+                        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+                        "workers": workers,
+                        "check": check,
+                        "options": options,
+                        "seconds": round(metrics.walltime(), 3),
+                        "rasters": []}
+            for inRaster in rasters:
+                entry = dict(entries[inRaster], stamp=stamps[inRaster], options=options)
+                manifest["rasters"].append(entry)
+                metrics.count(entry["status"])
+            if not os.path.isdir(os.path.dirname(manifestname)):
+                os.makedirs(os.path.dirname(manifestname), exist_ok=True)
+            with open(manifestname, "w", encoding="utf_8") as afile:
+                json.dump(manifest, afile, indent=1)
+
+            progress.message("...Processing Complete...")
+            for aline in metrics.summary():
+                progress.message(aline)
+            metrics.writejson(os.path.join(curpath, "laharz_textfiles", batchname + "_metrics.json"))
+            return
+
         #==========================
         # apply the conversion
-        #==========================  
-        arcpy.RasterToPolygon_conversion(inRaster, outPolygons, "NO_SIMPLIFY", field)    
-        endtimetot = time.process_time()
-        tottime = endtimetot - starttimetot
-        
-        arcpy.AddMessage("...Processing Complete...")   
-        arcpy.AddMessage("TOTAL TIME:  " + str(tottime) + " seconds")
-        
+        #==========================
+        metrics.start("convert")
+        if nested:
+            polygons, vertices, zoneareas = NestedConversion(inRaster, outPolygons, tolerance,
+                                                             SETTINGS.get("VECTOR_BACKGROUND", 1),
+                                                             SETTINGS.get("VECTOR_GEOJSON", False))
+            metrics.count("polygons", len(polygons))
+            metrics.count("vertices", vertices)
+            for zone in sorted(zoneareas):
+                progress.message("  zone " + str(zone) + ": area " + str(round(zoneareas[zone], 1)))
+        elif method == "native":
+            polygons, vertices, cellarea = NativeConversion(inRaster, outPolygons, tolerance,
+                                                            SETTINGS.get("VECTOR_GEOJSON", False))
+            metrics.count("polygons", len(polygons))
+            metrics.count("vertices", vertices)
+        else:
+            arcpy.RasterToPolygon_conversion(inRaster, outPolygons, "NO_SIMPLIFY", field)
+        metrics.stop("convert")
+
+        if method == "native" and not nested and SETTINGS.get("VECTOR_BENCHMARK", False):
+            if arcpy is None:
+                progress.warning("VECTOR_BENCHMARK needs arcpy: comparison skipped")
+            else:
+                progress.message("Comparing with RasterToPolygon_conversion:")
+                for aline in CompareWithArcpy(inRaster, outPolygons, polygons, vertices, cellarea):
+                    progress.message(aline)
+
+        progress.message("...Processing Complete...")
+        for aline in metrics.summary():
+            progress.message(aline)
+        metrics.writejson(os.path.join(curpath, "laharz_textfiles", shapename + "_metrics.json"))
+
     except:
+        if arcpy is None:
+            raise
         arcpy.GetMessages(2)
 
 if __name__ == "__main__":
-    main()   
+    main()
+
 
-        
\ No newline at end of file
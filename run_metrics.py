@@ -0,0 +1,177 @@
+# ---------------------------------------------------------------------------
+# run_metrics.py
+#
+# Usage: imported by the Laharz_py tools (surface_hydro.py, proximal_zone.py,
+#   distal_inundation.py, merge_runs.py, raster_to_shapefile.py)
+#
+#   This module records wall clock and CPU time for named stages of a tool
+#  run, counters such as stream cells traversed, cross sections computed and
+#  cells labelled, and the peak memory of the process.  The results can be
+#  written to a JSON file so runs can be compared on a dashboard.
+# ---------------------------------------------------------------------------
+
+# Start Up - Import system modules
+import os, json, time, contextlib
+
+try:
+    import psutil                # available in the ArcGIS Pro python environment
+except ImportError:
+    psutil = None
+
+try:
+    import resource              # unix only
+except ImportError:
+    resource = None
+
+#===========================================================================
+#  Local Functions
+#===========================================================================
+
+def PeakMemory():
+    # =====================================
+    # Reads the peak memory used by the current process
+    # (peak working set on Windows, maximum resident set size elsewhere)
+    #
+    # Returns:  peak memory in bytes, or None if it can not be determined
+    # =====================================
+
+    if psutil is not None:
+        meminfo = psutil.Process().memory_info()
+        if hasattr(meminfo, "peak_wset"):
+            return int(meminfo.peak_wset)
+    if resource is not None:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if os.uname().sysname == "Darwin":
+            return int(maxrss)        # bytes on macOS
+        return int(maxrss) * 1024     # kilobytes on linux
+    if psutil is not None:
+        return int(psutil.Process().memory_info().rss)
+    return None
+
+def CalcTime(tottime):
+    # =====================================
+    # Parameters:
+    #   tottime:  result of subtracting a start time from an
+    #             end time
+    #
+    # Calculates the hours, minutes, seconds from a total
+    # number of seconds.
+    #
+    # Returns:  string of hours, minutes, seconds
+    # =====================================
+
+    timehr = 0
+    timemin = int(tottime // 60)
+    timesec = round(tottime - (timemin * 60), 2)
+    if timemin >= 60:
+        timehr = timemin // 60
+        timemin = timemin - (timehr * 60)
+    if timehr > 0:
+        return str(timehr) + " hrs, " + str(timemin) + " mins, " + str(timesec) + " secs."
+    else:
+        return str(timemin) + " mins, " + str(timesec) + " secs."
+
+
+class RunMetrics(object):
+    # =====================================
+    # Parameters:
+    #   toolname:  name of the tool being measured
+    #
+    # Collects per stage timings and counters for one tool run.
+    # Use as:
+    #   metrics = RunMetrics("merge_runs")
+    #   with metrics.stage("read_runs"):
+    #       ...
+    # or metrics.start("read_runs") ... metrics.stop("read_runs")
+    #   metrics.count("cells_traversed", n)
+    #   metrics.writejson(path)
+    # =====================================
+
+    def __init__(self, toolname):
+        self.toolname = toolname
+        self.stages = {}      # stage name -> {"wall", "cpu", "calls"}
+        self.counters = {}    # counter name -> integer
+        self.running = {}     # stage name -> (wall, cpu) start of an open stage
+        self.startwall = time.perf_counter()
+        self.startcpu = time.process_time()
+        self.peakmem = None
+
+    def start(self, name):
+        # start timing a named stage
+        self.running[name] = (time.perf_counter(), time.process_time())
+
+    def stop(self, name):
+        # stop timing a named stage; repeated stages of the same name accumulate
+        wall0, cpu0 = self.running.pop(name)
+        entry = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0})
+        entry["wall"] += time.perf_counter() - wall0
+        entry["cpu"] += time.process_time() - cpu0
+        entry["calls"] += 1
+        self.samplememory()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        # time the body of a with statement as a named stage
+        self.start(name)
+        try:
+            yield self
+        finally:
+            self.stop(name)
+
+    def count(self, name, n=1):
+        # add n to a named counter
+        self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    def samplememory(self):
+        # keep the highest memory reading seen so far
+        mem = PeakMemory()
+        if mem is not None and (self.peakmem is None or mem > self.peakmem):
+            self.peakmem = mem
+        return self.peakmem
+
+    def walltime(self):
+        return time.perf_counter() - self.startwall
+
+    def cputime(self):
+        return time.process_time() - self.startcpu
+
+    def asdict(self):
+        self.samplememory()
+        return {
+            "tool": self.toolname,
+            "finished": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "wall_seconds": round(self.walltime(), 6),
+            "cpu_seconds": round(self.cputime(), 6),
+            "peak_memory_bytes": self.peakmem,
+            "stages": dict((k, {"wall_seconds": round(v["wall"], 6),
+                                "cpu_seconds": round(v["cpu"], 6),
+                                "calls": v["calls"]})
+                           for k, v in self.stages.items()),
+            "counters": dict(self.counters),
+        }
+
+    def summary(self):
+        # =====================================
+        # Returns:  list of text lines describing the run, used for
+        #           arcpy.AddMessage and the .pts files
+        # =====================================
+        lines = []
+        lines.append("TOTAL TIME:  " + str(round(self.walltime(), 3)) + " seconds (wall)")
+        lines.append("TOTAL TIME:  " + CalcTime(self.walltime()))
+        lines.append("CPU TIME:  " + str(round(self.cputime(), 3)) + " seconds")
+        for k, v in self.stages.items():
+            lines.append("  stage " + k + ":  " + str(round(v["wall"], 3)) + " s wall, " + str(round(v["cpu"], 3)) + " s cpu")
+        for k, v in self.counters.items():
+            lines.append("  " + k + ":  " + str(v))
+        if self.peakmem is not None:
+            lines.append("PEAK MEMORY:  " + str(round(self.peakmem / 1048576.0, 1)) + " MB")
+        return lines
+
+    def writejson(self, filename):
+        # write the metrics to filename, creating its folder if needed
+        folder = os.path.dirname(filename)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder, exist_ok=True)
+        with open(filename, "w", encoding="utf_8") as afile:
+            json.dump(self.asdict(), afile, indent=2)
+        return filename
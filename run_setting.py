@@ -0,0 +1,195 @@
+# このファイルの使い方は末尾"""以下参照
+
+# PROGRESS: 進捗メッセージの出力先 ("arcpy": ジオプロセシング画面, "console": 標準出力, "none": 出力しない)
+# VERBOSITY: メッセージの詳細度 ("QUIET", "NORMAL", "VERBOSE", "DEBUG")
+# PROGRESS_INTERVAL: 進捗メッセージを出力する最小間隔 (秒)
+# MERGE_MODE: merge_runsの方式 ("memory": ラスタ全体を一度に読む, "stream": 行ブロックごとに読む)
+# MERGE_BLOCK_ROWS: "stream"で一度に処理する行数
+# MERGE_WORKERS: "stream"で統合したブロックを閾値ごとに書き込むスレッド数 (1: 逐次処理)。ラスタの読み込みは常にメインスレッドで行う
+# MERGE_INCREMENTAL: True の場合、既存のmerge_<w>に含まれていない結果ラスタだけを読んで統合する
+# CONE_METHOD: proximal_zoneのH/Lコーンの計算方法 ("arcpy": ラスタ演算, "numpy": 配列で一度に計算)
+# CONE_TILE_SIZE: "numpy"で一度に計算するタイルの行数・列数
+# CONE_MEMORY_MB: "numpy"で1タイルの計算に使うメモリの上限 (MB)。同時に計算する頂点の数が決まる
+# CONE_REACH_WINDOW: True の場合、頂点から (頂点標高 - DEM最低標高) / H/L の範囲だけでコーンを計算する
+# HL_SWEEP_SLOPES: proximal_zoneで一度に計算するH/Lの一覧 (例: [0.1, 0.15, 0.2])。空の場合は入力したH/Lだけを計算する
+# BOUNDARY_METHOD: proximal_zoneの起点の求め方 ("arcpy": ポリゴン・ライン・ラスタ変換, "numpy": コーンの配列から直接求める)
+# WRITE_VECTOR_PRODUCTS: "numpy"でhl_cone<H/L>.shpとstartpts_<H/L>.shpも出力する場合は True
+# START_POINT_DEDUP: True の場合、ほかの起点から下流へDEDUP_PATH_CELLSセル以内の流路上にある起点を省き、上流の起点だけを残す
+# DEDUP_PATH_CELLS: 起点から下流へ流路をたどるセル数
+# SCRATCH_MEMORY_MB: 中間データを配列としてメモリに保持する上限 (MB)。超えた分は一時フォルダに書き出す
+# HYDRO_METHOD: surface_hydroの計算方法 ("arcpy": Spatial Analyst, "native": NumPy配列で計算, "tiled": タイルごとに並列計算)
+# HYDRO_FILL_EPSILON: "native"の窪地埋めで、埋めたセルに付ける勾配 (0: ArcGISのFillと同じく平坦に埋める)
+# HYDRO_BLOCK_ROWS: "native"の流向計算で一度に処理する行数
+# HYDRO_WEIGHT_RASTER: 流量累積の重みラスタ (""の場合は上流のセル数を数える)
+# HYDRO_TILE_SIZE: "tiled"のタイルの行数・列数
+# HYDRO_WORKERS: "tiled"で並列に計算するプロセス数 (0: すべてのCPUコア)
+# STREAM_INDEX: True の場合、new_stream_networkは河道網インデックスから<prefix>str<閾値>を作成する
+# STREAM_INDEX_MIN: 河道網インデックスに含める流量累積の最小値 (これより小さい閾値はGreaterThanで計算する)
+# STREAM_GRAPH: True の場合、surface_hydroとnew_stream_networkは<prefix>str<閾値>と一緒に河道網グラフ (<prefix>str<閾値>_graph.npz) を保存する
+# FLOW_PATH_ESTIMATES: True の場合、distal_inundationは全セルの下流の流路を一度に求め、各起点から流下計算がたどる最大セル数と、他の起点を通るかどうかを表示する
+# HYDRO_CACHE: True の場合、surface_hydroは<prefix>fill/dir/flac/strをキャッシュに保存し、同じDEMを別のprefixで実行したときはキャッシュからコピーする
+# HYDRO_CACHE_MB: キャッシュの上限 (MB)。超えた場合は最も長く使われていないDEMのものから削除する
+# HYDRO_CACHE_FOLDER: キャッシュのフォルダ。""の場合は作業フォルダの"laharz_cache\hydro"
+# VECTOR_METHOD: raster_to_shapefileのポリゴン化の方法。"arcpy" (RasterToPolygon) または "native" (NumPy配列上で境界を追跡、arcpy不要)
+# VECTOR_SIMPLIFY: "native"で境界線を単純化する距離 (地図単位)。0の場合はセルの角をすべて残す
+# VECTOR_GEOJSON: True の場合、"native"はシェープファイルと同じ名前のGeoJSON (.geojson) も書き出す
+# VECTOR_BENCHMARK: True の場合、"native"の結果をRasterToPolygonの結果 (<名前>_arcpy.shp) と比べ、時間・頂点数・面積を表示し、<名前>_benchmark.jsonに保存する
+# VECTOR_NESTED: True の場合、raster_to_shapefileは入れ子の値 (merge_runsの結果など) を「値 >= k」の範囲ごとにポリゴン化し、共有する境界を1回だけTopoJSONに保存する ("native"のみ)
+# VECTOR_BACKGROUND: VECTOR_NESTEDで範囲を作らない背景の値 (この値以下)
+# VECTOR_WORKERS: raster_to_shapefileのバッチ (複数のラスタ) を並列に変換するプロセス数 (0: すべてのCPUコア、"native"のみ)
+# VECTOR_BATCH_CHECK: バッチで変換済みのラスタを飛ばす判定。"mtime" (サイズと更新日時)、"hash" (内容)、"none" (常に変換)
+# DISTAL_COEFFICIENT_SETS: distal_inundationで一度に計算するcoefficient_setting.pyの係数セット名の一覧 (例: ["Lahar", "Debris_Flow"])。空の場合は選択したflowTypeだけを計算する
+# HYDRO_UPDATE_EXTENT: DEMを編集した範囲 ("xmin ymin xmax ymax"、地図単位)。指定すると既存の<prefix>fill/dir/flac/strをその範囲の影響分だけ更新する
+SETTINGS = {
+    "PROGRESS": "arcpy",
+    "VERBOSITY": "NORMAL",
+    "PROGRESS_INTERVAL": 5.0,
+    "MERGE_MODE": "memory",
+    "MERGE_BLOCK_ROWS": 512,
+    "MERGE_WORKERS": 1,
+    "MERGE_INCREMENTAL": False,
+    "CONE_METHOD": "arcpy",
+    "CONE_TILE_SIZE": 64,
+    "CONE_MEMORY_MB": 64,
+    "CONE_REACH_WINDOW": True,
+    "HL_SWEEP_SLOPES": [],
+    "BOUNDARY_METHOD": "arcpy",
+    "WRITE_VECTOR_PRODUCTS": False,
+    "START_POINT_DEDUP": False,
+    "DEDUP_PATH_CELLS": 10,
+    "SCRATCH_MEMORY_MB": 1024,
+    "HYDRO_METHOD": "arcpy",
+    "HYDRO_FILL_EPSILON": 0.0,
+    "HYDRO_BLOCK_ROWS": 1024,
+    "HYDRO_WEIGHT_RASTER": "",
+    "HYDRO_TILE_SIZE": 2048,
+    "HYDRO_WORKERS": 0,
+    "HYDRO_UPDATE_EXTENT": "",
+    "STREAM_INDEX": False,
+    "STREAM_INDEX_MIN": 100,
+    "STREAM_GRAPH": False,
+    "FLOW_PATH_ESTIMATES": False,
+    "HYDRO_CACHE": False,
+    "HYDRO_CACHE_MB": 10240,
+    "HYDRO_CACHE_FOLDER": "",
+    "VECTOR_METHOD": "arcpy",
+    "VECTOR_SIMPLIFY": 0.0,
+    "VECTOR_GEOJSON": False,
+    "VECTOR_BENCHMARK": False,
+    "VECTOR_NESTED": False,
+    "VECTOR_BACKGROUND": 1,
+    "VECTOR_WORKERS": 0,
+    "VECTOR_BATCH_CHECK": "mtime",
+    "DISTAL_COEFFICIENT_SETS": [],
+}
+
+"""
+2026年10月19日
+このPythonファイルは、LaharZの各ツールの実行設定を指定するためのものです。
+辞書の変数である"SETTINGS"の値を変更してください。ツール実行のたびに読み直されます。
+
+VERBOSITYの意味は以下の通りです。
+  "QUIET"   : 警告のみ
+  "NORMAL"  : 処理の見出しと、PROGRESS_INTERVAL秒ごとの進捗 (通常はこれ)
+  "VERBOSE" : 流下計算1回ごと、ラスタ1枚ごとの情報
+  "DEBUG"   : 河道セル1つごとの情報 (旧LaharZと同じ出力。ArcGIS Proでは非常に遅くなります)
+
+MERGE_MODE = "stream" は、数百の流下計算結果を統合する場合や、結果ラスタがDEM全体を覆っていない場合に使います。
+使用メモリはMERGE_BLOCK_ROWS (とMERGE_WORKERS) で決まり、結果ラスタの数や大きさには依存しません。
+出力は作業フォルダ内の一時ファイル (memmap) に書き込まれ、最後にラスタに変換されます。
+
+MERGE_INCREMENTAL = True の場合、merge_runsは統合に使った結果ラスタの一覧を作業フォルダの"merge_manifest.json"に記録し、
+一覧にない結果ラスタ (起点を追加して計算したもの) だけを読んで既存のmerge_<w>を更新します。一覧から削除された、
+または再計算された結果ラスタがある場合は、全体を統合し直します。再計算の判定はファイルの更新日時とサイズで行いますが、
+ジオデータベース内のラスタはファイルがないため、MERGE_BLOCK_ROWS行ずつ読んで内容のハッシュで判定します (結果ラスタを
+毎回すべて読むことになります)。MERGE_INCREMENTAL = False で統合した場合、古いmerge_manifest.jsonは削除されます。
+
+CONE_METHOD = "numpy" では、Textfileの頂点が多数 (火口縁全体など) でも、頂点ごとのGeoTIFFを作らずに
+すべての頂点のコーンの上包絡面を一度に計算します。
+
+HL_SWEEP_SLOPES を指定すると、proximal_zoneは入力したH/Lの代わりに一覧のすべてのH/Lについて
+hl_cone<H/L>.shp、startpnts_<H/L>.txt などを出力します。頂点からの距離場 (各セルの臨界H/L) は一度だけ計算され、
+作業フォルダの"laharz_cache"に保存されます。同じDEMと頂点で、範囲内のH/Lを再度計算する場合は保存済みのものを使います。
+
+BOUNDARY_METHOD = "numpy" では、コーンの境界 (周囲8セルのいずれかがコーンの外にあるセル) と河道の交点を配列上で求め、
+ポリゴン・ラインへの変換を行いません。境界のシェープファイルが必要な場合は WRITE_VECTOR_PRODUCTS = True にしてください。
+
+START_POINT_DEDUP = True の場合、起点から<prefix>dirの流向に沿って下流をたどり、同じ河道の起点は最も上流の1点だけを
+startpnts_<H/L>.txtに書き込みます。省略したdistal_inundationの計算回数はメッセージに表示されます。
+下流で合流するだけの支流の起点や、互いに流れ込まない隣接セルの起点は別の河道として残します。省いた起点と、その起点を
+流路上に持つ起点の組はメッセージに表示されます。
+
+proximal_zoneとdistal_inundationの中間ファイル (xhltemp.tif、hl_cone_1.shp、startpts_gなど) は、作業フォルダの
+"laharz_scratch"内に実行ごとに作られるフォルダに置かれ、終了時に削除されます。同じ作業フォルダで複数のツールを
+同時に実行しても中間ファイルが衝突しません。配列の中間データはSCRATCH_MEMORY_MBまでメモリに保持されます。
+
+HYDRO_METHOD = "native" では、surface_hydroがSpatial Analystを使わずに<prefix>fillを作成します (priority-flood法)。
+numbaがインストールされていれば高速に計算されます (ない場合も結果は同じですが、数十倍の時間がかかるため警告が表示されます)。
+Spatial AnalystのFillとの速度・結果の比較は、ArcGIS Proのpythonで hydro_benchmark.py を実行すると表示されます。
+<prefix>dirもFlowDirectionと同じESRIの流向コード (1, 2, 4, ... 128) で作成されます。平坦地のセルは、同じ標高で
+すでに流下しているセルへ向かう最短経路の方向に流れます。DEMの端やNoDataに接するセルで低い隣接セルがないものは外側へ流れます。
+<prefix>flacは上流のセル数 (符号なし32ビット整数) です。HYDRO_WEIGHT_RASTERを指定した場合は、上流のセルの重みの合計
+(浮動小数点) になります。重みラスタはDEMと同じ範囲・セルサイズにしてください。
+
+HYDRO_METHOD = "tiled" では、DEMをHYDRO_TILE_SIZEのタイルに分けて、窪地埋め・流向・流量累積をHYDRO_WORKERS個のプロセスで
+計算し、タイル間の流出標高と流量をつなぎ合わせます。結果は"native"でDEM全体を計算した場合と同じです。
+広域のモザイクDEMなど、1つのCPUコアでは時間がかかる場合に使います (タイルごとの計算が増えるため、コアが1つだけの場合は"native"より遅くなります)。
+HYDRO_FILL_EPSILON > 0 の場合、窪地埋めだけはDEM全体で計算されます。
+
+新しい噴出物やLiDARデータでDEMの一部を修正した場合は、修正したDEMを入力し、同じprefixでHYDRO_UPDATE_EXTENTに
+修正した範囲を指定してsurface_hydroを実行します。範囲内のセル、範囲に流れ込んでいたセル、範囲に接する窪地だけを埋め直し、
+流向はその周辺と接する平坦地だけ、流量累積は流向が変わったセルの下流だけを計算し直して、既存のラスタを上書きします。
+結果はDEM全体を計算し直した場合と同じです (HYDRO_FILL_EPSILON = 0 の場合)。既存のラスタがない場合はDEM全体を計算します。
+既存のラスタがHYDRO_METHOD = "native"または"tiled"で作成されていない場合 (laharz_textfilesの<prefix>hydro_products.jsonで判定)、
+またはHYDRO_FILL_EPSILON・HYDRO_WEIGHT_RASTERが変わった場合も、警告を表示してDEM全体を計算します。
+更新が終わったら、HYDRO_UPDATE_EXTENTを""に戻してください。
+
+STREAM_INDEX = True の場合、new_stream_networkは最初の実行時に<prefix>flacと<prefix>dirから河道網インデックスを作り、
+作業フォルダの"laharz_cache"に保存します (<prefix>stream_index.npz)。インデックスは合流点の間の河道区間ごとに、
+STREAM_INDEX_MINを超えるセルと流量累積を上流から順に記録したもので、2回目以降はラスタ全体を読まずに任意の閾値の
+<prefix>str<閾値>を作成できます。閾値は";"で区切って複数指定できます (例: 500;1000;2000)。
+<prefix>flacまたは<prefix>dirが更新された場合、インデックスは自動的に作り直されます。
+
+STREAM_GRAPH = True の場合、<prefix>str<閾値>の河道セルを合流点で区切った河道区間 (エッジ) と、源流端・合流点・流出端 (ノード)、
+各区間の下流の区間、Strahler次数を配列で表した河道網グラフを<prefix>str<閾値>_graph.npzに保存します。
+他のツールからはstream_graph.pyのLoadStreamGraphで読み込み、CellSegments (セルの河道区間) やTraceDownstream
+(下流への河道セルの列) で、<prefix>dirを1セルずつたどらずに河道を検索できます。
+
+FLOW_PATH_ESTIMATES = True の場合、distal_inundationは<prefix>dirから全セルの下流の流路 (流出端までの距離・セル数、
+流出端の番号、DEMの端に達するかどうか) をポインタジャンプ法で一度に求め (flow_paths.py)、各起点の流下計算がたどる
+セル数の上限を進捗表示に使います。ある起点の流路が別の起点を通る場合も表示されます (流下計算の結果が重なる起点の確認用)。
+
+HYDRO_CACHE = True の場合、surface_hydroは作成した<prefix>fill、<prefix>dir、<prefix>flacと閾値ごとの<prefix>str<閾値>を
+圧縮してキャッシュ (HYDRO_CACHE_FOLDER、既定では作業フォルダの"laharz_cache\\hydro") に保存します。
+DEMの値・位置・セルサイズ・座標系、計算方法 (arcpyかnative/tiled)、HYDRO_FILL_EPSILON、重みラスタが同じであれば、
+別のprefixで実行しても計算せずにキャッシュからコピーします。DEMを修正した場合は別のDEMとして扱われます。
+キャッシュの合計がHYDRO_CACHE_MBを超えた場合は、最も長く使われていないDEMのものから削除されます。
+
+VECTOR_METHOD = "native" の場合、raster_to_shapefileはラスタをNumPy配列に読み込み、値の異なるセルの境界を追跡して
+ポリゴン (穴を含む) を作ります (native_vector.py)。RasterToPolygon ("NO_SIMPLIFY") と同じく、同じ値で辺で接するセルの
+まとまりごとに1つのポリゴンになり、属性はIdとgridcodeです。階段状の境界の角だけを頂点として残します。
+VECTOR_SIMPLIFY > 0 の場合、3つ以上のポリゴンが接する点の間の境界線をDouglas-Peucker法で単純化します。隣り合う
+ポリゴンは同じ線を共有するので、すき間や重なりはできません (交差する線になる場合、その区間は単純化しません)。
+"native"の速度と結果はRasterToPolygonとまだ実データで比べていないため、VECTOR_METHODの既定値は"arcpy"のままです。
+"native"に切り替える前に、VECTOR_BENCHMARK = True でmerge_runsの結果 (merge_<w>) を変換し、<シェープファイル名>_benchmark.json
+の時間・ポリゴン数・頂点数・gridcodeごとの面積の差を確認してください。
+arcpyがない環境では、ESRI ASCIIグリッド (.asc) をコマンドラインから変換できます:
+    python raster_to_shapefile.py <作業フォルダ> <シェープファイル名> <ラスタ名.asc>
+
+VECTOR_NESTED = True の場合 (VECTOR_METHODに関係なく"native"で計算)、merge_runsやdistal_inundationの結果のように
+値が入れ子になったラスタ (大きな値ほど小さな体積の範囲) を、VECTOR_BACKGROUNDより大きい値kごとに「値 >= k」の範囲として
+一度にポリゴン化します。シェープファイルには全ての範囲が入り、属性はId、gridcode (k)、AREA (ポリゴンの面積)、
+ZONEAREA (その範囲全体の面積) です。同じ名前の.topojsonには範囲ごとのレイヤ (zone_<k>) が入り、範囲どうしが共有する
+境界線は1回だけ保存されるので、体積の数が増えてもファイルがあまり大きくなりません。単純化した場合も共有する境界は同じ線になります。
+
+raster_to_shapefileの3番目の引数に「;」で区切った複数のラスタ名や「merge_*」のようなパターンを指定すると、バッチとして
+すべてのラスタを<シェープファイル名>_<ラスタ名>.shpに変換します。"native"ではVECTOR_WORKERS個のプロセスで並列に変換します。
+変換の結果と時間はlaharz_textfiles/<シェープファイル名>_batch.jsonに記録され、次のバッチでは前回と同じ設定で変換され、
+その後ラスタが変わっていない (VECTOR_BATCH_CHECKで判定) ラスタは変換せずに飛ばします。
+
+DISTAL_COEFFICIENT_SETS を指定すると、distal_inundationは選択したflowTypeの代わりに一覧のすべての係数セットについて、
+河道を一度たどるだけで計算します。各断面で横断方向にたどるセルは標高だけで決まるので、すべての係数セットで共有し、
+係数セットごとに断面積を引いていきます (結果は係数セットごとに実行した場合と同じです)。結果ラスタは
+<drainName><label><n> (labelはcoefficient_setting.pyで指定) で、.ptsファイルには係数セットと体積の組み合わせごとの列が出力されます。
+このときツールで選択したflowType (信頼限界を含む) は使われず、そのことを警告として表示します。
+"""
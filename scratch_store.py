@@ -0,0 +1,111 @@
+# ---------------------------------------------------------------------------
+# scratch_store.py
+#
+# Usage: imported by the Laharz_py tools (proximal_zone.py, distal_inundation.py)
+#
+#   This module keeps the intermediate rasters of one tool run.  Arrays are
+#  held in memory and only spilled to .npy files once the arrays of the run
+#  exceed a memory threshold.  Intermediates that arcpy tools must read or
+#  write as datasets get a path in a scratch folder of their own
+#  (<workspace>\laharz_scratch\<tool>_<process id>_<random>), so two tools
+#  running in the same workspace never share a file name.  cleanup()
+#  removes everything the run created in one call.
+# ---------------------------------------------------------------------------
+
+# Start Up - Import system modules
+import os, shutil, uuid
+import numpy
+
+#===========================================================================
+#  Scratch store
+#===========================================================================
+
+class ScratchStore(object):
+    # =====================================
+    # Parameters:
+    #   workspace:  workspace of the tool run
+    #   toolname:   name of the tool, used in the scratch folder name
+    #   memorymb:   arrays above this total (MB) are spilled to disk
+    #
+    # Use as:
+    #   scratch = ScratchStore(env.workspace, "proximal_zone", 1024)
+    #   env.scratchWorkspace = scratch.folder()
+    #   B = scratch.put("startpts_g", array)
+    #   name = scratch.path("hl_cone_1.shp")
+    #   scratch.cleanup()
+    # =====================================
+
+    def __init__(self, workspace, toolname, memorymb=1024):
+        self.root = os.path.join(workspace, "laharz_scratch")
+        self.name = toolname + "_" + str(os.getpid()) + "_" + uuid.uuid4().hex[:8]
+        self.memorylimit = int(float(memorymb) * 1048576)
+        self.arrays = {}     # name -> array held in memory
+        self.spilled = {}    # name -> .npy file of a spilled array
+        self.inmemory = 0    # bytes of the arrays held in memory
+        self.spills = 0      # number of arrays spilled, keeps file names unique
+
+    def folder(self):
+        # scratch folder of this run, created on first use
+        folder = os.path.join(self.root, self.name)
+        if not os.path.isdir(folder):
+            os.makedirs(folder, exist_ok=True)
+        return folder
+
+    def path(self, name):
+        # path of a dataset named name in the scratch folder
+        return os.path.join(self.folder(), name)
+
+    def put(self, name, array):
+        # =====================================
+        # Keeps array under name, in memory if it fits under the
+        # threshold, else in a .npy file read back as a writable memmap
+        #
+        # Returns:  the stored array
+        # =====================================
+        self.delete(name)
+        if self.inmemory + array.nbytes <= self.memorylimit:
+            self.arrays[name] = array
+            self.inmemory += array.nbytes
+            return array
+        # a new file each time, an earlier memmap of name may still be open
+        self.spills += 1
+        filename = self.path(name + "_" + str(self.spills) + ".npy")
+        numpy.save(filename, array)
+        self.spilled[name] = filename
+        return numpy.load(filename, mmap_mode="r+")
+
+    def get(self, name):
+        if name in self.arrays:
+            return self.arrays[name]
+        return numpy.load(self.spilled[name], mmap_mode="r+")
+
+    def __contains__(self, name):
+        return name in self.arrays or name in self.spilled
+
+    def delete(self, name):
+        # forget an array; a spilled file is removed with the folder
+        array = self.arrays.pop(name, None)
+        if array is not None:
+            self.inmemory -= array.nbytes
+        self.spilled.pop(name, None)
+
+    def cleanup(self):
+        # =====================================
+        # Drops all arrays and removes the scratch folder of this run,
+        # and laharz_scratch itself once no other run is using it
+        # =====================================
+        self.arrays = {}
+        self.spilled = {}
+        self.inmemory = 0
+        shutil.rmtree(os.path.join(self.root, self.name), ignore_errors=True)
+        try:
+            os.rmdir(self.root)
+        except OSError:
+            pass     # another run still has a scratch folder
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.cleanup()
+        return False
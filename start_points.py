@@ -0,0 +1,126 @@
+# ---------------------------------------------------------------------------
+# start_points.py
+#
+# Usage: imported by proximal_zone.py
+#
+#   This module reduces the start points found where the H/L cone boundary
+#  crosses the streams to one point per channel.  A crossing cell that lies
+#  within a few cells down the path of another crossing cell (traced
+#  through the <prefix>dir grid) would give a nearly identical
+#  distal_inundation run, so only the upstream cell is kept.  Tributaries
+#  whose paths only meet further down, and neighbouring cells that do not
+#  drain into each other, are different channels and are all kept.
+# ---------------------------------------------------------------------------
+
+# Start Up - Import system modules
+import numpy
+from native_hydro import D8_CODES, NEIGHBOUR_ROWS, NEIGHBOUR_COLS
+
+# ESRI flow direction code -> (row step, column step)
+D8_OFFSETS = dict(zip(D8_CODES, zip(NEIGHBOUR_ROWS, NEIGHBOUR_COLS)))
+
+#===========================================================================
+#  Local Functions
+#===========================================================================
+
+def DownstreamPoints(rows, cols, direction, pathcells=10):
+    # =====================================
+    # Parameters:
+    #   rows, cols:  row and column of every start point cell
+    #   direction:   flow direction array (ESRI codes) aligned with the DEM
+    #   pathcells:   number of cells each downstream path is traced
+    #
+    # Returns:  list of the other points on the downstream path of
+    #           every point, in path order
+    # =====================================
+
+    numpoints = len(rows)
+    numrows, numcols = direction.shape
+    index = {}
+    for i in range(numpoints):
+        index[(int(rows[i]), int(cols[i]))] = i
+
+    reach = []
+    for i in range(numpoints):
+        r = int(rows[i])
+        c = int(cols[i])
+        found = []
+        for step in range(pathcells):
+            move = D8_OFFSETS.get(int(direction[r, c]))
+            if move is None:
+                break       # sink, NoData or edge of the flow direction grid
+            r += move[0]
+            c += move[1]
+            if r < 0 or c < 0 or r >= numrows or c >= numcols:
+                break
+            j = index.get((r, c))
+            if j is not None and j != i and j not in found:
+                found.append(j)
+        reach.append(found)
+    return reach
+
+def ChannelGroups(rows, cols, direction, pathcells=10):
+    # =====================================
+    # Parameters:
+    #   rows, cols:  row and column of every start point cell
+    #   direction:   flow direction array (ESRI codes) aligned with the DEM
+    #   pathcells:   number of cells each downstream path is traced
+    #
+    # Groups start points on the same channel: a point is merged into a
+    # point upstream whose downstream path passes through it within
+    # pathcells cells.  Points whose paths only meet, and 8-neighbours
+    # that do not drain into each other, stay apart.  When two points
+    # are on each other's path (a loop in the flow directions) the
+    # first one is kept.
+    #
+    # Returns:  for every point the index of the kept point it was
+    #           merged into, or -1 for the points that are kept
+    # =====================================
+
+    numpoints = len(rows)
+    reach = DownstreamPoints(rows, cols, direction, pathcells)
+    upstream = [[] for i in range(numpoints)]    # points whose path reaches each point
+    for i in range(numpoints):
+        for j in reach[i]:
+            if not (i in reach[j] and j < i):
+                upstream[j].append(i)
+
+    into = numpy.full(numpoints, -1, dtype=numpy.int64)
+    kept = [len(upstream[i]) == 0 for i in range(numpoints)]
+    for j in range(numpoints):
+        if kept[j]:
+            continue
+        # nearest kept point up the paths reaching j
+        queue = sorted(upstream[j])
+        seen = set(queue)
+        while queue and into[j] < 0:
+            i = queue.pop(0)
+            if kept[i]:
+                into[j] = i
+                break
+            for k in sorted(upstream[i]):
+                if k not in seen:
+                    seen.add(k)
+                    queue.append(k)
+        if into[j] < 0:
+            kept[j] = True      # only reached from a loop of merged points
+    return into
+
+def DedupeStartPoints(rows, cols, direction, pathcells=10):
+    # =====================================
+    # Parameters:
+    #   rows, cols:  row and column of every start point cell
+    #   direction:   flow direction array (ESRI codes) aligned with the DEM
+    #   pathcells:   see ChannelGroups
+    #
+    # Keeps one start point per channel: the points that are not on the
+    # downstream path of another point
+    #
+    # Returns:  (sorted indices of the points to keep, list of
+    #           (merged point, kept point) index pairs)
+    # =====================================
+
+    into = ChannelGroups(rows, cols, direction, pathcells)
+    keep = [i for i in range(len(into)) if into[i] < 0]
+    merged = [(j, int(into[j])) for j in range(len(into)) if into[j] >= 0]
+    return keep, merged
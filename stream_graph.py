@@ -0,0 +1,210 @@
+# ---------------------------------------------------------------------------
+# stream_graph.py
+#
+# Usage: imported by surface_hydro.py and new_stream_network.py, which save
+#        the graph of every <prefix>str<threshold> they create, and by any
+#        tool that follows streams (load it with LoadStreamGraph)
+#
+#   This module describes a stream grid as a graph held in flat arrays:
+#  Segments (edges):  chains of stream cells from a head or a confluence to
+#         the cell before the next confluence; their cells are one range
+#         of the cell list, upstream first.  Each segment has its Strahler
+#         order, the segment it flows into, and its upstream and
+#         downstream node.
+#  Nodes:  heads, confluences (the first cell of the segment below) and
+#         outlets (the last stream cell of a path), by cell number.
+#  A graph is saved as <prefix>str<threshold>_graph.npz next to the grid.
+# ---------------------------------------------------------------------------
+
+# Start Up - Import system modules
+import os
+import numpy
+from native_hydro import TopologicalFrontiers
+from stream_index import StreamSegments
+
+# node kinds
+HEAD = 0
+CONFLUENCE = 1
+OUTLET = 2
+
+#===========================================================================
+#  Local Functions
+#===========================================================================
+
+def StrahlerOrder(segdown):
+    # =====================================
+    # Parameters:
+    #   segdown:  segment each segment flows into, -1 for none
+    #
+    # Returns:  Strahler order of every segment: 1 for a head segment,
+    #           else the highest order flowing in, plus one when two or
+    #           more segments flowing in have it
+    # =====================================
+    numsegments = len(segdown)
+    order = numpy.zeros(numsegments, dtype=numpy.int32)
+    best = numpy.zeros(numsegments, dtype=numpy.int32)     # highest order flowing in
+    ties = numpy.zeros(numsegments, dtype=numpy.int32)     # segments flowing in with it
+    donors = numpy.zeros(numsegments, dtype=bool)
+    donors[segdown[segdown >= 0]] = True
+    for frontier in TopologicalFrontiers(segdown, numpy.flatnonzero(~donors)):
+        order[frontier] = numpy.where(best[frontier] == 0, 1, best[frontier] + (ties[frontier] >= 2))
+        target = segdown[frontier]
+        keep = target >= 0
+        target = target[keep]
+        value = order[frontier[keep]]
+        if len(target) == 0:
+            continue
+        # highest order and its count for every target in this frontier
+        sort = numpy.lexsort((-value, target))
+        target = target[sort]
+        value = value[sort]
+        first = numpy.concatenate(([True], target[1:] != target[:-1]))
+        starts = numpy.flatnonzero(first)
+        targets = target[starts]
+        highest = value[starts]
+        lengths = numpy.diff(numpy.append(starts, len(value)))
+        counts = numpy.add.reduceat((value == numpy.repeat(highest, lengths)).astype(numpy.int32), starts)
+        higher = highest > best[targets]
+        same = highest == best[targets]
+        best[targets[higher]] = highest[higher]
+        ties[targets[higher]] = counts[higher]
+        ties[targets[same]] += counts[same]
+    return order
+
+#===========================================================================
+#  Stream graph
+#===========================================================================
+
+def BuildStreamGraph(stream, codes):
+    # =====================================
+    # Parameters:
+    #   stream:  stream grid, 1 on stream cells (other values off stream)
+    #   codes:   flow direction array (ESRI codes)
+    #
+    # Returns:  dictionary of arrays:
+    #   cells, offsets:  cells of every segment, upstream first
+    #   segdown:   segment each segment flows into, -1 at an outlet
+    #   upnode, downnode:  nodes at the two ends of every segment
+    #   strahler:  Strahler order of every segment
+    #   nodecell, nodekind:  cell number and kind of every node
+    #   shape
+    # =====================================
+    cells, offsets, down = StreamSegments((stream == 1).ravel(), codes)
+    numsegments = len(offsets) - 1
+    firsts = cells[offsets[:-1]].astype(numpy.int64)
+    lasts = cells[offsets[1:] - 1].astype(numpy.int64)
+
+    # segment below every segment: the one starting at the next cell
+    order = numpy.argsort(firsts)
+    below = down[lasts]
+    segdown = numpy.full(numsegments, -1, dtype=numpy.int64)
+    flows = below >= 0
+    segdown[flows] = order[numpy.searchsorted(firsts[order], below[flows])]
+
+    # nodes: the first cell of every segment (head or confluence), and
+    # the last cell of the segments that end the stream
+    donors = numpy.bincount(segdown[segdown >= 0], minlength=numsegments)
+    outlets = numpy.flatnonzero(segdown < 0)
+    nodecell = numpy.concatenate((firsts, lasts[outlets]))
+    nodekind = numpy.concatenate((numpy.where(donors == 0, HEAD, CONFLUENCE), numpy.full(len(outlets), OUTLET))).astype(numpy.uint8)
+    upnode = numpy.arange(numsegments, dtype=numpy.int64)
+    downnode = numpy.empty(numsegments, dtype=numpy.int64)
+    downnode[flows] = segdown[flows]
+    downnode[outlets] = numsegments + numpy.arange(len(outlets))
+
+    graph = {"cells": cells,
+             "offsets": offsets,
+             "segdown": segdown,
+             "upnode": upnode,
+             "downnode": downnode,
+             "strahler": StrahlerOrder(segdown),
+             "nodecell": nodecell,
+             "nodekind": nodekind,
+             "shape": numpy.array(codes.shape, dtype=numpy.int64)}
+    return graph
+
+def SaveStreamGraph(filename, graph):
+    # saves graph as an uncompressed .npz file, quick to load
+    arrays = {name: graph[name] for name in graph if not name.startswith("sorted")}
+    with open(filename, "wb") as afile:
+        numpy.savez(afile, **arrays)
+
+def LoadStreamGraph(filename):
+    # =====================================
+    # Returns:  graph saved by SaveStreamGraph, or None if there is none
+    # =====================================
+    if not os.path.isfile(filename):
+        return None
+    with numpy.load(filename) as saved:
+        return {name: saved[name] for name in saved.files}
+
+def GraphFileName(strname):
+    # name of the graph file saved with the stream grid strname
+    return strname + "_graph.npz"
+
+#===========================================================================
+#  Queries
+#===========================================================================
+
+def CellSegments(graph, cells):
+    # =====================================
+    # Parameters:
+    #   graph:  result of BuildStreamGraph
+    #   cells:  flat cell numbers (row * columns + column)
+    #
+    # Returns:  (segment of every cell, -1 off the streams; position of
+    #           the cell in its segment)
+    # =====================================
+    if "sortedcells" not in graph:
+        order = numpy.argsort(graph["cells"])
+        graph["sortedcells"] = graph["cells"][order]
+        graph["sortedplaces"] = order
+    cells = numpy.asarray(cells, dtype=numpy.int64)
+    sortedcells = graph["sortedcells"]
+    found = numpy.searchsorted(sortedcells, cells)
+    found = numpy.minimum(found, len(sortedcells) - 1)
+    onstream = (len(sortedcells) > 0) & (sortedcells[found] == cells)
+    places = graph["sortedplaces"][found]
+    segments = numpy.searchsorted(graph["offsets"], places, side="right") - 1
+    positions = places - graph["offsets"][numpy.maximum(segments, 0)]
+    return numpy.where(onstream, segments, -1), numpy.where(onstream, positions, -1)
+
+def DownstreamSegments(graph, segment):
+    # =====================================
+    # Returns:  list of the segments from segment down to its outlet
+    # =====================================
+    segments = []
+    while segment >= 0:
+        segments.append(int(segment))
+        segment = graph["segdown"][segment]
+    return segments
+
+def TraceDownstream(graph, cell, maxcells=None):
+    # =====================================
+    # Parameters:
+    #   graph:     result of BuildStreamGraph
+    #   cell:      flat cell number of a stream cell
+    #   maxcells:  length of the path returned, None for all of it
+    #
+    # Returns:  array of the stream cells from cell down to the outlet,
+    #           empty if cell is not on a stream
+    # =====================================
+    segments, positions = CellSegments(graph, [cell])
+    if segments[0] < 0:
+        return numpy.zeros(0, dtype=numpy.int64)
+    offsets = graph["offsets"]
+    parts = []
+    count = 0
+    for segment in DownstreamSegments(graph, segments[0]):
+        start = offsets[segment]
+        if segment == segments[0]:
+            start += positions[0]
+        part = graph["cells"][start:offsets[segment + 1]]
+        parts.append(part)
+        count += len(part)
+        if maxcells is not None and count >= maxcells:
+            break
+    path = numpy.concatenate(parts).astype(numpy.int64)
+    if maxcells is not None:
+        path = path[:maxcells]
+    return path
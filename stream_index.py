@@ -0,0 +1,191 @@
+# ---------------------------------------------------------------------------
+# stream_index.py
+#
+# Usage: imported by new_stream_network.py
+#
+#   This module keeps the stream network of every threshold in one index
+#  built from <prefix>flac and <prefix>dir.  Flow accumulation only grows
+#  downstream, so the cells above a threshold are, on every chain of cells
+#  between two confluences (a segment), a downstream part of the chain.
+#  The index stores the cells above a minimum threshold segment by segment,
+#  upstream first, with their accumulation; the stream cells of any higher
+#  threshold are then found from the segments alone: whole segments above
+#  it, and the downstream part of the segments it cuts.
+#  The index is saved as an .npz file with the signature of the grids it
+#  was built from.
+# ---------------------------------------------------------------------------
+
+# Start Up - Import system modules
+import os, json
+import numpy
+from native_hydro import DownstreamCells, DIR_NODATA
+
+#===========================================================================
+#  Local Functions
+#===========================================================================
+
+def Ranges(starts, ends):
+    # =====================================
+    # Returns:  positions start..end-1 of every range, one after the other
+    # =====================================
+    lengths = ends - starts
+    keep = lengths > 0
+    starts = starts[keep]
+    lengths = lengths[keep]
+    if len(lengths) == 0:
+        return numpy.zeros(0, dtype=numpy.int64)
+    steps = numpy.ones(int(lengths.sum()), dtype=numpy.int64)
+    firsts = numpy.concatenate(([0], numpy.cumsum(lengths)[:-1]))
+    steps[firsts] = starts
+    steps[firsts[1:]] -= starts[:-1] + lengths[:-1] - 1
+    return numpy.cumsum(steps)
+
+def StreamSegments(member, codes):
+    # =====================================
+    # Parameters:
+    #   member:  flat boolean array of the stream cells
+    #   codes:   flow direction array (ESRI codes)
+    #
+    # Splits the stream cells into segments: a segment starts at a head
+    # or a confluence and runs down to the cell before the next
+    # confluence, or to the last stream cell
+    #
+    # Returns:  (cells segment by segment, upstream first; offsets of
+    #           the segments in cells and the end; downstream stream
+    #           cell of every cell, -1 for none)
+    # =====================================
+    numrows, numcols = codes.shape
+    down = DownstreamCells(codes)
+    down[~member] = -1
+    down[down >= 0] = numpy.where(member[down[down >= 0]], down[down >= 0], -1)
+    donors = numpy.bincount(down[down >= 0], minlength=len(down))
+
+    frontier = numpy.flatnonzero(member & (donors != 1))
+    segment = numpy.arange(len(frontier), dtype=numpy.int64)
+    cells = [frontier]
+    segments = [segment]
+    positions = [numpy.zeros(len(frontier), dtype=numpy.int64)]
+    position = 0
+    while len(frontier) > 0:
+        position += 1
+        frontier = down[frontier]
+        follow = frontier >= 0
+        frontier = frontier[follow]
+        segment = segment[follow]
+        follow = donors[frontier] == 1
+        frontier = frontier[follow]
+        segment = segment[follow]
+        cells.append(frontier)
+        segments.append(segment)
+        positions.append(numpy.full(len(frontier), position, dtype=numpy.int64))
+    cells = numpy.concatenate(cells)
+    segments = numpy.concatenate(segments)
+    order = numpy.lexsort((numpy.concatenate(positions), segments))
+    cells = cells[order]
+    if numrows * numcols < 2 ** 31:
+        cells = cells.astype(numpy.int32)
+    counts = numpy.bincount(segments, minlength=len(positions[0]))
+    offsets = numpy.zeros(len(counts) + 1, dtype=numpy.int64)
+    numpy.cumsum(counts, out=offsets[1:])
+    return cells, offsets, down
+
+#===========================================================================
+#  Stream network index
+#===========================================================================
+
+def BuildStreamIndex(accumulation, codes, minthreshold):
+    # =====================================
+    # Parameters:
+    #   accumulation:  flow accumulation array, NoData as nan or on the
+    #                  DIR_NODATA cells of codes
+    #   codes:         flow direction array (ESRI codes)
+    #   minthreshold:  lowest stream threshold the index can answer
+    #
+    # Returns:  dictionary of arrays:
+    #   cells:    flat cell numbers above minthreshold, segment by
+    #             segment, upstream first
+    #   acc:      accumulation of those cells
+    #   offsets:  first position of every segment in cells, and the end
+    #   minacc, maxacc:  accumulation at the top and bottom of segments
+    #   nodata:   packed bits of the NoData cells
+    #   shape, minthreshold
+    # =====================================
+    acc = accumulation.ravel()
+    nodata = codes.ravel() == DIR_NODATA
+    if numpy.issubdtype(acc.dtype, numpy.floating):
+        nodata |= numpy.isnan(acc)
+    cells, offsets, down = StreamSegments(~nodata & (acc > minthreshold), codes)
+    cellacc = acc[cells]
+
+    index = {"cells": cells,
+             "acc": cellacc,
+             "offsets": offsets,
+             "minacc": cellacc[offsets[:-1]],
+             "maxacc": cellacc[offsets[1:] - 1],
+             "nodata": numpy.packbits(nodata),
+             "shape": numpy.array(codes.shape, dtype=numpy.int64),
+             "minthreshold": numpy.array(minthreshold, dtype=numpy.float64)}
+    return index
+
+def StreamCells(index, threshold):
+    # =====================================
+    # Parameters:
+    #   index:      result of BuildStreamIndex
+    #   threshold:  stream threshold, not below the minthreshold of index
+    #
+    # Returns:  flat cell numbers with accumulation above threshold
+    # =====================================
+    if threshold < float(index["minthreshold"]):
+        raise ValueError("stream threshold " + str(threshold) + " is below the index minimum " +
+                         str(float(index["minthreshold"])))
+    offsets = index["offsets"]
+    starts = offsets[:-1]
+    ends = offsets[1:]
+    whole = index["minacc"] > threshold
+    cut = ~whole & (index["maxacc"] > threshold)
+    parts = [Ranges(starts[whole], ends[whole])]
+    if cut.any():
+        # the segments cut by threshold keep their downstream cells
+        positions = Ranges(starts[cut], ends[cut])
+        parts.append(positions[index["acc"][positions] > threshold])
+    return index["cells"][numpy.concatenate(parts)]
+
+def StreamGrid(index, threshold, nodata=255):
+    # =====================================
+    # Returns:  uint8 stream grid of threshold, 1 on streams, 0 off
+    #           streams, nodata on NoData, as GreaterThan on <prefix>flac
+    # =====================================
+    shape = tuple(int(v) for v in index["shape"])
+    numcells = shape[0] * shape[1]
+    grid = numpy.zeros(numcells, dtype=numpy.uint8)
+    grid[StreamCells(index, threshold)] = 1
+    grid[numpy.unpackbits(index["nodata"], count=numcells).astype(bool)] = nodata
+    return grid.reshape(shape)
+
+def SaveStreamIndex(filename, index, signature):
+    # =====================================
+    # Parameters:
+    #   filename:   .npz file of the index
+    #   index:      result of BuildStreamIndex
+    #   signature:  JSON-able description of the grids it was built from
+    # =====================================
+    folder = os.path.dirname(filename)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder, exist_ok=True)
+    arrays = dict(index)
+    arrays["signature"] = numpy.array(json.dumps(signature))
+    with open(filename, "wb") as afile:
+        numpy.savez(afile, **arrays)
+
+def LoadStreamIndex(filename, signature):
+    # =====================================
+    # Returns:  index saved in filename if it was built from grids with
+    #           the same signature, else None.  A signature holding None
+    #           never matches, so the index is rebuilt.
+    # =====================================
+    if None in signature or not os.path.isfile(filename):
+        return None
+    with numpy.load(filename) as saved:
+        if str(saved["signature"]) != json.dumps(signature):
+            return None
+        return {name: saved[name] for name in saved.files if name != "signature"}
@@ -10,23 +10,147 @@
 #   This program creates surface hydrology datasets from an input raster (DEM)
 #  It fills sinks in the original DEM, then calculates flow direction, flow accumulation,
 #  and delineates streams from flow accumulation according to the stream threshold
+#  With HYDRO_METHOD = "native" in run_setting.py the grids are computed with
+#  native_hydro.py on NumPy arrays instead of the Spatial Analyst tools, and
+#  with "tiled" by tiled_hydro.py, tile by tile in a pool of processes.
+#  With HYDRO_UPDATE_EXTENT set, existing grids of the prefix are updated
+#  by incremental_hydro.py for a DEM edited inside that extent
+#  With HYDRO_CACHE = True the grids are kept by hydro_cache.py and copied
+#  from there when the same DEM is run again under another prefix
 #  
 # ---------------------------------------------------------------------------
 
 # Start Up - Import system modules
-import sys, string, os, arcpy
+import sys, string, os, arcpy, importlib, math, json
+import numpy
 from arcpy import env
 from arcpy.sa import *
+import run_setting
+from run_metrics import RunMetrics
+from native_hydro import PriorityFloodFill, D8FlowDirection, DIR_NODATA, FLAC_NODATA, NUMBA_AVAILABLE
+from native_hydro import FlowAccumulation as NativeFlowAccumulation   # arcpy.sa has a FlowAccumulation tool
+from tiled_hydro import TiledFill, TiledD8FlowDirection, TiledFlowAccumulation
+from incremental_hydro import IncrementalUpdate
+from stream_graph import BuildStreamGraph, SaveStreamGraph, GraphFileName
+from hydro_cache import HydroCacheKey, LoadHydroProducts, SaveHydroProducts, SaveStreamProduct, PruneHydroCache
+from hydro_cache import CacheFolder
 
 # Check out license
 arcpy.CheckOutExtension("Spatial")
 
+#===========================================================================
+#  Local Functions
+#===========================================================================
+
+def LoadSettings():
+    # run_setting.py を毎回読み直して、ArcGIS セッション中の変更も反映する
+    importlib.reload(run_setting)
+    return run_setting.SETTINGS
+
+def ReadDEMArray(rastername):
+    # =====================================
+    # Parameters:
+    #   rastername:  name of the DEM
+    #
+    # Returns:  floating point array of the DEM, NoData as nan
+    # =====================================
+    raster = arcpy.Raster(rastername)
+    A = arcpy.RasterToNumPyArray(raster)
+    if not numpy.issubdtype(A.dtype, numpy.floating):
+        A = A.astype(numpy.float64)
+    if raster.noDataValue is not None:
+        A[A == raster.noDataValue] = numpy.nan
+    return A
+
+def SaveArray(array, rastername, dem_desc, nodata=None):
+    # =====================================
+    # Parameters:
+    #   array:       array aligned with the DEM
+    #   rastername:  name of the output raster
+    #   dem_desc:    arcpy.Describe of the DEM
+    #   nodata:      array value written as NoData; nan is always NoData
+    #
+    # Saves the array with the extent, cell size and coordinate
+    # system of the DEM
+    # =====================================
+    lowerleft = arcpy.Point(dem_desc.extent.XMin, dem_desc.extent.YMin)
+    if nodata is None:
+        raster = arcpy.NumPyArrayToRaster(array, lowerleft, dem_desc.meanCellWidth, dem_desc.meanCellHeight)
+    else:
+        raster = arcpy.NumPyArrayToRaster(array, lowerleft, dem_desc.meanCellWidth, dem_desc.meanCellHeight, nodata)
+    raster.save(rastername)
+    arcpy.DefineProjection_management(rastername, dem_desc.spatialReference)
+
+def ReadGridArray(rastername, dtype, nodata):
+    # =====================================
+    # Parameters:
+    #   rastername:  name of an existing <prefix>dir or <prefix>flac
+    #   dtype:       dtype of the returned array
+    #   nodata:      value given to NoData cells
+    # =====================================
+    raster = arcpy.Raster(rastername)
+    A = arcpy.RasterToNumPyArray(raster)
+    missing = numpy.zeros(A.shape, dtype=bool)
+    if raster.noDataValue is not None:
+        missing = A == raster.noDataValue
+    A = A.astype(dtype)
+    A[missing] = nodata
+    return A
+
+def ReadProductInfo(filename):
+    # =====================================
+    # Returns:  record of how the <prefix>fill/dir/flac grids were made
+    #           (method, epsilon, weight), None if there is none
+    # =====================================
+    try:
+        with open(filename, "r", encoding="utf_8") as afile:
+            return json.load(afile)
+    except (OSError, ValueError):
+        return None
+
+def WriteProductInfo(filename, info):
+    # keeps the record of how the <prefix>fill/dir/flac grids were made
+    if not os.path.isdir(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, "w", encoding="utf_8") as afile:
+        json.dump(info, afile, indent=1)
+
+def ExtentWindow(extent, dem_desc, shape):
+    # =====================================
+    # Parameters:
+    #   extent:    "xmin ymin xmax ymax" of the edited area, map units
+    #   dem_desc:  arcpy.Describe of the DEM
+    #   shape:     (rows, columns) of the DEM
+    #
+    # Returns:  (row0, row1, col0, col1) of the cells touching extent
+    # =====================================
+    xmin, ymin, xmax, ymax = [float(v) for v in extent.split()]
+    cellwidth = dem_desc.meanCellWidth
+    cellheight = dem_desc.meanCellHeight
+    col0 = max(0, int(math.floor((xmin - dem_desc.extent.XMin) / cellwidth)))
+    col1 = min(shape[1], int(math.ceil((xmax - dem_desc.extent.XMin) / cellwidth)))
+    row0 = max(0, int(math.floor((dem_desc.extent.YMax - ymax) / cellheight)))
+    row1 = min(shape[0], int(math.ceil((dem_desc.extent.YMax - ymin) / cellheight)))
+    return row0, row1, col0, col1
+
 
 def main():
     try:
         #===========================================================================
         # Assign user inputs from menu to appropriate variables
         #===========================================================================
+        metrics = RunMetrics("surface_hydro") # wall/cpu time of stages
+        SETTINGS = LoadSettings()
+        hydromethod = SETTINGS.get("HYDRO_METHOD", "arcpy") # "arcpy" Spatial Analyst, "native" or "tiled" arrays
+        onarrays = hydromethod in ("native", "tiled")
+        if onarrays and not NUMBA_AVAILABLE:
+            arcpy.AddWarning("numba is not installed: HYDRO_METHOD \"" + hydromethod + "\" runs its cell loops as plain Python, "
+                             "many times slower than Spatial Analyst (see hydro_benchmark.py)")
+        tilesize = int(SETTINGS.get("HYDRO_TILE_SIZE", 2048))
+        workers = int(SETTINGS.get("HYDRO_WORKERS", 0))
+        weightname = SETTINGS.get("HYDRO_WEIGHT_RASTER", "") # optional weight raster of flow accumulation
+        updateextent = SETTINGS.get("HYDRO_UPDATE_EXTENT", "") # edited area of the DEM, "" recomputes everything
+        usecache = SETTINGS.get("HYDRO_CACHE", False) # reuse grids of a DEM run before
         arcpy.AddMessage("Parsing user inputs:")
           
         env.workspace = sys.argv[1]         # set the ArcGIS workspace
@@ -62,31 +186,225 @@ def main():
         arcpy.AddMessage( "")
         arcpy.AddMessage( "Filling sinks in DEM:  " + Input_surface_raster)
 
-        # Fill
-        arcpy.AddMessage( 'searching for sinks >>')
-        tempa = Fill(Input_surface_raster)
-        tempa.save(fillname)
-        arcpy.AddMessage( 'Created filled DEM: ' + fillname)
+        products = [fillname, dirname, flacname]
+        infoname = textdir + PreName + "hydro_products.json"
+        productinfo = {"method": hydromethod,
+                       "epsilon": float(SETTINGS.get("HYDRO_FILL_EPSILON", 0.0)) if onarrays else 0.0,
+                       "weight": weightname}
+        incremental = updateextent and all(arcpy.Exists(name) for name in products)
+        if updateextent and not incremental:
+            arcpy.AddMessage("  " + PreName + "fill/dir/flac not found: computing the whole DEM")
+        if incremental:
+            # the update repeats the native computation, so only grids
+            # made by "native" or "tiled" with the same options are updated
+            previous = ReadProductInfo(infoname)
+            if previous is None or previous.get("method") not in ("native", "tiled"):
+                incremental = False
+                arcpy.AddWarning("  " + PreName + "fill/dir/flac were not made by HYDRO_METHOD \"native\" or \"tiled\": "
+                                 "computing the whole DEM")
+            elif previous.get("epsilon") != float(SETTINGS.get("HYDRO_FILL_EPSILON", 0.0)) or previous.get("weight") != weightname:
+                incremental = False
+                arcpy.AddWarning("  HYDRO_FILL_EPSILON or HYDRO_WEIGHT_RASTER changed since " + PreName +
+                                 "fill/dir/flac were made: computing the whole DEM")
+            else:
+                productinfo = previous
+
+        # Look the DEM up in the hydrology cache
+        E = None
+        W = None
+        cached = None
+        usecache = usecache and not incremental
+        if usecache:
+            metrics.start("hydro_cache")
+            dem_desc = arcpy.Describe(Input_surface_raster)
+            E = ReadDEMArray(Input_surface_raster)
+            if weightname:
+                W = ReadDEMArray(weightname)
+            cachedir = SETTINGS.get("HYDRO_CACHE_FOLDER", "") or os.path.join(CacheFolder(curdir), "hydro")
+            if not os.path.isdir(cachedir):
+                os.makedirs(cachedir, exist_ok=True)
+            georeference = [dem_desc.extent.XMin, dem_desc.extent.YMin, dem_desc.meanCellWidth,
+                            dem_desc.meanCellHeight, dem_desc.spatialReference.name]
+            options = {"method": "native" if onarrays else "arcpy",   # native and tiled give the same grids
+                       "epsilon": float(SETTINGS.get("HYDRO_FILL_EPSILON", 0.0)) if onarrays else 0.0}
+            cachekey = HydroCacheKey(E, georeference, options, W)
+            cached = LoadHydroProducts(cachedir, cachekey, Stream_Value)
+            metrics.stop("hydro_cache")
+            metrics.count("cache_hits", int(cached is not None))
+            if cached is None:
+                arcpy.AddMessage("  DEM not in the hydrology cache " + cachedir)
+            else:
+                arcpy.AddMessage("  DEM found in the hydrology cache: " + cachekey)
+
+        if incremental:
+            # Update existing grids for the edited window only
+            arcpy.AddMessage( "Updating grids for the edited extent " + updateextent + " >>")
+            metrics.start("incremental_update")
+            overwrite = arcpy.env.overwriteOutput   # restored after the grids are replaced
+            arcpy.env.overwriteOutput = True
+            try:
+                dem_desc = arcpy.Describe(Input_surface_raster)
+                E = ReadDEMArray(Input_surface_raster)
+                window = ExtentWindow(updateextent, dem_desc, E.shape)
+                W = None
+                if weightname:
+                    W = ReadDEMArray(weightname)
+                    A = ReadGridArray(flacname, numpy.float64, numpy.nan)
+                else:
+                    A = ReadGridArray(flacname, numpy.uint32, FLAC_NODATA)
+                F, D, A, counts = IncrementalUpdate(E, ReadDEMArray(fillname), ReadGridArray(dirname, numpy.uint8, DIR_NODATA),
+                                                    A, window, float(SETTINGS.get("HYDRO_FILL_EPSILON", 0.0)), W)
+                SaveArray(F, fillname, dem_desc)
+                SaveArray(D, dirname, dem_desc, DIR_NODATA)
+                if weightname:
+                    SaveArray(A, flacname, dem_desc)
+                else:
+                    SaveArray(A, flacname, dem_desc, FLAC_NODATA)
+                S = (A > int(Stream_Value)).astype(numpy.uint8)
+                S[D == DIR_NODATA] = DIR_NODATA
+                SaveArray(S, strname, dem_desc, DIR_NODATA)
+                metrics.count("refilled_cells", counts["refilled"])
+                metrics.count("redirected_cells", counts["redirected"])
+                metrics.count("reaccumulated_cells", counts["reaccumulated"])
+            finally:
+                arcpy.env.overwriteOutput = overwrite
+            metrics.stop("incremental_update")
+            arcpy.AddMessage("  cells refilled: " + str(counts["refilled"]) + ", redirected: " + str(counts["redirected"]) +
+                             ", reaccumulated: " + str(counts["reaccumulated"]))
+            arcpy.AddMessage( "Updated Rasters: " + ", ".join(products + [strname]))
+        elif cached is not None:
+            # Copy the cached grids to this prefix
+            arcpy.AddMessage( "Copying grids from the hydrology cache >>")
+            metrics.start("cache_copy")
+            F = cached["fill"]
+            D = cached["dir"]
+            A = cached["flac"]
+            SaveArray(F, fillname, dem_desc)
+            SaveArray(D, dirname, dem_desc, DIR_NODATA)
+            if weightname:
+                SaveArray(A, flacname, dem_desc)
+            else:
+                SaveArray(A, flacname, dem_desc, FLAC_NODATA)
+            if "str" in cached:
+                S = cached["str"]
+            else:
+                S = (A > int(Stream_Value)).astype(numpy.uint8)
+                S[D == DIR_NODATA] = DIR_NODATA
+            SaveArray(S, strname, dem_desc, DIR_NODATA)
+            metrics.stop("cache_copy")
+            arcpy.AddMessage( "Created Rasters: " + ", ".join(products + [strname]))
+        else:
+            # Fill
+            arcpy.AddMessage( 'searching for sinks >>')
+            metrics.start("fill")
+            if onarrays:
+                dem_desc = arcpy.Describe(Input_surface_raster) # extent, cell size, coordinate system of outputs
+                epsilon = float(SETTINGS.get("HYDRO_FILL_EPSILON", 0.0))
+                if E is None:
+                    E = ReadDEMArray(Input_surface_raster)
+                if hydromethod == "tiled" and epsilon == 0:
+                    F = TiledFill(E, tilesize, workers)
+                else:
+                    if hydromethod == "tiled":
+                        arcpy.AddMessage("  HYDRO_FILL_EPSILON > 0: filling the whole DEM at once")
+                    F = PriorityFloodFill(E, epsilon)
+                SaveArray(F, fillname, dem_desc)
+            else:
+                tempa = Fill(Input_surface_raster)
+                tempa.save(fillname)
+            metrics.stop("fill")
+            arcpy.AddMessage( 'Created filled DEM: ' + fillname)
         
-        # Flow Direction
-        arcpy.AddMessage( "Calculating Flow Direction >>")    
-        tempa2 = FlowDirection(fillname)
-        tempa2.save(dirname)
-        arcpy.AddMessage( 'Created Raster: ' + dirname)
-
-        # Flow Accumulation    
-        arcpy.AddMessage( "Calculating Flow Accumulation >>")
-        tempa3 = FlowAccumulation(dirname, "", "INTEGER")
-        tempa3.save(flacname)
-        arcpy.AddMessage( 'Created Raster: ' + flacname)
-
-        # Applying stream threshold    
-        arcpy.AddMessage( "Calculating Streams >> ")
-        tempa4 = GreaterThan(flacname, int(Stream_Value))
-        tempa4.save(strname)
-        arcpy.AddMessage( "Created Raster: " + strname)
+            # Flow Direction
+            arcpy.AddMessage( "Calculating Flow Direction >>")    
+            metrics.start("flow_direction")
+            if hydromethod == "tiled":
+                D = TiledD8FlowDirection(F, tilesize, workers)
+                SaveArray(D, dirname, dem_desc, DIR_NODATA)
+            elif hydromethod == "native":
+                blockrows = int(SETTINGS.get("HYDRO_BLOCK_ROWS", 1024))
+                D = D8FlowDirection(F, blockrows)  # F: filled DEM still in memory
+                SaveArray(D, dirname, dem_desc, DIR_NODATA)
+            else:
+                tempa2 = FlowDirection(fillname)
+                tempa2.save(dirname)
+            metrics.stop("flow_direction")
+            arcpy.AddMessage( 'Created Raster: ' + dirname)
+
+            # Flow Accumulation    
+            arcpy.AddMessage( "Calculating Flow Accumulation >>")
+            metrics.start("flow_accumulation")
+            if onarrays:
+                if weightname and W is None:
+                    W = ReadDEMArray(weightname)
+                if hydromethod == "tiled":
+                    A = TiledFlowAccumulation(D, W, tilesize, workers)
+                else:
+                    A = NativeFlowAccumulation(D, W)
+                if weightname:
+                    SaveArray(A, flacname, dem_desc)
+                else:
+                    SaveArray(A, flacname, dem_desc, FLAC_NODATA)
+            elif weightname:
+                tempa3 = FlowAccumulation(dirname, weightname, "FLOAT")
+                tempa3.save(flacname)
+            else:
+                tempa3 = FlowAccumulation(dirname, "", "INTEGER")
+                tempa3.save(flacname)
+            metrics.stop("flow_accumulation")
+            arcpy.AddMessage( 'Created Raster: ' + flacname)
+
+            # Applying stream threshold    
+            arcpy.AddMessage( "Calculating Streams >> ")
+            metrics.start("streams")
+            if onarrays:
+                S = (A > int(Stream_Value)).astype(numpy.uint8)
+                S[D == DIR_NODATA] = DIR_NODATA
+                SaveArray(S, strname, dem_desc, DIR_NODATA)
+            else:
+                tempa4 = GreaterThan(flacname, int(Stream_Value))
+                tempa4.save(strname)
+            metrics.stop("streams")
+            arcpy.AddMessage( "Created Raster: " + strname)
+
+        WriteProductInfo(infoname, productinfo)
+
+        # Keep the grids in the hydrology cache
+        if usecache:
+            metrics.start("hydro_cache")
+            if cached is None:
+                if not onarrays:
+                    F = ReadDEMArray(fillname)
+                    D = ReadGridArray(dirname, numpy.uint8, DIR_NODATA)
+                    if weightname:
+                        A = ReadGridArray(flacname, numpy.float64, numpy.nan)
+                    else:
+                        A = ReadGridArray(flacname, numpy.uint32, FLAC_NODATA)
+                    S = ReadGridArray(strname, numpy.uint8, DIR_NODATA)
+                SaveHydroProducts(cachedir, cachekey, {"fill": F, "dir": D, "flac": A},
+                                  {"dem": Input_surface_raster, "prefix": PreName, "method": hydromethod})
+            if cached is None or "str" not in cached:
+                SaveStreamProduct(cachedir, cachekey, Stream_Value, S)
+            removed = PruneHydroCache(cachedir, float(SETTINGS.get("HYDRO_CACHE_MB", 10240)), cachekey)
+            metrics.stop("hydro_cache")
+            if removed:
+                arcpy.AddMessage("  removed " + str(len(removed)) + " least recently used entries from the hydrology cache")
+
+        # Stream graph saved next to the stream grid
+        if SETTINGS.get("STREAM_GRAPH", False):
+            metrics.start("stream_graph")
+            if not (incremental or onarrays or usecache):
+                S = ReadGridArray(strname, numpy.uint8, DIR_NODATA)
+                D = ReadGridArray(dirname, numpy.uint8, DIR_NODATA)
+            graph = BuildStreamGraph(S, D)
+            SaveStreamGraph(GraphFileName(strname), graph)
+            metrics.stop("stream_graph")
+            arcpy.AddMessage( "Created stream graph: " + GraphFileName(strname) + " (" + str(len(graph["segdown"])) + " segments)")
         
         arcpy.AddMessage( "Processing Complete.")
+        for aline in metrics.summary():
+            arcpy.AddMessage(aline)
+        metrics.writejson(textdir + PreName + "surface_hydro_metrics.json")
 
         arcpy.AddMessage( "")
     except:
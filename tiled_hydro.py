@@ -0,0 +1,458 @@
+# ---------------------------------------------------------------------------
+# tiled_hydro.py
+#
+# Usage: imported by surface_hydro.py, hydro_benchmark.py
+#
+#   This module computes the grids of native_hydro.py tile by tile in a pool
+#  of processes, for DEMs too large to condition on one core, and stitches
+#  the tiles so the result is the same as for the whole DEM.
+#  Fill: every tile is flooded from its own edge, and each tile edge cell
+#  labels the cells it floods (Barnes et al., 2014, parallel priority-flood).
+#  The labels touching each other, within a tile or across a tile edge, form
+#  a small graph whose spill elevations are found from the DEM edge inwards;
+#  a cell is then raised to the spill elevation of its label.
+#  Flow direction: the steepest descent of blocks of rows is computed in the
+#  pool, and flats are resolved over the whole DEM as in native_hydro.py.
+#  Flow accumulation: every tile accumulates its own cells and reports the
+#  totals of its edge cells and where they drain.  The flow passed between
+#  tiles is summed over the graph of edge cells, and the tiles accumulate
+#  again with the inflow they receive.
+# ---------------------------------------------------------------------------
+
+# Start Up - Import system modules
+import os
+import numpy
+from native_hydro import Compiled, HeapPush, HeapPop, EdgeCells, D8Block, ResolveFlats
+from native_hydro import DownstreamCells, TopologicalFrontiers, FlowAccumulation
+from native_hydro import NEIGHBOUR_ROWS, NEIGHBOUR_COLS, DIR_NODATA, FLAC_NODATA
+from process_pool import ProcessPool
+
+#===========================================================================
+#  Local Functions
+#===========================================================================
+
+def Tiles(shape, tilesize):
+    # =====================================
+    # Returns:  list of (row0, row1, col0, col1) covering the DEM
+    # =====================================
+    numrows, numcols = shape
+    tiles = []
+    for row0 in range(0, numrows, tilesize):
+        for col0 in range(0, numcols, tilesize):
+            tiles.append((row0, min(numrows, row0 + tilesize), col0, min(numcols, col0 + tilesize)))
+    return tiles
+
+def HaloWindow(array, tile, fill):
+    # =====================================
+    # Returns:  tile of array with a ring of one cell around it, fill
+    #           where the ring is outside the array
+    # =====================================
+    numrows, numcols = array.shape
+    row0, row1, col0, col1 = tile
+    halo = numpy.full((row1 - row0 + 2, col1 - col0 + 2), fill, dtype=array.dtype)
+    top = max(0, row0 - 1)
+    left = max(0, col0 - 1)
+    bottom = min(numrows, row1 + 1)
+    right = min(numcols, col1 + 1)
+    halo[top - row0 + 1:bottom - row0 + 1, left - col0 + 1:right - col0 + 1] = array[top:bottom, left:right]
+    return halo
+
+def RunTiles(func, jobs, workers):
+    # =====================================
+    # Parameters:
+    #   func:     function of this module run for every job
+    #   jobs:     list of argument tuples
+    #   workers:  number of processes; 1 runs in order
+    #
+    # The processes are started by process_pool.py with the Python of
+    # ArcGIS Pro.  They import this module and native_hydro.py (NumPy and
+    # numba only) to run func, so both must stay free of arcpy.
+    #
+    # Returns:  list of the results, in the order of jobs
+    # =====================================
+    if workers is None or workers <= 1 or len(jobs) <= 1:
+        return [func(*job) for job in jobs]
+    with ProcessPool(workers) as pool:
+        futures = [pool.submit(func, *job) for job in jobs]
+        return [future.result() for future in futures]
+
+def Workers(workers):
+    # 0 or None uses every core of the node
+    if not workers:
+        return os.cpu_count() or 1
+    return int(workers)
+
+#===========================================================================
+#  Fill
+#===========================================================================
+
+@Compiled
+def LabelFloodCells(z, closed, labels, seeds, numrows, numcols):
+    # =====================================
+    # Parameters:
+    #   z:        flat elevation array of the tile, filled in place
+    #   closed:   flat uint8 array, 1 for NoData cells, else 0
+    #   labels:   flat int32 array of zeros, set to the label of the
+    #             seed each cell is flooded from (labels start at 1)
+    #   seeds:    cell numbers of the tile edge cells
+    #   numrows, numcols:  shape of the tile
+    #
+    # Floods the tile flat from its edge as FloodCells does, and
+    # records the labels that touch each other
+    #
+    # Returns:  (label a, label b, elevation) of every contact, the
+    #           elevation being the higher of the two cells
+    # =====================================
+    size = 0
+    keys = numpy.empty(max(1024, 2 * seeds.shape[0]), dtype=z.dtype)
+    cells = numpy.empty(keys.shape[0], dtype=seeds.dtype)
+    for s in range(seeds.shape[0]):
+        closed[seeds[s]] = 1
+        keys, cells, size = HeapPush(keys, cells, size, z[seeds[s]], seeds[s])
+
+    count = 0
+    contacta = numpy.empty(max(1024, 4 * seeds.shape[0]), dtype=numpy.int32)
+    contactb = numpy.empty(contacta.shape[0], dtype=numpy.int32)
+    contactz = numpy.empty(contacta.shape[0], dtype=z.dtype)
+    nextlabel = 1
+    pit = numpy.empty(z.shape[0], dtype=seeds.dtype)
+    head = 0
+    tail = 0
+    while size > 0 or head < tail:
+        if head < tail:
+            c = pit[head]
+            head += 1
+        else:
+            c, size = HeapPop(keys, cells, size)
+        if labels[c] == 0:
+            labels[c] = nextlabel      # a seed starts its own label
+            nextlabel += 1
+        zc = z[c]
+        row = c // numcols
+        col = c - row * numcols
+        for k in range(8):
+            r = row + NEIGHBOUR_ROWS[k]
+            q = col + NEIGHBOUR_COLS[k]
+            if r < 0 or q < 0 or r >= numrows or q >= numcols:
+                continue
+            n = r * numcols + q
+            if closed[n]:
+                if labels[n] != 0 and labels[n] != labels[c]:
+                    if count == contacta.shape[0]:
+                        contacta = numpy.concatenate((contacta, numpy.empty_like(contacta)))
+                        contactb = numpy.concatenate((contactb, numpy.empty_like(contactb)))
+                        contactz = numpy.concatenate((contactz, numpy.empty_like(contactz)))
+                    contacta[count] = labels[c]
+                    contactb[count] = labels[n]
+                    contactz[count] = max(zc, z[n])
+                    count += 1
+                continue
+            closed[n] = 1
+            labels[n] = labels[c]
+            if z[n] <= zc:
+                z[n] = zc
+                pit[tail] = n
+                tail += 1
+            else:
+                keys, cells, size = HeapPush(keys, cells, size, z[n], n)
+    return contacta[:count], contactb[:count], contactz[:count]
+
+def FillTile(halo):
+    # =====================================
+    # Parameters:
+    #   halo:  tile of the DEM with a ring of one cell, nan outside
+    #
+    # Returns:  (tile filled from its own edge, int32 labels, contact
+    #           arrays a, b, z, labels of cells where water leaves the
+    #           whole DEM)
+    # =====================================
+    tile = numpy.array(halo[1:-1, 1:-1], copy=True)
+    numrows, numcols = tile.shape
+    valid = ~numpy.isnan(tile)
+    demedge = EdgeCells(~numpy.isnan(halo))[1:-1, 1:-1]
+    if numrows * numcols < 2 ** 31:
+        celltype = numpy.int32
+    else:
+        celltype = numpy.int64
+    z = tile.ravel()
+    closed = (~valid).ravel().astype(numpy.uint8)
+    labels = numpy.zeros(z.shape[0], dtype=numpy.int32)
+    seeds = numpy.flatnonzero(EdgeCells(valid)).astype(celltype)
+    a, b, contact = LabelFloodCells(z, closed, labels, seeds, numrows, numcols)
+    labels = labels.reshape(tile.shape)
+    outlets = numpy.unique(labels[demedge])
+    return tile, labels, a, b, contact, outlets
+
+@Compiled
+def SpillElevations(indptr, targets, heights, outlets, spill):
+    # =====================================
+    # Parameters:
+    #   indptr, targets, heights:  label graph in compressed rows
+    #   outlets:  labels where water leaves the DEM
+    #   spill:    float64 array of inf, set to the lowest elevation at
+    #             which each label drains to an outlet
+    # =====================================
+    size = 0
+    keys = numpy.empty(max(1024, 2 * outlets.shape[0]), dtype=numpy.float64)
+    cells = numpy.empty(keys.shape[0], dtype=numpy.int64)
+    for i in range(outlets.shape[0]):
+        spill[outlets[i]] = -numpy.inf
+        keys, cells, size = HeapPush(keys, cells, size, -numpy.inf, outlets[i])
+    done = numpy.zeros(spill.shape[0], dtype=numpy.uint8)
+    while size > 0:
+        node, size = HeapPop(keys, cells, size)
+        if done[node]:
+            continue
+        done[node] = 1
+        for e in range(indptr[node], indptr[node + 1]):
+            n = targets[e]
+            level = max(spill[node], heights[e])
+            if level < spill[n]:
+                spill[n] = level
+                keys, cells, size = HeapPush(keys, cells, size, level, n)
+
+def TiledFill(dem, tilesize=2048, workers=None):
+    # =====================================
+    # Parameters:
+    #   dem:       DEM array, NoData as nan
+    #   tilesize:  rows and columns of a tile
+    #   workers:   number of processes, 0 or None for every core
+    #
+    # Fills depressions flat (as PriorityFloodFill with epsilon 0)
+    #
+    # Returns:  filled array, NoData as nan
+    # =====================================
+    if not numpy.issubdtype(dem.dtype, numpy.floating):
+        dem = dem.astype(numpy.float64)
+    tiles = Tiles(dem.shape, tilesize)
+    results = RunTiles(FillTile, [(HaloWindow(dem, tile, numpy.nan),) for tile in tiles], Workers(workers))
+
+    # labels numbered over the whole DEM
+    filled = numpy.empty_like(dem)
+    labels = numpy.zeros(dem.shape, dtype=numpy.int64)
+    contacta = []
+    contactb = []
+    contactz = []
+    outlets = []
+    offset = 0
+    for tile, (z, tilelabels, a, b, contact, tileoutlets) in zip(tiles, results):
+        row0, row1, col0, col1 = tile
+        filled[row0:row1, col0:col1] = z
+        labels[row0:row1, col0:col1] = numpy.where(tilelabels > 0, tilelabels + offset, 0)
+        contacta.append(a + offset)
+        contactb.append(b + offset)
+        contactz.append(contact)
+        outlets.append(tileoutlets[tileoutlets > 0] + offset)
+        offset += int(tilelabels.max())
+
+    # labels touching across tile edges; edge cells are never raised
+    numrows, numcols = dem.shape
+    for row0 in sorted(set(tile[0] for tile in tiles))[1:]:
+        for dc in (-1, 0, 1):
+            c0 = max(0, -dc)
+            c1 = min(numcols, numcols - dc)
+            above = labels[row0 - 1, c0:c1]
+            below = labels[row0, c0 + dc:c1 + dc]
+            height = numpy.maximum(filled[row0 - 1, c0:c1], filled[row0, c0 + dc:c1 + dc])
+            keep = (above > 0) & (below > 0)
+            contacta.append(above[keep])
+            contactb.append(below[keep])
+            contactz.append(height[keep])
+    for col0 in sorted(set(tile[2] for tile in tiles))[1:]:
+        for dr in (-1, 0, 1):
+            r0 = max(0, -dr)
+            r1 = min(numrows, numrows - dr)
+            left = labels[r0:r1, col0 - 1]
+            right = labels[r0 + dr:r1 + dr, col0]
+            height = numpy.maximum(filled[r0:r1, col0 - 1], filled[r0 + dr:r1 + dr, col0])
+            keep = (left > 0) & (right > 0)
+            contacta.append(left[keep])
+            contactb.append(right[keep])
+            contactz.append(height[keep])
+
+    # spill elevation of every label, from the outlets inwards
+    a = numpy.concatenate(contacta).astype(numpy.int64)
+    b = numpy.concatenate(contactb).astype(numpy.int64)
+    height = numpy.concatenate(contactz).astype(numpy.float64)
+    sources = numpy.concatenate((a, b))
+    order = numpy.argsort(sources, kind="stable")
+    targets = numpy.concatenate((b, a))[order]
+    heights = numpy.concatenate((height, height))[order]
+    indptr = numpy.zeros(offset + 2, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(sources, minlength=offset + 1), out=indptr[1:])
+    spill = numpy.full(offset + 1, numpy.inf)
+    SpillElevations(indptr, targets, heights, numpy.concatenate(outlets).astype(numpy.int64), spill)
+    spill[numpy.isinf(spill)] = -numpy.inf
+
+    valid = labels > 0
+    filled[valid] = numpy.maximum(filled[valid], spill[labels[valid]].astype(filled.dtype))
+    return filled
+
+#===========================================================================
+#  Flow direction
+#===========================================================================
+
+def DirectionStrip(strip, row0, row1):
+    # steepest descent of rows row0:row1 of a strip holding one more row
+    # above and below where the DEM has them
+    return D8Block(strip, row0, row1)
+
+def TiledD8FlowDirection(dem, tilesize=2048, workers=None):
+    # =====================================
+    # Parameters:
+    #   dem:       DEM array (normally filled), NoData as nan
+    #   tilesize:  rows of a block
+    #   workers:   number of processes, 0 or None for every core
+    #
+    # Returns:  uint8 direction codes, the same as D8FlowDirection
+    # =====================================
+    numrows = dem.shape[0]
+    jobs = []
+    for row0 in range(0, numrows, tilesize):
+        row1 = min(numrows, row0 + tilesize)
+        top = max(0, row0 - 1)
+        jobs.append((dem[top:min(numrows, row1 + 1)], row0 - top, row1 - top))
+    codes = numpy.concatenate(RunTiles(DirectionStrip, jobs, Workers(workers)))
+    return ResolveFlats(dem, codes)
+
+#===========================================================================
+#  Flow accumulation
+#===========================================================================
+
+def TileEdge(shape):
+    # boolean array of the cells on the edge of a tile
+    edge = numpy.zeros(shape, dtype=bool)
+    edge[0, :] = True
+    edge[-1, :] = True
+    edge[:, 0] = True
+    edge[:, -1] = True
+    return edge
+
+def AccumulateTileEdges(codes, weight):
+    # =====================================
+    # Parameters:
+    #   codes:   direction codes of the tile
+    #   weight:  weight of the tile cells (0 on NoData)
+    #
+    # Accumulates the tile on its own
+    #
+    # Returns:  (tile cell numbers of the edge cells, their totals
+    #           including their own weight, the next edge cell each
+    #           drains to inside the tile, -1 for none)
+    # =====================================
+    down = DownstreamCells(codes)
+    edge = TileEdge(codes.shape).ravel()
+    total = FlowAccumulation(codes, weight).ravel() + weight.ravel()
+
+    # next edge cell downstream, from the outlets of the tile upwards
+    link = numpy.full(len(down), -1, dtype=numpy.int64)
+    donors = numpy.zeros(len(down), dtype=bool)
+    donors[down[down >= 0]] = True
+    start = numpy.flatnonzero(~donors & (codes.ravel() != DIR_NODATA))
+    frontiers = list(TopologicalFrontiers(down, start))
+    for frontier in reversed(frontiers):
+        target = down[frontier]
+        inside = target >= 0
+        cells = frontier[inside]
+        target = target[inside]
+        link[cells] = numpy.where(edge[target], target, link[target])
+
+    cells = numpy.flatnonzero(edge & (codes.ravel() != DIR_NODATA))
+    return cells, total[cells], link[cells]
+
+def AccumulateTile(codes, weight, inflow):
+    # =====================================
+    # Parameters:
+    #   codes:   direction codes of the tile
+    #   weight:  weight of the tile cells (0 on NoData)
+    #   inflow:  flow entering every tile cell from other tiles
+    #
+    # Returns:  float64 accumulation of the tile with the inflow
+    # =====================================
+    return FlowAccumulation(codes, weight + inflow) + inflow
+
+def TiledFlowAccumulation(codes, weight=None, tilesize=2048, workers=None):
+    # =====================================
+    # Parameters:
+    #   codes:     flow direction array (ESRI codes), DIR_NODATA on NoData
+    #   weight:    optional weight of every cell (nan counted as 0)
+    #   tilesize:  rows and columns of a tile
+    #   workers:   number of processes, 0 or None for every core
+    #
+    # Returns:  the same as FlowAccumulation
+    # =====================================
+    numrows, numcols = codes.shape
+    nodata = codes == DIR_NODATA
+    if weight is None:
+        weights = (~nodata).astype(numpy.float64)
+    else:
+        weights = numpy.nan_to_num(numpy.asarray(weight, dtype=numpy.float64))
+        weights[nodata] = 0
+    tiles = Tiles(codes.shape, tilesize)
+    workers = Workers(workers)
+    tileviews = [(codes[r0:r1, c0:c1], weights[r0:r1, c0:c1]) for r0, r1, c0, c1 in tiles]
+    results = RunTiles(AccumulateTileEdges, tileviews, workers)
+
+    # edge cells of all tiles, numbered over the DEM
+    nodes = []
+    totals = []
+    links = []
+    for (row0, row1, col0, col1), (cells, total, link) in zip(tiles, results):
+        width = col1 - col0
+        nodes.append((cells // width + row0) * numcols + cells % width + col0)
+        totals.append(total)
+        linked = link >= 0
+        link = numpy.where(linked, (link // width + row0) * numcols + link % width + col0, -1)
+        links.append(link)
+    nodes = numpy.concatenate(nodes)
+    totals = numpy.concatenate(totals)
+    links = numpy.concatenate(links)
+    order = numpy.argsort(nodes)
+    nodes = nodes[order]
+    totals = totals[order]
+    links = links[order]
+
+    # where each edge cell drains: the next edge cell of its own tile,
+    # or a cell of another tile it flows into directly
+    tilenumber = numpy.zeros(codes.shape, dtype=numpy.int64)
+    for t, (row0, row1, col0, col1) in enumerate(tiles):
+        tilenumber[row0:row1, col0:col1] = t
+    tilenumber = tilenumber.ravel()
+    down = DownstreamCells(codes)[nodes]
+    crosses = (down >= 0) & (tilenumber[numpy.maximum(down, 0)] != tilenumber[nodes])
+    successor = numpy.where(crosses, down, links)
+    nodedown = numpy.full(len(nodes), -1, dtype=numpy.int64)
+    has = successor >= 0
+    nodedown[has] = numpy.searchsorted(nodes, successor[has])
+
+    # flow from other tiles reaching every edge cell, upstream first
+    extra = numpy.zeros(len(nodes), dtype=numpy.float64)
+    donors = numpy.zeros(len(nodes), dtype=bool)
+    donors[nodedown[nodedown >= 0]] = True
+    for frontier in TopologicalFrontiers(nodedown, numpy.flatnonzero(~donors)):
+        target = nodedown[frontier]
+        keep = target >= 0
+        frontier = frontier[keep]
+        carried = extra[frontier] + numpy.where(crosses[frontier], totals[frontier], 0.0)
+        numpy.add.at(extra, target[keep], carried)
+
+    # inflow entering each tile, then the tiles accumulated again
+    inflow = numpy.zeros(numrows * numcols, dtype=numpy.float64)
+    numpy.add.at(inflow, down[crosses], totals[crosses] + extra[crosses])
+    inflow = inflow.reshape(codes.shape)
+    jobs = [(codes[r0:r1, c0:c1], weights[r0:r1, c0:c1], inflow[r0:r1, c0:c1]) for r0, r1, c0, c1 in tiles]
+    results = RunTiles(AccumulateTile, jobs, workers)
+
+    if weight is None:
+        accumulation = numpy.empty(codes.shape, dtype=numpy.uint32)
+    else:
+        accumulation = numpy.empty(codes.shape, dtype=numpy.float64)
+    for (row0, row1, col0, col1), total in zip(tiles, results):
+        if weight is None:
+            total = numpy.rint(numpy.nan_to_num(total)).astype(numpy.uint32)
+        accumulation[row0:row1, col0:col1] = total
+    if weight is None:
+        accumulation[nodata] = FLAC_NODATA
+    else:
+        accumulation[nodata] = numpy.nan
+    return accumulation
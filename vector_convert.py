@@ -0,0 +1,147 @@
+# ---------------------------------------------------------------------------
+# vector_convert.py
+#
+# Usage: imported by raster_to_shapefile.py
+#
+#   This module converts one raster into a polygon shapefile with
+#  native_vector.py, for raster_to_shapefile.py and for the processes of its
+#  batches.  The processes of a pool import the module of the function they
+#  run by name (process_pool.py), so ConvertRaster lives here rather than in
+#  the tool script, and arcpy is only imported when a raster that is not an
+#  ESRI ASCII grid is read or RasterToPolygon is asked for.
+# ---------------------------------------------------------------------------
+
+# Start Up - Import system modules
+import os, time
+from native_vector import VectorizeRaster, VectorizeLevels, MapCoordinates, ReadAsciiGrid
+from native_vector import WriteShapefile, WriteGeoJSON, WriteTopoJSON
+
+#===========================================================================
+#  Local Functions
+#===========================================================================
+
+def LoadArcpy():
+    # arcpy, imported on first use; None if it is not installed
+    try:
+        import arcpy
+    except ImportError:
+        return None
+    return arcpy
+
+def ReadLabelRaster(rastername):
+    # =====================================
+    # Parameters:
+    #   rastername:  raster of volumes, or an ESRI ASCII grid (.asc)
+    #
+    # Returns:  (array, NoData value or None, xmin, ymax, cell width,
+    #           cell height, WKT of the coordinate system)
+    # =====================================
+    arcpy = None
+    if not rastername.lower().endswith(".asc"):
+        arcpy = LoadArcpy()
+    if arcpy is None:
+        values, nodata, xmin, ymax, cellsize, wkt = ReadAsciiGrid(rastername)
+        return values, nodata, xmin, ymax, cellsize, cellsize, wkt
+    raster = arcpy.Raster(rastername)
+    desc = arcpy.Describe(rastername)
+    A = arcpy.RasterToNumPyArray(raster)
+    return (A, raster.noDataValue, desc.extent.XMin, desc.extent.YMax, desc.meanCellWidth, desc.meanCellHeight,
+            desc.spatialReference.exportToString())
+
+def NativeConversion(rastername, outPolygons, tolerance, geojson):
+    # =====================================
+    # Parameters:
+    #   rastername:   raster to convert
+    #   outPolygons:  shapefile written
+    #   tolerance:    simplification distance in map units, 0 for none
+    #   geojson:      True to write a .geojson next to the shapefile
+    #
+    # Returns:  (polygons of VectorizeRaster, number of vertices
+    #           written, area of a cell)
+    # =====================================
+    values, nodata, xmin, ymax, cellwidth, cellheight, wkt = ReadLabelRaster(rastername)
+    polygons = VectorizeRaster(values, nodata, tolerance / cellwidth)
+    shapes = [MapCoordinates(polygon["rings"], xmin, ymax, cellwidth, cellheight) for polygon in polygons]
+    fields = [("Id", "N", 9, 0), ("gridcode", "N", 9, 0)]
+    records = [[number + 1, int(polygon["value"])] for number, polygon in enumerate(polygons)]
+    WriteShapefile(outPolygons, shapes, fields, records, wkt)
+    if geojson:
+        WriteGeoJSON(os.path.splitext(outPolygons)[0] + ".geojson", shapes, fields, records)
+    vertices = sum(len(ring) for rings in shapes for ring in rings)
+    return polygons, vertices, cellwidth * cellheight
+
+def NestedConversion(rastername, outPolygons, tolerance, background, geojson):
+    # =====================================
+    # Parameters:
+    #   rastername:   raster of nested zones to convert
+    #   outPolygons:  shapefile written; <name>.topojson next to it
+    #   tolerance:    simplification distance in map units, 0 for none
+    #   background:   raster value of the cells outside every zone
+    #   geojson:      True to write a .geojson next to the shapefile
+    #
+    # Returns:  (polygons of VectorizeLevels, number of vertices
+    #           written, dictionary zone value -> area)
+    # =====================================
+    values, nodata, xmin, ymax, cellwidth, cellheight, wkt = ReadLabelRaster(rastername)
+    polygons, lines = VectorizeLevels(values, nodata, background, tolerance / cellwidth)
+    cellarea = cellwidth * cellheight
+    zoneareas = {}
+    for polygon in polygons:
+        zone = int(polygon["value"])
+        zoneareas[zone] = zoneareas.get(zone, 0.0) + polygon["cells"] * cellarea
+    shapes = [MapCoordinates(polygon["rings"], xmin, ymax, cellwidth, cellheight) for polygon in polygons]
+    fields = [("Id", "N", 9, 0), ("gridcode", "N", 9, 0), ("AREA", "N", 19, 3), ("ZONEAREA", "N", 19, 3)]
+    records = [[number + 1, int(polygon["value"]), polygon["cells"] * cellarea, zoneareas[int(polygon["value"])]]
+               for number, polygon in enumerate(polygons)]
+    WriteShapefile(outPolygons, shapes, fields, records, wkt)
+    if geojson:
+        WriteGeoJSON(os.path.splitext(outPolygons)[0] + ".geojson", shapes, fields, records)
+    layers = {}
+    for polygon, record in zip(polygons, records):
+        layers.setdefault("zone_" + str(record[1]), []).append((polygon["arcs"], dict(zip([field[0] for field in fields], record))))
+    WriteTopoJSON(os.path.splitext(outPolygons)[0] + ".topojson", lines, layers, values.shape[0], xmin, ymax, cellwidth, cellheight)
+    vertices = sum(len(ring) for rings in shapes for ring in rings)
+    return polygons, vertices, zoneareas
+
+#===========================================================================
+#  Conversion of one raster of a batch
+#===========================================================================
+
+def ConvertRaster(inRaster, outPolygons, options):
+    # =====================================
+    # Parameters:
+    #   inRaster:     raster to convert
+    #   outPolygons:  shapefile written
+    #   options:      dictionary method, tolerance, nested, background,
+    #                 geojson
+    #
+    # Converts one raster of a batch, in this process or in a process
+    # of the pool
+    #
+    # Returns:  dictionary of the manifest entry: raster, output, status
+    #           ("converted" or "failed"), seconds, cpu, and polygons and
+    #           vertices, or error
+    # =====================================
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    entry = {"raster": inRaster, "output": outPolygons}
+    try:
+        if options["nested"]:
+            polygons, vertices, zoneareas = NestedConversion(inRaster, outPolygons, options["tolerance"],
+                                                             options["background"], options["geojson"])
+            entry["zoneareas"] = {str(zone): zoneareas[zone] for zone in sorted(zoneareas)}
+        elif options["method"] == "native":
+            polygons, vertices, cellarea = NativeConversion(inRaster, outPolygons, options["tolerance"], options["geojson"])
+        else:
+            LoadArcpy().RasterToPolygon_conversion(inRaster, outPolygons, "NO_SIMPLIFY", "VALUE")
+            polygons = None
+        entry["status"] = "converted"
+        if polygons is not None:
+            entry["polygons"] = len(polygons)
+            entry["vertices"] = vertices
+    except Exception as error:
+        entry["status"] = "failed"
+        entry["error"] = type(error).__name__ + ": " + str(error)
+    entry["seconds"] = round(time.perf_counter() - wall, 3)
+    entry["cpu"] = round(time.process_time() - cpu, 3)
+    return entry